@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# Zoplete load benchmark against a synthetic cluster; no real Kubernetes needed.
+#
+#   python bench/bench.py                      # run, print p50/p99/throughput, compare to baseline.json
+#   python bench/bench.py --nodes 3000 --concurrency 16 --duration 20
+#   python bench/bench.py --update-baseline    # store this run as the new baseline
+#
+# It boots a fake kube-apiserver (lists, watches, CRDs, APIServices and metrics.k8s.io for N
+# nodes and their pods, M HelmReleases, GitRepositories and Kustomizations), puts stub `kubectl` and `flux`
+# binaries that read from it on PATH, starts zoplete.py against both, and drives the list
+# endpoints with a concurrent load generator. Exits 1 when an endpoint regresses beyond
+# --tolerance against the baseline.
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import tempfile
+import shutil
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ZOPLETE = os.path.join(BENCH_DIR, "..", "zoplete.py")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+ENDPOINTS = ["/api/nodes", "/api/nodes?limit=200", "/api/marketplace", "/api/metrics", "/api/metrics/workloads", "/api/capacity", "/api/git-sources", "/api/kustomizations"]
+CATALOG_KEYS = ["kafka", "kouncil", "jupyterhub", "nifi", "trino", "airflow"]
+FLUX_GROUPS = {"gitrepositories": "source.toolkit.fluxcd.io/v1", "kustomizations": "kustomize.toolkit.fluxcd.io/v1",
+               "helmreleases": "helm.toolkit.fluxcd.io/v2"}
+
+# --- SYNTHETIC CLUSTER ---
+def condition(ready):
+    return {"type": "Ready", "status": "True" if ready else "False", "reason": "Succeeded" if ready else "Failed"}
+
+class SyntheticCluster:
+    def __init__(self, nodes, releases, gitrepos, kustomizations, pods=0, seed=1):
+        rnd = random.Random(seed)
+        self.resource_version = 1000
+        self.nodes = []
+        for i in range(nodes):
+            labels = {"kubernetes.io/hostname": f"node-{i:05d}"}
+            if i < 3: labels["node-role.kubernetes.io/control-plane"] = ""
+            cpu, mem_gib = rnd.choice([2, 4, 8, 16, 32]), rnd.choice([4, 8, 16, 32, 64])
+            self.nodes.append({
+                "metadata": {"name": f"node-{i:05d}", "uid": f"uid-node-{i}", "resourceVersion": str(1000 + i), "labels": labels},
+                "status": {"capacity": {"cpu": str(cpu), "memory": f"{mem_gib * 1024 * 1024}Ki"},
+                           "allocatable": {"cpu": f"{cpu * 1000 - 100}m", "memory": f"{mem_gib * 1024 - 512}Mi"},
+                           "conditions": [{"type": "Ready", "status": "True" if rnd.random() > 0.02 else "False"}],
+                           "addresses": [{"type": "InternalIP", "address": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"}]}})
+        names = CATALOG_KEYS[:min(releases, len(CATALOG_KEYS))] + [f"release-{i:04d}" for i in range(max(releases - len(CATALOG_KEYS), 0))]
+        self.helmreleases = [{"apiVersion": "helm.toolkit.fluxcd.io/v2", "kind": "HelmRelease",
+                              "metadata": {"name": name, "namespace": "flux-system"},
+                              "spec": {"chart": {"spec": {"chart": name, "version": "1.0.0"}}},
+                              "status": {"conditions": [condition(rnd.random() > 0.1)]}} for name in names]
+        self.services = [{"metadata": {"name": svc, "namespace": "default"}, "spec": {"ports": [{"port": 80, "nodePort": 30000 + i}]}}
+                         for i, svc in enumerate(["kouncil", "proxy-public", "nifi", "trino", "airflow-webserver"])]
+        self.gitrepositories = [{"apiVersion": "source.toolkit.fluxcd.io/v1", "kind": "GitRepository",
+                                 "metadata": {"name": f"repo-{i:04d}", "namespace": "flux-system"},
+                                 "spec": {"url": f"https://git.example.com/team/repo-{i:04d}.git", "ref": {"branch": "main"}},
+                                 "status": {"conditions": [condition(rnd.random() > 0.1)]}} for i in range(gitrepos)]
+        self.kustomizations = [{"apiVersion": "kustomize.toolkit.fluxcd.io/v1", "kind": "Kustomization",
+                                "metadata": {"name": f"kust-{i:04d}", "namespace": "flux-system"},
+                                "spec": {"path": f"./clusters/prod/app-{i:04d}", "sourceRef": {"kind": "GitRepository", "name": f"repo-{i % max(gitrepos, 1):04d}"}},
+                                "status": {"lastAppliedRevision": f"main@sha1:{rnd.getrandbits(160):040x}", "conditions": [condition(rnd.random() > 0.1)]}}
+                               for i in range(kustomizations)]
+        self.pods = [{"metadata": {"name": f"pod-{i:06d}", "namespace": f"team-{i % 25:02d}", "uid": f"uid-pod-{i}",
+                               "labels": {"app.kubernetes.io/instance": names[i % len(names)]} if names and i % 3 else {}},
+                      "spec": {"nodeName": f"node-{i % max(nodes, 1):05d}", "containers": [
+                          {"name": "main", "resources": {"requests": {"cpu": "100m", "memory": "128Mi"}, "limits": {"cpu": "500m", "memory": "256Mi"}}},
+                          {"name": "sidecar", "resources": {"requests": {"cpu": "10m", "memory": "16Mi"}}}]},
+                      "status": {"phase": "Running"}} for i in range(pods)]
+        self._rnd = rnd
+
+    def node_metrics(self):
+        # Fresh usage on every scrape, like metrics-server
+        rnd = self._rnd
+        return [{"metadata": {"name": n["metadata"]["name"]}, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "window": "10s",
+                 "usage": {"cpu": f"{rnd.randint(50, 4000) * 1000000}n", "memory": f"{rnd.randint(512, 16384) * 1024}Ki"}}
+                for n in self.nodes]
+
+    def pod_metrics(self):
+        rnd = self._rnd
+        return [{"metadata": {"name": p["metadata"]["name"], "namespace": p["metadata"]["namespace"]}, "window": "10s",
+                 "containers": [{"name": c["name"], "usage": {"cpu": f"{rnd.randint(1, 900) * 1000000}n", "memory": f"{rnd.randint(8, 2048) * 1024}Ki"}}
+                                for c in p["spec"]["containers"]]} for p in self.pods]
+
+    def lists(self):
+        # Path -> list items, for every collection the fake API server answers
+        return {
+            "/api/v1/nodes": lambda: self.nodes,
+            "/apis/metrics.k8s.io/v1beta1/nodes": self.node_metrics,
+            "/api/v1/pods": lambda: self.pods,
+            "/apis/metrics.k8s.io/v1beta1/pods": self.pod_metrics,
+            "/apis/helm.toolkit.fluxcd.io/v2/namespaces/flux-system/helmreleases": lambda: self.helmreleases,
+            "/apis/helm.toolkit.fluxcd.io/v2/helmreleases": lambda: self.helmreleases,
+            "/api/v1/namespaces/default/services": lambda: self.services,
+            "/apis/source.toolkit.fluxcd.io/v1/gitrepositories": lambda: self.gitrepositories,
+            "/apis/kustomize.toolkit.fluxcd.io/v1/kustomizations": lambda: self.kustomizations,
+        }
+
+# --- FAKE API SERVER ---
+class FakeApiServer:
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.lists = cluster.lists()
+        self.requests = {}
+        self.stopping = threading.Event()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+            def do_GET(self): fake.handle(self)
+            def do_PATCH(self): fake.respond(self, 200, {"kind": "Status", "status": "Success"})
+            def do_POST(self): fake.respond(self, 201, {"kind": "Status", "status": "Success"})
+            def do_DELETE(self): fake.respond(self, 200, {"kind": "Status", "status": "Success"})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-apiserver", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+
+    def respond(self, handler, status, body):
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/")
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if path in self.lists:
+            if query.get("watch", ["false"])[0] == "true": return self.watch(handler, int(query.get("timeoutSeconds", ["30"])[0]))
+            return self.respond(handler, 200, {"kind": "List", "apiVersion": "v1", "items": self.lists[path](),
+                                               "metadata": {"resourceVersion": str(self.cluster.resource_version)}})
+        if path.startswith("/apis/apiextensions.k8s.io/v1/customresourcedefinitions/"):
+            return self.respond(handler, 200, {"kind": "CustomResourceDefinition", "metadata": {"name": path.rsplit("/", 1)[1]}})
+        if path.startswith("/apis/apiregistration.k8s.io/v1/apiservices/"):
+            return self.respond(handler, 200, {"kind": "APIService", "metadata": {"name": path.rsplit("/", 1)[1]},
+                                               "status": {"conditions": [{"type": "Available", "status": "True"}]}})
+        self.respond(handler, 404, {"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404, "message": f"{path} not found"})
+
+    def watch(self, handler, timeout):
+        # A quiet cluster: headers, then nothing until the timeout (or shutdown) ends the stream
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.wfile.flush()
+        self.stopping.wait(min(timeout, 60))
+        handler.close_connection = True
+
+# --- STUB BINARIES ---
+KUBECTL_STUB = r'''#!PYTHON
+# Stub kubectl for the benchmark: `get <resource> -A -o json` reads from the fake API server
+import os, sys, json, urllib.request
+GROUPS = GROUPS_JSON
+args = [a for a in sys.argv[1:] if a not in ("-A", "--all-namespaces")]
+if args[:1] == ["get"] and len(args) > 1:
+    resource = args[1].split(".")[0]
+    prefix = "/apis/" + GROUPS[resource] if resource in GROUPS else "/api/v1"
+    sys.stdout.write(urllib.request.urlopen(os.environ["FAKE_APISERVER"] + prefix + "/" + resource).read().decode())
+else:
+    print("ok")
+'''
+
+FLUX_STUB = r'''#!PYTHON
+# Stub flux for the benchmark
+import sys
+print("flux: v2.3.0" if sys.argv[1:2] == ["version"] else "ok")
+'''
+
+def write_stubs(directory, apiserver_url):
+    paths = {}
+    for name, source in (("kubectl", KUBECTL_STUB), ("flux", FLUX_STUB)):
+        path = paths[name] = os.path.join(directory, name)
+        with open(path, "w") as f: f.write(source.replace("PYTHON", sys.executable).replace("GROUPS_JSON", json.dumps(FLUX_GROUPS)))
+        os.chmod(path, 0o755)
+    kubeconfig = os.path.join(directory, "kubeconfig")
+    with open(kubeconfig, "w") as f:
+        json.dump({"apiVersion": "v1", "kind": "Config", "current-context": "bench",
+                   "clusters": [{"name": "bench", "cluster": {"server": apiserver_url}}],
+                   "users": [{"name": "bench", "user": {"token": "bench"}}],
+                   "contexts": [{"name": "bench", "context": {"cluster": "bench", "user": "bench"}}]}, f)
+    return kubeconfig
+
+# --- ZOPLETE UNDER TEST ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def get(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as resp: return resp.status, resp.read()
+
+def log_tail(path, lines=20):
+    # The workdir is removed on exit, so failures quote the log instead of pointing at it
+    with open(path) as f: return "".join(f.readlines()[-lines:])
+
+def start_zoplete(workdir, kubeconfig, apiserver_url, threads):
+    port = free_port()
+    env = dict(os.environ, PATH=workdir + os.pathsep + os.environ.get("PATH", ""), FAKE_APISERVER=apiserver_url, ZOPLETE_KUBECONFIG=kubeconfig,
+               ZOPLETE_JOBS_DIR=os.path.join(workdir, "jobs"), ZOPLETE_BOOTSTRAP_DIR=os.path.join(workdir, "bootstrap"),
+               ZOPLETE_ARTIFACTS_DIR=os.path.join(workdir, "artifacts"), ZOPLETE_VENDOR_DIR=os.path.join(workdir, "vendor"),
+               ZOPLETE_TSDB_DIR=os.path.join(workdir, "tsdb"))
+    log = open(os.path.join(workdir, "zoplete.log"), "w")
+    proc = subprocess.Popen([sys.executable, ZOPLETE, "--host", "127.0.0.1", "--port", str(port), "--threads", str(threads)],
+                            env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None: raise RuntimeError(f"zoplete exited with {proc.returncode}:\n{log_tail(log.name)}")
+        try:
+            get(base + "/api/jobs", timeout=2)
+            return proc, base
+        except (OSError, urllib.error.URLError): time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"zoplete did not come up:\n{log_tail(log.name)}")
+
+def warm_up(base, nodes):
+    # Wait for the node informer to hold the whole synthetic cluster and for a metrics tick
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if len(json.loads(get(base + "/api/nodes")[1])) >= nodes and json.loads(get(base + "/api/metrics")[1]).get("metrics"): return
+        time.sleep(0.5)
+    raise RuntimeError("zoplete did not sync the synthetic cluster within 60s")
+
+# --- LOAD GENERATOR ---
+def percentile(values, q):
+    # Nearest rank, same as zoplete's summarize()
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+def load(url, concurrency, duration):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        nonlocal errors
+        mine, failed = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = get(url)
+                if status != 200: failed += 1
+            except (OSError, urllib.error.URLError): failed += 1
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+    return {"requests": len(latencies), "errors": errors, "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2), "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)}
+
+def compare(results, baseline, tolerance):
+    # A regression is a p99 above, or a throughput below, the baseline by more than tolerance
+    failures = []
+    for endpoint, r in results.items():
+        base = baseline.get("results", {}).get(endpoint)
+        if not base: continue
+        if r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            failures.append(f"{endpoint}: p99 {r['p99_ms']}ms > baseline {base['p99_ms']}ms +{tolerance:.0%}")
+        if r["rps"] < base["rps"] * (1 - tolerance):
+            failures.append(f"{endpoint}: {r['rps']} req/s < baseline {base['rps']} req/s -{tolerance:.0%}")
+        if r["errors"] > base.get("errors", 0):
+            failures.append(f"{endpoint}: {r['errors']} errors (baseline {base.get('errors', 0)})")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark zoplete against a synthetic cluster")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--releases", type=int, default=50)
+    parser.add_argument("--gitrepos", type=int, default=200)
+    parser.add_argument("--kustomizations", type=int, default=200)
+    parser.add_argument("--pods", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load per endpoint")
+    parser.add_argument("--threads", type=int, default=16, help="zoplete --threads")
+    parser.add_argument("--endpoints", nargs="*", default=ENDPOINTS)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative regression (runs on a shared machine vary by ~30%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args()
+    cluster_config = {k: getattr(args, k) for k in ("nodes", "releases", "gitrepos", "kustomizations", "pods", "concurrency", "duration", "threads")}
+
+    cluster = SyntheticCluster(args.nodes, args.releases, args.gitrepos, args.kustomizations, args.pods)
+    apiserver = FakeApiServer(cluster).start()
+    workdir = tempfile.mkdtemp(prefix="zoplete-bench-")
+    proc = None
+    try:
+        kubeconfig = write_stubs(workdir, apiserver.url)
+        proc, base = start_zoplete(workdir, kubeconfig, apiserver.url, args.threads)
+        warm_up(base, args.nodes)
+        results = {}
+        print(f"{'endpoint':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for endpoint in args.endpoints:
+            r = results[endpoint] = load(base + endpoint, args.concurrency, args.duration)
+            print(f"{endpoint:<24}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}")
+    finally:
+        if proc:
+            proc.terminate()
+            try: proc.wait(timeout=30)
+            except subprocess.TimeoutExpired: proc.kill()
+        apiserver.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"config": cluster_config, "results": results, "apiserver_requests": apiserver.requests}
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f: json.dump({"config": cluster_config, "results": results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (run with --update-baseline)")
+        return 0
+    with open(args.baseline) as f: baseline = json.load(f)
+    if baseline.get("config") != cluster_config:
+        print(f"Warning: baseline was recorded with {baseline.get('config')}")
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures: print(f"REGRESSION {failure}")
+    print("OK: no regressions against baseline" if not failures else f"{len(failures)} regression(s)")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
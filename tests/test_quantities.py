@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+import pytest
+
+from zoplete import parse_quantity, resource_pair
+
+
+@pytest.mark.parametrize("quantity, expected", [
+    ("1Ei", 2**60),
+    ("1E", 10**18),
+    ("1e3", 1000),
+    ("1E3", 1000),
+    ("129e6", 129000000),
+    ("2e-3", Decimal("0.002")),
+    ("250m", Decimal("0.25")),
+    ("3500000n", Decimal("0.0035")),
+    ("100u", Decimal("0.0001")),
+    ("1.5Gi", 3 * 2**29),
+    ("64Mi", 64 * 2**20),
+    ("16364296Ki", 16364296 * 2**10),
+    ("1k", 1000),
+    ("128974848", 128974848),
+    (4, 4),
+])
+def test_parse_quantity(quantity, expected):
+    assert parse_quantity(quantity) == expected
+
+
+@pytest.mark.parametrize("quantity", ["", "abc", "1Kb", "1.2.3", "1e", "1Ee3", "Gi"])
+def test_parse_quantity_rejects(quantity):
+    with pytest.raises(ValueError):
+        parse_quantity(quantity)
+
+
+def test_resource_pair_rounds_up_exactly():
+    assert resource_pair({"cpu": "0.3", "memory": "1Gi"}) == (300, 2**30)
+    assert resource_pair({"cpu": "1500000n"}) == (2, 0)
+    assert resource_pair(None) == (0, 0)
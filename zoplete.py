@@ -3,16 +3,70 @@ import re
 import time
 import yaml
 import socket
+import selectors
 import psutil
 import datetime
 import subprocess
 import threading
 import json
-from flask import Flask, Response, request, jsonify, stream_with_context
+import shlex
+import io
+import tarfile
+import functools
+import hashlib
+import uuid
+import signal
+import tempfile
+import gzip
+import argparse
+import urllib.request
+import base64
+import binascii
+import bisect
+import heapq
+import math
+import mmap
+import struct
+import shutil
+import sys
+import hmac
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import deque, OrderedDict
+from decimal import Decimal
+from urllib.parse import urlsplit, quote, unquote
+from flask import Flask, Response, request, jsonify, stream_with_context, send_from_directory, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 from kubernetes import client, config
+from kubernetes.watch.watch import iter_resp_lines
+
+try: import brotli  # optional: adds br alongside gzip for static assets
+except ImportError: brotli = None
 
 # --- CONFIGURATION ---
 app = Flask(__name__)
+KUBECONFIG_PATH = os.environ.get("ZOPLETE_KUBECONFIG", "/etc/kubernetes/admin.conf")
+KUBE_POOL_SIZE = int(os.environ.get("ZOPLETE_KUBE_POOL_SIZE", "16"))
+JOBS_DIR = os.environ.get("ZOPLETE_JOBS_DIR", "/var/lib/zoplete/jobs")
+BOOTSTRAP_STATE_DIR = os.environ.get("ZOPLETE_BOOTSTRAP_DIR", "/var/lib/zoplete/bootstrap")
+ARTIFACTS_DIR = os.environ.get("ZOPLETE_ARTIFACTS_DIR", "/var/lib/zoplete/artifacts")
+ARTIFACTS_URL = os.environ.get("ZOPLETE_ARTIFACTS_URL", "")  # default: this server's address, see artifacts_base_url
+SERVER_ADDRESS = None  # (host, port) this process listens on, set at startup
+JOB_WORKERS = int(os.environ.get("ZOPLETE_JOB_WORKERS", "4"))
+SSH_BINARY = os.environ.get("ZOPLETE_SSH", "ssh")
+SSH_KNOWN_HOSTS = os.environ.get("ZOPLETE_SSH_KNOWN_HOSTS", "")
+SSH_KEY = os.environ.get("ZOPLETE_SSH_KEY", "")
+METRICS_INTERVAL = float(os.environ.get("ZOPLETE_METRICS_INTERVAL", "2"))
+METRICS_HISTORY_SECONDS = int(os.environ.get("ZOPLETE_METRICS_HISTORY", "900"))
+TSDB_DIR = os.environ.get("ZOPLETE_TSDB_DIR", "/var/lib/zoplete/tsdb")
+TSDB_RAW_HOURS = float(os.environ.get("ZOPLETE_TSDB_RAW_HOURS", "6"))
+TSDB_MINUTE_DAYS = float(os.environ.get("ZOPLETE_TSDB_MINUTE_DAYS", "14"))
+TSDB_HOUR_DAYS = float(os.environ.get("ZOPLETE_TSDB_HOUR_DAYS", "400"))
+HOST_FACTS_TTL = int(os.environ.get("ZOPLETE_HOST_FACTS_TTL", "300"))
+ADMIN_TOKEN = os.environ.get("ZOPLETE_ADMIN_TOKEN")  # unset: admin endpoints are disabled
+VENDOR_DIR = os.environ.get("ZOPLETE_VENDOR_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendor"))
 
 # --- FRONTEND TEMPLATE (Material Design 3) ---
 HTML_TEMPLATE = r"""
@@ -71,6 +125,9 @@ HTML_TEMPLATE = r"""
         table { width: 100%; border-collapse: collapse; font-size: 14px; }
         th { text-align: left; padding: 12px; background: var(--md-sys-color-surface-variant); border-radius: 4px; }
         td { padding: 12px; border-bottom: 1px solid #eee; }
+        #node-table thead th { position: sticky; top: 0; z-index: 1; }
+        #node-table th[data-sort] { cursor: pointer; }
+        #node-table td { white-space: nowrap; }
         .chip { padding: 4px 12px; border-radius: 8px; font-size: 12px; font-weight: 500; }
         .chip-success { background: #e6f4ea; color: #137333; }
         .chip-warning { background: #fef7e0; color: #ea8600; }
@@ -140,14 +197,25 @@ HTML_TEMPLATE = r"""
                     <h2>Cluster Nodes</h2>
                     <button class="btn btn-tonal" onclick="loadNodes()"><span class="material-symbols-outlined">refresh</span> Refresh</button>
                 </div>
-                <div style="border: 1px solid #ddd; border-radius: 12px; overflow: hidden;">
+                <div id="capacity-summary" class="card" style="display:none; margin-bottom:16px;"></div>
+                <div style="display:flex; gap: 12px; margin-bottom: 12px;">
+                    <input type="text" id="node-search" placeholder="Search by name prefix" oninput="loadNodes()" style="flex:1; padding:8px; border-radius:8px; border:1px solid #ccc;">
+                    <select id="node-status-filter" onchange="loadNodes()" style="padding:8px; border-radius:8px; border:1px solid #ccc;">
+                        <option value="">All Statuses</option><option value="Ready">Ready</option><option value="NotReady">NotReady</option>
+                    </select>
+                    <select id="node-role-filter" onchange="loadNodes()" style="padding:8px; border-radius:8px; border:1px solid #ccc;">
+                        <option value="">All Roles</option><option value="Master">Master</option><option value="Worker">Worker</option>
+                    </select>
+                </div>
+                <div id="node-scroll" style="border: 1px solid #ddd; border-radius: 12px; overflow-y: auto; max-height: 560px;">
                     <table id="node-table">
                         <thead>
-                            <tr><th>Name</th><th>Role</th><th>Status</th><th>IP</th><th>CPU</th><th>RAM</th><th>Action</th></tr>
+                            <tr><th data-sort="name">Name</th><th data-sort="role">Role</th><th data-sort="status">Status</th><th>IP</th><th data-sort="cpu">CPU</th><th data-sort="memory">RAM</th><th>Action</th></tr>
                         </thead>
                         <tbody></tbody>
                     </table>
                 </div>
+                <div id="node-count" style="font-size:12px; color:#666; margin-top:6px;"></div>
 
                 <div class="card" style="margin-top: 24px;">
                     <h3>Add Worker Nodes</h3>
@@ -161,6 +229,23 @@ HTML_TEMPLATE = r"""
                         <button class="btn btn-tonal" onclick="downloadScript('sh')">Download Bash Script</button>
                         <button class="btn btn-tonal" onclick="downloadScript('yaml')">Download Cloud-Init</button>
                     </div>
+                    <div style="display:flex; gap: 12px; margin-top: 12px; align-items:center;">
+                        <input type="text" id="worker-hosts" placeholder="Hostnames (comma separated) or a count, e.g. 20" style="flex:1; padding:8px; border-radius:8px; border:1px solid #ccc;">
+                        <button class="btn btn-tonal" onclick="downloadBundle()">Download Bundle (.tar.gz)</button>
+                    </div>
+
+                    <h4 style="margin-bottom:8px;">Bootstrap over SSH</h4>
+                    <p style="font-size:13px; color:#666; margin-top:0;">One host per line: <code>[user@]host[:port] [debian|rhel|suse] [node-name]</code>. Uses this server's SSH key.</p>
+                    <textarea id="fleet-inventory" rows="4" placeholder="root@10.0.0.11&#10;admin@10.0.0.12:2222 rhel worker-12" style="width:100%; box-sizing:border-box; padding:8px; border-radius:8px; border:1px solid #ccc; font-family:monospace;"></textarea>
+                    <div style="display:flex; gap: 12px; margin-top: 12px; align-items:center;">
+                        <label style="font-size:13px;">Parallel hosts <input type="number" id="fleet-concurrency" value="10" min="1" max="100" style="width:60px; padding:6px; border-radius:8px; border:1px solid #ccc;"></label>
+                        <button class="btn btn-filled" onclick="bootstrapFleet()">Join via SSH</button>
+                        <button id="btn-fleet-retry" class="btn btn-text" onclick="retryFleet()" style="display:none;">Retry Failed Hosts</button>
+                    </div>
+                    <div id="fleet-progress" style="display:none; margin-top:12px;">
+                        <div id="fleet-table"></div>
+                        <div id="fleet-log" style="font-family: monospace; font-size: 12px; white-space: pre-wrap; max-height: 200px; overflow-y: auto; margin-top: 8px;"></div>
+                    </div>
                 </div>
             </div>
         </div>
@@ -169,7 +254,15 @@ HTML_TEMPLATE = r"""
         <div id="marketplace" class="page">
             <div style="display:flex; justify-content:space-between; margin-bottom:16px;">
                 <h2>App Marketplace</h2>
-                <span id="flux-status" class="chip chip-warning">Checking Flux...</span>
+                <div style="display:flex; align-items:center; gap:12px;">
+                    <button id="btn-install-stack" class="btn btn-tonal" onclick="installSelected()" style="display:none;">Install Selected</button>
+                    <span id="flux-status" class="chip chip-warning">Checking Flux...</span>
+                </div>
+            </div>
+            <div id="stack-progress" class="card" style="display:none;">
+                <h3 style="margin-top:0;">Stack Installation</h3>
+                <div id="stack-table"></div>
+                <div id="stack-log" style="font-family: monospace; font-size: 13px; white-space: pre-wrap;"></div>
             </div>
             <div id="flux-install-prompt" class="card" style="display:none; text-align:center;">
                 <h3>FluxCD Required</h3>
@@ -195,6 +288,13 @@ HTML_TEMPLATE = r"""
                         <option value="all">All Nodes (Detailed)</option>
                         <!-- Nodes injected via JS -->
                     </select>
+                    <select id="monitor-range-select" onchange="resetCharts()" style="margin-left:8px;">
+                        <option value="0">Live</option>
+                        <option value="21600">Last 6 hours</option>
+                        <option value="86400">Last 24 hours</option>
+                        <option value="604800">Last 7 days</option>
+                        <option value="2592000">Last 30 days</option>
+                    </select>
                 </div>
             </div>
             
@@ -216,6 +316,18 @@ HTML_TEMPLATE = r"""
                 <div class="card">
                     <canvas id="netChart" height="100"></canvas>
                 </div>
+                <div class="card">
+                    <div style="display:flex; align-items:center; margin-bottom:12px;">
+                        <h3 id="workloads-title" style="margin:0;">Top Workloads</h3>
+                        <select id="workloads-group" onchange="loadWorkloads()" style="margin-left:auto; padding:8px; border-radius:8px; border:1px solid #ccc;">
+                            <option value="top_cpu">Pods by CPU</option>
+                            <option value="top_mem">Pods by Memory</option>
+                            <option value="namespaces">Namespaces</option>
+                            <option value="releases">HelmReleases</option>
+                        </select>
+                    </div>
+                    <table id="workloads-table"><thead></thead><tbody></tbody></table>
+                </div>
             </div>
         </div>
 
@@ -294,6 +406,20 @@ HTML_TEMPLATE = r"""
         <!-- INFO TAB -->
         <div id="info" class="page">
             <h2>Requirements</h2>
+            <div class="card">
+                <div style="display:flex; justify-content:space-between; align-items:center;">
+                    <h3 style="margin:0;">This Host</h3>
+                    <div style="display:flex; gap:8px;">
+                        <select id="preflight-role" style="padding:6px; border-radius:8px; border:1px solid #ccc;">
+                            <option value="master">As Master</option>
+                            <option value="worker">As Worker</option>
+                        </select>
+                        <button class="btn btn-tonal" onclick="runPreflight()">Run Preflight</button>
+                    </div>
+                </div>
+                <div id="host-facts" style="font-size:13px; color:#666; margin-top:8px;"></div>
+                <div id="preflight-results" style="margin-top:12px;"></div>
+            </div>
             <div class="grid">
                 <div class="card">
                     <h3>Master Node</h3>
@@ -312,7 +438,11 @@ HTML_TEMPLATE = r"""
         let isMonitoring = false;
         let charts = {};
         let knownNodes = [];
-        let lastNetwork = { sent: 0, recv: 0, time: 0 };
+        let lastMetricsTs = 0;
+        let metricsSource = null;
+        let nodeValues = {};
+        let seedingHistory = false;
+        const MAX_POINTS = 150;
         let fluxInstalled = false;
 
         // --- NAVIGATION ---
@@ -329,6 +459,7 @@ HTML_TEMPLATE = r"""
             // Loaders
             if (tabId === 'marketplace') loadMarketplace();
             if (tabId === 'settings') loadSettings();
+            if (tabId === 'info') loadHostFacts();
         }
 
         // --- INITIAL LOAD ---
@@ -342,6 +473,8 @@ HTML_TEMPLATE = r"""
                 document.getElementById('install-box').style.display = 'none';
                 document.getElementById('node-view').style.display = 'block';
                 loadNodes();
+            } else if (localStorage.getItem('masterJob')) {
+                followJobLog(localStorage.getItem('masterJob')); // resume a bootstrap started from another page load
             }
             
             // Check Flux status globally
@@ -351,39 +484,113 @@ HTML_TEMPLATE = r"""
         }
 
         // --- DASHBOARD ---
+        // Virtualized node table: rows are fetched a page at a time and only the ones in
+        // (or near) the viewport are in the DOM, drawn with a single innerHTML write.
+        const NODE_PAGE = 200;
+        let nodeRows = [], nodeTotal = 0, nodeCursor = null, nodeLoading = null, nodeQueryId = 0;
+        let nodeSort = { key: 'name', desc: false };
+        let nodeRowHeight = 49;
+
+        async function loadCapacity() {
+            // Requested vs allocatable is what the scheduler sees; used is what the nodes are doing
+            try {
+                const res = await fetch('/api/capacity');
+                if (!res.ok) return;
+                const c = (await res.json()).cluster;
+                const pct = (v, of) => of ? ` (${Math.round(100 * v / of)}%)` : '';
+                const line = (label, r, unit, scale) => {
+                    const f = v => (v / scale).toFixed(1);
+                    const used = r.used === null ? 'n/a' : `${f(r.used)}${pct(r.used, r.allocatable)}`;
+                    return `<div><strong>${label}</strong>: requested ${f(r.requested)} of ${f(r.allocatable)} ${unit}${pct(r.requested, r.allocatable)}
+                            &middot; limits ${f(r.limits)}${pct(r.limits, r.allocatable)} &middot; used ${used}</div>`;
+                };
+                const box = document.getElementById('capacity-summary');
+                box.innerHTML = `<h3>Capacity</h3><p style="font-size:12px; color:#666;">${c.pods} pods on ${c.nodes} nodes</p>` +
+                                line('CPU', c.cpu, 'cores', 1) + line('Memory', c.memory, 'GiB', 1024);
+                box.style.display = 'block';
+            } catch(e) { console.log(e); }
+        }
+
         async function loadNodes() {
-            const res = await fetch('/api/nodes');
-            const nodes = await res.json();
-            const tbody = document.querySelector('#node-table tbody');
-            tbody.innerHTML = '';
-            
-            knownNodes = nodes.map(n => n.Name);
+            loadCapacity();
+            nodeQueryId++;
+            nodeRows = []; nodeTotal = 0; nodeCursor = null; nodeLoading = null;
+            document.getElementById('node-scroll').scrollTop = 0;
+            await fetchNodePage();
+            knownNodes = nodeRows.map(n => n.Name);
             updateMonitorDropdown(); // Populate monitor dropdown
+        }
+
+        function fetchNodePage() {
+            if (nodeLoading) return nodeLoading;
+            const queryId = nodeQueryId;
+            const params = new URLSearchParams({ limit: NODE_PAGE, sort: nodeSort.key, desc: nodeSort.desc ? '1' : '0' });
+            const q = document.getElementById('node-search').value.trim();
+            const status = document.getElementById('node-status-filter').value;
+            const role = document.getElementById('node-role-filter').value;
+            if (q) params.set('q', q);
+            if (status) params.set('status', status);
+            if (role) params.set('role', role);
+            if (nodeCursor) params.set('cursor', nodeCursor);
+            nodeLoading = fetch(`/api/nodes?${params}`).then(r => r.json()).then(page => {
+                if (queryId !== nodeQueryId) return; // a newer search replaced this one
+                nodeRows = nodeRows.concat(page.items);
+                nodeTotal = page.total;
+                nodeCursor = page.next_cursor;
+                nodeLoading = null;
+                renderNodeRows();
+            });
+            return nodeLoading;
+        }
 
-            if (nodes.length === 0) {
+        function nodeRowHtml(n) {
+            const statusClass = n.Status === 'Ready' ? 'chip-success' : 'chip-warning';
+            const delBtn = n.Role === 'Master'
+                ? `<button class="btn-text" disabled>Locked</button>`
+                : `<button class="btn-text" style="color:#ba1a1a" onclick="deleteNode('${n.Name}')">Detach</button>`;
+            return `<tr>
+                <td><strong>${n.Name}</strong></td>
+                <td>${n.Role}</td>
+                <td><span class="chip ${statusClass}">${n.Status}</span></td>
+                <td>${n['Internal IP']}</td>
+                <td>${n.CPU}</td>
+                <td>${n.Memory}</td>
+                <td>${delBtn}</td>
+            </tr>`;
+        }
+
+        function renderNodeRows() {
+            const scroller = document.getElementById('node-scroll');
+            const tbody = document.querySelector('#node-table tbody');
+            document.getElementById('node-count').innerText = `${nodeTotal} node${nodeTotal === 1 ? '' : 's'}`;
+            if (nodeTotal === 0) {
                 tbody.innerHTML = '<tr><td colspan="7" style="text-align:center">No nodes found.</td></tr>';
                 return;
             }
-
-            nodes.forEach(n => {
-                const statusClass = n.Status === 'Ready' ? 'chip-success' : 'chip-warning';
-                const delBtn = n.Role === 'Master' 
-                    ? `<button class="btn-text" disabled>Locked</button>`
-                    : `<button class="btn-text" style="color:#ba1a1a" onclick="deleteNode('${n.Name}')">Detach</button>`;
-                
-                const tr = `<tr>
-                    <td><strong>${n.Name}</strong></td>
-                    <td>${n.Role}</td>
-                    <td><span class="chip ${statusClass}">${n.Status}</span></td>
-                    <td>${n['Internal IP']}</td>
-                    <td>${n.CPU}</td>
-                    <td>${n.Memory}</td>
-                    <td>${delBtn}</td>
-                </tr>`;
-                tbody.innerHTML += tr;
-            });
+            const visible = Math.ceil(scroller.clientHeight / nodeRowHeight) || 12;
+            const start = Math.max(Math.floor(scroller.scrollTop / nodeRowHeight) - 10, 0);
+            const end = Math.min(start + visible + 20, nodeRows.length);
+            const top = start * nodeRowHeight;
+            const bottom = Math.max(nodeTotal - end, 0) * nodeRowHeight;
+            tbody.innerHTML = `<tr style="height:${top}px"></tr>` + nodeRows.slice(start, end).map(nodeRowHtml).join('') + `<tr style="height:${bottom}px"></tr>`;
+            const firstRow = tbody.rows[1];
+            if (firstRow && firstRow.offsetHeight && firstRow.offsetHeight !== nodeRowHeight) {
+                nodeRowHeight = firstRow.offsetHeight;
+                return renderNodeRows();
+            }
+            if (nodeCursor && end >= nodeRows.length - 20) fetchNodePage();
         }
-        
+
+        let nodeScrollFrame = null;
+        document.getElementById('node-scroll').addEventListener('scroll', () => {
+            if (nodeScrollFrame) return;
+            nodeScrollFrame = requestAnimationFrame(() => { nodeScrollFrame = null; renderNodeRows(); });
+        });
+        document.querySelectorAll('#node-table th[data-sort]').forEach(th => th.addEventListener('click', () => {
+            nodeSort = { key: th.dataset.sort, desc: nodeSort.key === th.dataset.sort && !nodeSort.desc };
+            loadNodes();
+        }));
+
         function updateMonitorDropdown() {
             const select = document.getElementById('monitor-view-select');
             // Keep first 2 options (Total, All)
@@ -398,23 +605,60 @@ HTML_TEMPLATE = r"""
         }
 
         async function installMaster() {
+            const res = await fetch('/api/install-master', { method: 'POST' });
+            const data = await res.json();
+            localStorage.setItem('masterJob', data.job_id);
+            followJobLog(data.job_id);
+        }
+
+        async function followJobLog(jobId) {
             const term = document.getElementById('terminal');
             term.style.display = 'block';
             term.innerText = 'Starting Installation...\n';
-            
-            const response = await fetch('/api/install-master', { method: 'POST' });
-            const reader = response.body.getReader();
+            const job = await streamJobLog(jobId, text => {
+                term.innerText += text;
+                term.scrollTop = term.scrollHeight;
+            });
+            if (job) term.innerText += `\n[${job.status}, exit code ${job.exit_code}, ${job.duration}s]\n`;
+            localStorage.removeItem('masterJob');
+            init(); // Reload state
+        }
+
+        async function streamJobLog(jobId, onText) {
             const decoder = new TextDecoder();
+            let offset = 0;
+            // The job keeps running server-side; on a dropped connection resume from the last byte offset
+            while (true) {
+                try {
+                    const response = await fetch(`/api/jobs/${jobId}/log?follow=1&offset=${offset}`);
+                    if (response.status === 404) return null;
+                    const reader = response.body.getReader();
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        offset += value.length;
+                        onText(decoder.decode(value, { stream: true }));
+                    }
+                    const job = await (await fetch(`/api/jobs/${jobId}`)).json();
+                    if (job.finished) return job;
+                } catch (e) {
+                    await new Promise(r => setTimeout(r, 2000));
+                }
+            }
+        }
 
+        async function waitForJob(jobId) {
             while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-                const text = decoder.decode(value);
-                term.innerText += text;
-                term.scrollTop = term.scrollHeight;
+                const res = await fetch(`/api/jobs/${jobId}?wait=25`);
+                const job = await res.json();
+                if (res.status === 404 || job.finished) return job;
             }
-            
-            init(); // Reload state
+        }
+
+        async function jobError(job) {
+            const res = await fetch(`/api/jobs/${job.id}/log`);
+            const log = await res.text();
+            return `${job.status}: ${job.error || log.slice(-500) || 'Unknown error'}`;
         }
 
         async function deleteNode(name) {
@@ -428,6 +672,89 @@ HTML_TEMPLATE = r"""
             window.location.href = `/api/download-worker?type=${type}&os=${os}`;
         }
 
+        function downloadBundle() {
+            const os = document.getElementById('worker-os').value;
+            const hosts = document.getElementById('worker-hosts').value.trim();
+            if (!hosts) return;
+            const query = /^\d+$/.test(hosts) ? `count=${hosts}` : `hosts=${encodeURIComponent(hosts)}`;
+            window.location.href = `/api/download-worker/bulk?os=${os}&${query}`;
+        }
+
+        let fleetRunId = null;
+
+        async function bootstrapFleet() {
+            const res = await fetch('/api/fleet/bootstrap', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({
+                    inventory: document.getElementById('fleet-inventory').value,
+                    os: document.getElementById('worker-os').value,
+                    concurrency: parseInt(document.getElementById('fleet-concurrency').value, 10)
+                })
+            });
+            const data = await res.json();
+            if (data.status !== 'ok') { alert('Bootstrap Failed: ' + data.error); return; }
+            fleetRunId = data.run_id;
+            followFleet(data.job_id);
+        }
+
+        async function retryFleet() {
+            const res = await fetch(`/api/fleet/${fleetRunId}/retry`, { method: 'POST' });
+            const data = await res.json();
+            if (data.status === 'ok') followFleet(data.job_id);
+            else alert('Retry Failed: ' + data.error);
+        }
+
+        async function followFleet(jobId) {
+            document.getElementById('fleet-progress').style.display = 'block';
+            document.getElementById('btn-fleet-retry').style.display = 'none';
+            const log = document.getElementById('fleet-log');
+            log.innerText = '';
+            await streamJobLog(jobId, text => {
+                log.innerText += text;
+                log.scrollTop = log.scrollHeight;
+                renderFleet();
+            });
+            const hosts = await renderFleet();
+            if (hosts.some(h => h.state === 'Failed')) document.getElementById('btn-fleet-retry').style.display = 'inline-flex';
+            loadNodes();
+        }
+
+        async function renderFleet() {
+            const res = await fetch(`/api/fleet/${fleetRunId}`);
+            const data = await res.json();
+            const rows = data.hosts.map(h => {
+                const cls = h.state === 'Joined' ? 'chip-success' : (h.state === 'Failed' ? 'chip-error' : 'chip-warning');
+                const timings = Object.entries(h.timings).map(([p, t]) => `${p} ${t}s`).join(', ');
+                return `<tr><td>${h.host}</td><td><span class="chip ${cls}">${h.state}</span></td><td>${timings}</td><td>${h.attempts}</td></tr>`;
+            }).join('');
+            document.getElementById('fleet-table').innerHTML = `<table><thead><tr><th>Host</th><th>State</th><th>Phase Timings</th><th>Attempts</th></tr></thead><tbody>${rows}</tbody></table>`;
+            return data.hosts;
+        }
+
+        // --- INFO ---
+        async function loadHostFacts() {
+            const res = await fetch('/api/host-facts');
+            const f = (await res.json()).facts;
+            if (!f.os) return;
+            document.getElementById('host-facts').innerText =
+                `${f.os.PRETTY_NAME} · kernel ${f.kernel} · cgroup ${f.cgroup} · ${f.cpus} CPUs · ${f.memory_mb} MiB RAM · swap ${f.swap_mb} MiB · ${f.disk_free_gb} GB free`;
+        }
+
+        async function runPreflight() {
+            const out = document.getElementById('preflight-results');
+            out.innerText = 'Running checks...';
+            const role = document.getElementById('preflight-role').value;
+            const data = await (await fetch(`/api/preflight?role=${role}`)).json();
+            const rows = data.checks.map(c => {
+                const cls = c.status === 'pass' ? 'chip-success' : (c.status === 'fail' ? 'chip-error' : 'chip-warning');
+                return `<tr><td>${c.check}</td><td><span class="chip ${cls}">${c.status}</span></td><td>${c.detail}</td></tr>`;
+            }).join('');
+            out.innerHTML = `<table><thead><tr><th>Check</th><th>Result</th><th>Detail</th></tr></thead><tbody>${rows}</tbody></table>
+                <p style="font-size:12px; color:#666;">${data.ok ? 'Ready' : 'Not ready'} · ${data.duration}s</p>`;
+            loadHostFacts();
+        }
+
         // --- SETTINGS (GitOps) ---
         async function loadSettings() {
             // Refresh flux status
@@ -452,8 +779,9 @@ HTML_TEMPLATE = r"""
         async function installFluxSettings() {
             const statusDiv = document.getElementById('settings-flux-status');
             statusDiv.innerHTML = '<span class="chip chip-warning">Installing...</span>';
-            await fetch('/api/install-flux', { method: 'POST' });
-            setTimeout(loadSettings, 2000);
+            const res = await fetch('/api/install-flux', { method: 'POST' });
+            await waitForJob((await res.json()).job_id);
+            loadSettings();
         }
 
         async function loadGitSources() {
@@ -557,6 +885,15 @@ HTML_TEMPLATE = r"""
             const appGrid = document.getElementById('app-grid');
             const installPrompt = document.getElementById('flux-install-prompt');
 
+            if (data.error) {
+                // Keep the last rendered state rather than offering to reinstall everything
+                fluxStatus.className = 'chip chip-warning';
+                fluxStatus.innerText = 'Cluster Unreachable';
+                fluxStatus.title = data.error;
+                return;
+            }
+            fluxStatus.title = '';
+
             if (!data.flux_installed) {
                 fluxStatus.className = 'chip chip-error';
                 fluxStatus.innerText = 'Flux Missing';
@@ -567,6 +904,7 @@ HTML_TEMPLATE = r"""
 
             fluxStatus.className = 'chip chip-success';
             fluxStatus.innerText = 'Flux Active';
+            document.getElementById('btn-install-stack').style.display = 'inline-flex';
             installPrompt.style.display = 'none';
             appGrid.style.display = 'grid';
             appGrid.innerHTML = '';
@@ -599,8 +937,11 @@ HTML_TEMPLATE = r"""
                              accessInfo = `<div style="margin-top:12px; padding:8px; background:#fff; border-radius:8px; font-size:12px;">
                                 <strong>Access:</strong> <a href="${url}" target="_blank">${url}</a>
                              </div>`;
+                        } else if (appFailures[key]) {
+                             accessInfo = `<div style="margin-top:12px; font-size:12px; color:#ba1a1a;">Failed: ${appFailures[key]}</div>`;
                         } else {
                              accessInfo = `<div style="margin-top:12px; font-size:12px; color:orange;">Waiting for Port...</div>`;
+                             waitForApp(key);
                         }
                     }
                 }
@@ -623,7 +964,8 @@ HTML_TEMPLATE = r"""
                     </div>
                     <p style="font-size:14px; color:#444; height:40px; overflow:hidden;">${app.desc}</p>
                     ${accessInfo}
-                    <div style="margin-top:16px; display:flex; justify-content:flex-end;">
+                    <div style="margin-top:16px; display:flex; justify-content:flex-end; align-items:center; gap:8px;">
+                        ${isInstalled ? '' : `<label style="font-size:13px; margin-right:auto;"><input type="checkbox" class="stack-select" value="${key}"> Select</label>`}
                         <button class="btn ${btnClass}" ${disabled ? 'disabled' : ''} 
                             onclick="toggleApp('${key}', ${isInstalled})">
                             ${btnLabel}
@@ -634,9 +976,50 @@ HTML_TEMPLATE = r"""
             }
         }
 
+        async function installSelected() {
+            const keys = [...document.querySelectorAll('.stack-select:checked')].map(c => c.value);
+            if (keys.length === 0) { alert('Select at least one app.'); return; }
+            const res = await fetch('/api/install-apps', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ app_keys: keys })
+            });
+            const data = await res.json();
+            if (data.status !== 'ok') { alert('Operation Failed: ' + data.error); return; }
+
+            // Dependencies are resolved server-side; independent apps install in parallel
+            document.getElementById('stack-progress').style.display = 'block';
+            const log = document.getElementById('stack-log');
+            log.innerText = `Plan: ${Object.keys(data.plan).join(', ')}\n`;
+            let lastRender = 0;
+            const job = await streamJobLog(data.job_id, text => {
+                log.innerText += text;
+                // Per-app states come from job.progress, at most once a second
+                if (Date.now() - lastRender > 1000) {
+                    lastRender = Date.now();
+                    fetch(`/api/jobs/${data.job_id}`).then(r => r.json()).then(renderStackProgress);
+                }
+            });
+            if (job) {
+                renderStackProgress(job);
+                log.innerText += `\n[${job.status}, ${job.duration}s]\n`;
+            }
+            loadMarketplace();
+        }
+
+        function renderStackProgress(job) {
+            if (!job.progress) return;
+            const rows = Object.entries(job.progress).map(([key, p]) => {
+                const cls = p.state === 'Ready' ? 'chip-success' : (['Failed', 'Skipped', 'Cancelled'].includes(p.state) ? 'chip-error' : 'chip-warning');
+                return `<tr><td>${key}</td><td><span class="chip ${cls}">${p.state}</span></td><td>${p.message || ''}</td><td>${p.duration != null ? p.duration + 's' : ''}</td></tr>`;
+            }).join('');
+            document.getElementById('stack-table').innerHTML = `<table><thead><tr><th>App</th><th>State</th><th>Message</th><th>Duration</th></tr></thead><tbody>${rows}</tbody></table>`;
+        }
+
         async function installFlux() {
-            await fetch('/api/install-flux', { method: 'POST' });
-            setTimeout(loadMarketplace, 2000);
+            const res = await fetch('/api/install-flux', { method: 'POST' });
+            await waitForJob((await res.json()).job_id);
+            loadMarketplace();
         }
 
         async function toggleApp(key, isInstalled) {
@@ -650,11 +1033,42 @@ HTML_TEMPLATE = r"""
                 const data = await res.json();
                 if (data.status !== 'ok') {
                     alert('Operation Failed: ' + (data.error || 'Unknown error'));
+                } else if (data.job_id) {
+                    const job = await waitForJob(data.job_id);
+                    if (job.status !== 'succeeded') alert('Operation Failed: ' + await jobError(job));
                 }
             } catch(e) {
                 alert('Request Failed: ' + e);
             }
-            setTimeout(loadMarketplace, 2000);
+            delete appFailures[key];
+            loadMarketplace();
+            if (isInstalled) await waitForApp(key, 'uninstalled');
+            else await waitForApp(key);
+        }
+
+        // Long-polls the server until the app settles, then re-renders once. Failures are
+        // remembered so the re-render shows them instead of arming another wait.
+        const appWaits = new Set();
+        const appFailures = {};
+        async function waitForApp(key, target = 'ready') {
+            if (appWaits.has(key) || appFailures[key]) return;
+            appWaits.add(key);
+            try {
+                while (true) {
+                    const res = await fetch(`/api/apps/${key}/wait?timeout=120&for=${target}`);
+                    const data = await res.json();
+                    if (data.state === 'Failed' || data.state === 'Error') {
+                        appFailures[key] = data.message || data.state;
+                        alert(`${key} failed: ${appFailures[key]}`);
+                    }
+                    if (data.state !== 'Timeout') break;
+                }
+            } catch(e) {
+                console.log(e);
+                appFailures[key] = String(e);
+            }
+            appWaits.delete(key);
+            loadMarketplace();
         }
 
         // --- MONITOR ---
@@ -676,130 +1090,251 @@ HTML_TEMPLATE = r"""
                 charts.net = new Chart(ctxNet, { type: 'line', data: { labels: [], datasets: [] }, options: { ...commonOpt, plugins: { title: { display: true, text: 'Network I/O (MB/s - Master)' } }, scales: { y: { beginAtZero: true } } } });
             }
 
-            pollMetrics();
+            loadMetricsHistory().then(openMetricsStream);
+            loadWorkloads();
+            workloadsTimer = setInterval(loadWorkloads, 10000);
         }
 
         function stopMonitoring() { 
             isMonitoring = false; 
             document.getElementById('live-indicator').style.display = 'none';
+            if (metricsSource) { metricsSource.close(); metricsSource = null; }
+            clearInterval(workloadsTimer); workloadsTimer = null;
         }
         
         function resetCharts() {
             if (charts.cpu) {
-                charts.cpu.data.datasets = [];
-                charts.mem.data.datasets = [];
+                Object.values(charts).forEach(c => { c.data.labels = []; c.data.datasets = []; });
+                lastMetricsTs = 0; // replay the server-side history for the new view
+                loadMetricsHistory();
+                loadWorkloads();
             }
         }
 
-        async function pollMetrics() {
-            if (!isMonitoring) return;
-            
+        // Workloads card: cluster-wide top pods / namespaces / releases, or, with a node
+        // selected in the view mode, that node's pods. Clicking a node drills down to it.
+        let workloadsTimer = null;
+
+        async function loadWorkloads() {
+            const view = document.getElementById('monitor-view-select').value;
+            const group = document.getElementById('workloads-group');
+            const perNode = !isAggregateView();
+            group.style.display = perNode ? 'none' : '';
+            document.getElementById('workloads-title').innerText = perNode ? `Pods on ${view}` : 'Top Workloads';
             try {
-                const res = await fetch('/api/metrics');
+                const res = await fetch(perNode ? `/api/metrics/pods?node=${encodeURIComponent(view)}` : '/api/metrics/workloads');
                 const data = await res.json();
-                
-                if (!data.has_metrics) {
-                    document.getElementById('metrics-install-prompt').style.display = 'block';
-                    document.getElementById('charts-view').style.display = 'none';
+                const rows = perNode ? data.pods : data[group.value];
+                const byGroup = !perNode && (group.value === 'namespaces' || group.value === 'releases');
+                const head = byGroup
+                    ? `<tr><th>Namespace</th>${group.value === 'releases' ? '<th>Release</th>' : ''}<th>Pods</th><th>CPU (cores)</th><th>Memory (MiB)</th></tr>`
+                    : '<tr><th>Pod</th><th>Namespace</th><th>Release</th><th>Node</th><th>CPU (cores)</th><th>Memory (MiB)</th></tr>';
+                const body = rows.map(r => byGroup
+                    ? `<tr><td>${r.namespace}</td>${group.value === 'releases' ? `<td>${r.release}</td>` : ''}<td>${r.pods}</td><td>${r.cpu}</td><td>${r.mem}</td></tr>`
+                    : `<tr><td><strong>${r.name}</strong></td><td>${r.namespace}</td><td>${r.release || '-'}</td>
+                       <td>${r.node ? `<a href="#" onclick="drillToNode('${r.node}'); return false;">${r.node}</a>` : '-'}</td><td>${r.cpu}</td><td>${r.mem}</td></tr>`).join('');
+                document.querySelector('#workloads-table thead').innerHTML = head;
+                document.querySelector('#workloads-table tbody').innerHTML = body || `<tr><td colspan="6" style="text-align:center">No pod metrics yet.</td></tr>`;
+            } catch(e) { console.log(e); }
+        }
+
+        function drillToNode(name) {
+            const select = document.getElementById('monitor-view-select');
+            if (![...select.options].some(o => o.value === name)) {
+                const opt = document.createElement('option');
+                opt.value = name;
+                opt.innerText = `Node: ${name}`;
+                select.appendChild(opt);
+            }
+            select.value = name;
+            resetCharts();
+        }
+
+        function showMetricsAvailable(hasMetrics) {
+            document.getElementById('metrics-install-prompt').style.display = hasMetrics ? 'none' : 'block';
+            document.getElementById('charts-view').style.display = hasMetrics ? 'block' : 'none';
+        }
+
+        // Cluster-wide views draw a fixed set of series (total, or p50/p95/max plus the top
+        // TOP_K nodes) from server-side aggregates, so their cost does not grow with the cluster.
+        const TOP_K = 5;
+        const AGG_COLORS = { 'Cluster Total': '#00639a', 'p50': '#00639a', 'p95': '#e65100', 'max': '#ba1a1a' };
+        const NODE_COLORS = ['#00695c', '#6a1b9a', '#5d4037', '#c2185b', '#455a64'];
+        let topNodes = [];
+        let aggregateSeededAt = 0;
+
+        function isAggregateView() {
+            const view = document.getElementById('monitor-view-select').value;
+            return view === 'total' || view === 'all';
+        }
+
+        function historyRange() {
+            // Seconds of stored history to chart instead of the live window (0: live)
+            return Number(document.getElementById('monitor-range-select').value);
+        }
+
+        async function loadMetricsHistory() {
+            // Seeds the charts with the server-side window; live points then arrive over SSE
+            seedingHistory = true;
+            try {
+                if (historyRange()) {
+                    const now = Date.now() / 1000;
+                    const view = document.getElementById('monitor-view-select').value;
+                    const res = await fetch(`/api/metrics/range?start=${now - historyRange()}&end=${now}&points=${MAX_POINTS}` +
+                                            (isAggregateView() ? '' : `&node=${encodeURIComponent(view)}`));
+                    applyRange(await res.json());
+                } else if (isAggregateView()) {
+                    const res = await fetch(`/api/metrics/aggregate?points=${MAX_POINTS}&k=${TOP_K}&by=cpu`);
+                    const data = await res.json();
+                    showMetricsAvailable(data.has_metrics);
+                    if (data.has_metrics) applyAggregate(data);
                 } else {
-                    document.getElementById('metrics-install-prompt').style.display = 'none';
-                    document.getElementById('charts-view').style.display = 'block';
-                    updateCharts(data.metrics, data.network);
+                    const res = await fetch('/api/metrics/history' + (lastMetricsTs ? `?since=${lastMetricsTs}` : ''));
+                    const data = await res.json();
+                    showMetricsAvailable(data.has_metrics);
+                    if (data.has_metrics) applyHistory(data);
                 }
             } catch(e) { console.log(e); }
-            
-            if (isMonitoring) setTimeout(pollMetrics, 2000);
+            seedingHistory = false;
+        }
+
+        function aggregateSeries(agg, nodeValueAt) {
+            // {label: [cpu, mem]} for the current cluster-wide view
+            if (document.getElementById('monitor-view-select').value === 'total') return { 'Cluster Total': [agg.cpu[0], agg.mem[0]] };
+            const series = { 'p50': [agg.cpu[1], agg.mem[1]], 'p95': [agg.cpu[2], agg.mem[2]], 'max': [agg.cpu[3], agg.mem[3]] };
+            topNodes.forEach(name => { series[name] = nodeValueAt(name) || [null, null]; });
+            return series;
+        }
+
+        function applyAggregate(data) {
+            // Downsampled server-side, so this replaces whatever the charts held
+            Object.values(charts).forEach(c => { c.data.labels = []; c.data.datasets = []; });
+            topNodes = Object.keys(data.top.nodes);
+            data.ts.forEach((ts, i) => {
+                const agg = { cpu: ['total', 'p50', 'p95', 'max'].map(s => data.cpu[s][i]), mem: ['total', 'p50', 'p95', 'max'].map(s => data.mem[s][i]) };
+                const series = aggregateSeries(agg, name => {
+                    const n = data.top.nodes[name];
+                    return n.cpu[i] === null ? null : [n.cpu[i], n.mem[i]];
+                });
+                pushPoint(ts, { sent: data.network.sent[i], recv: data.network.recv[i] }, series);
+            });
+            lastMetricsTs = data.ts.length ? data.ts[data.ts.length - 1] : lastMetricsTs;
+            aggregateSeededAt = Date.now();
+            Object.values(charts).forEach(c => c.update());
+        }
+
+        function applyRange(data) {
+            // Read back from the on-disk store; stays put until the view or range changes
+            Object.values(charts).forEach(c => { c.data.labels = []; c.data.datasets = []; });
+            topNodes = [];
+            const view = document.getElementById('monitor-view-select').value;
+            data.ts.forEach((ts, i) => {
+                const stats = (metric) => ['total', 'p50', 'p95', 'max'].map(s => data[metric][s][i]);
+                const series = isAggregateView() ? aggregateSeries({ cpu: stats('cpu'), mem: stats('mem') }, () => null)
+                                                 : { [view]: [data.cpu[view][i], data.mem[view][i]] };
+                pushPoint(ts, { sent: data.network.sent[i], recv: data.network.recv[i] }, series);
+            });
+            Object.values(charts).forEach(c => c.update());
         }
 
-        function updateCharts(metrics, network) {
-            const timeLabel = new Date().toLocaleTimeString();
+        function openMetricsStream() {
+            if (metricsSource || !isMonitoring) return;
+            // EventSource reconnects on its own and resumes via the Last-Event-ID header
+            metricsSource = new EventSource('/api/metrics/stream');
+            metricsSource.onmessage = (e) => {
+                const ev = JSON.parse(e.data);
+                if (ev.full) nodeValues = {};
+                Object.assign(nodeValues, ev.nodes);
+                ev.removed.forEach(name => delete nodeValues[name]);
+                showMetricsAvailable(ev.has_metrics);
+                if (!ev.has_metrics || seedingHistory || historyRange() || ev.ts <= lastMetricsTs) return;
+                if (isAggregateView()) {
+                    // Re-rank the top nodes once a minute
+                    if (Date.now() - aggregateSeededAt > 60000) return resetCharts();
+                    if (ev.agg) pushPoint(ev.ts, ev.network, aggregateSeries(ev.agg, name => nodeValues[name]));
+                } else {
+                    updateCharts(ev.network, ev.ts);
+                }
+                lastMetricsTs = ev.ts;
+                Object.values(charts).forEach(c => c.update());
+            };
+        }
+
+        function applyHistory(data) {
+            // Regroup the per-node columns into one metrics list per sample tick
+            const ticks = new Map();
+            const net = data.network;
+            net.ts.forEach((ts, i) => ticks.set(ts, { metrics: [], network: { sent: net.sent[i], recv: net.recv[i] } }));
+            for (const [name, series] of Object.entries(data.nodes)) {
+                series.ts.forEach((ts, i) => {
+                    if (!ticks.has(ts)) ticks.set(ts, { metrics: [], network: { sent: 0, recv: 0 } });
+                    ticks.get(ts).metrics.push({ Name: name, 'CPU (cores)': series.cpu[i], 'Memory (MiB)': series.mem[i] });
+                });
+            }
+            [...ticks.keys()].sort((a, b) => a - b).forEach(ts => {
+                const tick = ticks.get(ts);
+                const values = {};
+                tick.metrics.forEach(m => { values[m.Name] = [m['CPU (cores)'], m['Memory (MiB)']]; });
+                updateCharts(tick.network, ts, values);
+                lastMetricsTs = Math.max(lastMetricsTs, ts);
+            });
+            Object.values(charts).forEach(c => c.update());
+        }
+
+        function updateCharts(network, ts, values = nodeValues) {
+            // Single-node view
             const viewMode = document.getElementById('monitor-view-select').value;
-            
-            if (charts.cpu.data.labels.length > 20) {
+            pushPoint(ts, network, { [viewMode]: values[viewMode] || [null, null] });
+        }
+
+        function pushPoint(ts, network, series) {
+            // series: {label: [cpu, mem]}; datasets not in it are dropped, so the chart only
+            // ever holds the fixed set of lines the current view asks for.
+            const date = new Date(ts * 1000);
+            const timeLabel = historyRange() > 86400 ? date.toLocaleString([], { month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' }) : date.toLocaleTimeString();
+            const single = Object.keys(series).length === 1;
+
+            if (charts.cpu.data.labels.length >= MAX_POINTS) {
                 charts.cpu.data.labels.shift();
                 charts.mem.data.labels.shift();
                 charts.net.data.labels.shift();
             }
-            
+
             charts.cpu.data.labels.push(timeLabel);
             charts.mem.data.labels.push(timeLabel);
             charts.net.data.labels.push(timeLabel);
 
-            // Net Chart
+            // Net Chart (rates are computed by the server sampler)
             let netSent = charts.net.data.datasets.find(d => d.label === 'Sent (MB/s)');
             let netRecv = charts.net.data.datasets.find(d => d.label === 'Recv (MB/s)');
-            
+
             if (!netSent) {
                 netSent = { label: 'Sent (MB/s)', data: [], borderColor: '#4caf50', fill: false };
                 netRecv = { label: 'Recv (MB/s)', data: [], borderColor: '#2196f3', fill: false };
                 charts.net.data.datasets.push(netSent, netRecv);
             }
-            
-            if (netSent.data.length > 20) { netSent.data.shift(); netRecv.data.shift(); }
 
-            // Calculate Rate
-            const now = Date.now();
-            let sentRate = 0;
-            let recvRate = 0;
-            
-            if (lastNetwork.time !== 0) {
-                const seconds = (now - lastNetwork.time) / 1000;
-                if (seconds > 0) {
-                    sentRate = (network.sent - lastNetwork.sent) / seconds;
-                    recvRate = (network.recv - lastNetwork.recv) / seconds;
-                }
-            }
-            lastNetwork = { sent: network.sent, recv: network.recv, time: now };
-            if (sentRate < 0) sentRate = 0;
-            if (recvRate < 0) recvRate = 0;
-
-            netSent.data.push(sentRate);
-            netRecv.data.push(recvRate);
-            charts.net.update();
-
-            // Metrics
-            if (viewMode === 'total') {
-                let totalCpu = 0;
-                let totalMem = 0;
-                metrics.forEach(n => { totalCpu += n['CPU (cores)']; totalMem += n['Memory (MiB)']; });
-                
-                updateDataset(charts.cpu, 'Cluster Total', totalCpu, '#00639a', true);
-                updateDataset(charts.mem, 'Cluster Total', totalMem, '#00639a', true);
-                
-                charts.cpu.data.datasets = charts.cpu.data.datasets.filter(d => d.label === 'Cluster Total');
-                charts.mem.data.datasets = charts.mem.data.datasets.filter(d => d.label === 'Cluster Total');
-                
-            } else if (viewMode === 'all') {
-                 metrics.forEach((node, index) => {
-                    const colors = ['#00639a', '#ba1a1a', '#00695c', '#e65100', '#6a1b9a'];
-                    const color = colors[index % colors.length];
-                    updateDataset(charts.cpu, node.Name, node['CPU (cores)'], color, false);
-                    updateDataset(charts.mem, node.Name, node['Memory (MiB)'], color, false);
-                 });
-                 charts.cpu.data.datasets = charts.cpu.data.datasets.filter(d => metrics.find(m => m.Name === d.label));
-                 charts.mem.data.datasets = charts.mem.data.datasets.filter(d => metrics.find(m => m.Name === d.label));
+            if (netSent.data.length >= MAX_POINTS) { netSent.data.shift(); netRecv.data.shift(); }
 
-            } else {
-                const node = metrics.find(n => n.Name === viewMode);
-                if (node) {
-                    updateDataset(charts.cpu, node.Name, node['CPU (cores)'], '#00639a', true);
-                    updateDataset(charts.mem, node.Name, node['Memory (MiB)'], '#00639a', true);
-                    charts.cpu.data.datasets = charts.cpu.data.datasets.filter(d => d.label === node.Name);
-                    charts.mem.data.datasets = charts.mem.data.datasets.filter(d => d.label === node.Name);
-                }
-            }
+            netSent.data.push(network.sent);
+            netRecv.data.push(network.recv);
 
-            charts.cpu.update();
-            charts.mem.update();
+            Object.entries(series).forEach(([label, v], index) => {
+                const color = AGG_COLORS[label] || (single ? '#00639a' : NODE_COLORS[index % NODE_COLORS.length]);
+                updateDataset(charts.cpu, label, v[0], color, single);
+                updateDataset(charts.mem, label, v[1], color, single);
+            });
+            charts.cpu.data.datasets = charts.cpu.data.datasets.filter(d => d.label in series);
+            charts.mem.data.datasets = charts.mem.data.datasets.filter(d => d.label in series);
         }
-        
+
         function updateDataset(chart, label, value, color, fill) {
             let ds = chart.data.datasets.find(d => d.label === label);
             if (!ds) {
                 ds = { label: label, data: [], borderColor: color, tension: 0.3, fill: fill, backgroundColor: fill ? color + '33' : undefined };
                 chart.data.datasets.push(ds);
             }
-            if (ds.data.length > 20) ds.data.shift();
+            if (ds.data.length >= MAX_POINTS) ds.data.shift();
             ds.data.push(value);
         }
         
@@ -808,7 +1343,9 @@ HTML_TEMPLATE = r"""
             btn.disabled = true;
             btn.innerHTML = '<span class="material-symbols-outlined spin">refresh</span> Installing...';
             try {
-                await fetch('/api/install-metrics', { method: 'POST' });
+                const res = await fetch('/api/install-metrics', { method: 'POST' });
+                const job = await waitForJob((await res.json()).job_id);
+                if (job.status !== 'succeeded') throw await jobError(job);
             } catch (e) {
                 alert("Install Failed: " + e);
                 btn.disabled = false;
@@ -840,246 +1377,2844 @@ def detect_os_release():
     except: pass
     return os_info
 
-def run_shell_cmd(cmd):
-    try:
-        res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        return res.returncode == 0, res.stdout
-    except Exception as e: return False, str(e)
+# --- SELF METRICS ---
+# A minimal Prometheus registry for Zoplete's own internals, rendered on /metrics. Hot paths
+# only bump numbers under a lock; everything else is computed at scrape time.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
 
-def stream_shell_cmd(cmd):
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-    for line in process.stdout:
-        yield line
+def prom_labels(names, values, extra=None):
+    pairs = [f'{n}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for n, v in zip(names, values)]
+    if extra: pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
 
-def get_detailed_nodes():
-    try:
-        if os.path.exists("/etc/kubernetes/admin.conf"):
-            config.load_kube_config(config_file="/etc/kubernetes/admin.conf")
-        api = client.CoreV1Api()
-        nodes = api.list_node()
-        data = []
-        for n in nodes.items:
-            role = "Worker"
-            if "node-role.kubernetes.io/control-plane" in n.metadata.labels: role = "Master"
-            status = "NotReady"
-            for c in n.status.conditions:
-                if c.type == "Ready" and c.status == "True": status = "Ready"
-            ip = next((a.address for a in n.status.addresses if a.type == "InternalIP"), "Unknown")
-            mem_kb = int(n.status.capacity['memory'].replace('Ki',''))
-            mem_gib = f"{mem_kb / (1024*1024):.2f} GiB"
-            data.append({
-                "Name": n.metadata.name,
-                "Role": role,
-                "Status": status,
-                "Internal IP": ip,
-                "CPU": n.status.capacity['cpu'],
-                "Memory": mem_gib
-            })
-        return data
-    except: return []
+class PromMetric:
+    def __init__(self, name, doc, kind, labels=()):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
 
-def get_public_ip_metadata():
-    try:
-        cmd_token = 'curl -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 21600" -s --fail'
-        token_res = subprocess.run(cmd_token, shell=True, stdout=subprocess.PIPE, text=True, timeout=1)
-        if token_res.returncode != 0: return None
-        token = token_res.stdout.strip()
-        cmd_ip = f'curl -H "X-aws-ec2-metadata-token: {token}" http://169.254.169.254/latest/meta-data/public-ipv4 -s --fail'
-        ip_res = subprocess.run(cmd_ip, shell=True, stdout=subprocess.PIPE, text=True, timeout=1)
-        if ip_res.returncode == 0: return ip_res.stdout.strip()
-    except: pass
-    return None
+    def samples(self):
+        with self._lock: return dict(self.values)
 
-def get_node_ips():
-    ips = []
-    try:
-        if os.path.exists("/etc/kubernetes/admin.conf"):
-            try: config.load_kube_config(config_file="/etc/kubernetes/admin.conf")
-            except: pass
-        api = client.CoreV1Api()
-        nodes = api.list_node()
-        for node in nodes.items:
-            ext_ip = None
-            int_ip = None
-            for addr in node.status.addresses:
-                if addr.type == "ExternalIP": ext_ip = addr.address
-                if addr.type == "InternalIP": int_ip = addr.address
-            if ext_ip: ips.append(ext_ip)
-            elif int_ip: ips.append(int_ip)
-    except Exception: pass
-    public_ip = get_public_ip_metadata()
-    if public_ip: ips.insert(0, public_ip)
-    return list(set(ips))
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        return lines + [f"{self.name}{prom_labels(self.labels, k)} {v}" for k, v in sorted(self.samples().items()) if v is not None]
 
-def get_k8s_install_cmd(os_family):
-    if os_family == "debian":
-        return """
-    sudo rm -f /etc/apt/sources.list.d/kubernetes.list
-    sudo apt-get update && sudo apt-get install -y apt-transport-https ca-certificates curl gpg
-    curl -fsSL https://pkgs.k8s.io/core:/stable:/v1.30/deb/Release.key | sudo gpg --dearmor --yes -o /etc/apt/keyrings/kubernetes-apt-keyring.gpg
-    echo 'deb [signed-by=/etc/apt/keyrings/kubernetes-apt-keyring.gpg] https://pkgs.k8s.io/core:/stable:/v1.30/deb/ /' | sudo tee /etc/apt/sources.list.d/kubernetes.list
-    sudo apt-get update
-    sudo apt-get install -y kubelet kubeadm kubectl
-    sudo apt-mark hold kubelet kubeadm kubectl
-    """
-    # ... other families same as before
-    return "# Manual Installation Required"
+class PromCounter(PromMetric):
+    def __init__(self, name, doc, labels=(), kind="counter"): super().__init__(name, doc, kind, labels)
 
-# --- CATALOG & GITOPS LOGIC ---
-MARKETPLACE_CATALOG = {
-    "kafka": { "title": "Apache Kafka", "desc": "Event streaming platform.", "chart": "kafka", "repo_url": "https://charts.bitnami.com/bitnami", "repo_name": "bitnami", "version": "26.0.0", "values": {"zookeeper": {"enabled": True}, "replicaCount": 1}, "ui_svc": None, "logo_url": "https://upload.wikimedia.org/wikipedia/commons/0/01/Apache_Kafka_logo.svg"},
-    "kouncil": { "title": "Kouncil", "desc": "Kafka UI. Requires Kafka.", "chart": "kouncil", "repo_url": "https://consdata.github.io/kouncil/", "repo_name": "consdata", "version": "1.5.0", "values": {"bootstrapServers": "kafka.flux-system.svc.cluster.local:9092", "service": {"type": "NodePort"}}, "ui_svc": "kouncil", "dependency": "kafka", "logo_url": "https://avatars.githubusercontent.com/u/47789366?s=200&v=4"},
-    "jupyterhub": { "title": "JupyterHub", "desc": "Notebook server.", "chart": "jupyterhub", "repo_url": "https://jupyterhub.github.io/helm-chart/", "repo_name": "jupyterhub", "version": "3.1.0", "values": {"proxy": {"service": {"type": "NodePort"}}}, "ui_svc": "proxy-public", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/3/38/Jupyter_logo.svg"},
-    "nifi": { "title": "Apache NiFi", "desc": "Data flow.", "chart": "nifi", "repo_url": "https://cetic.github.io/helm-charts", "repo_name": "cetic", "version": "1.1.0", "values": {"service": {"type": "NodePort"}}, "ui_svc": "nifi", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/f/ff/Apache-nifi-logo.svg"},
-    "trino": { "title": "Trino (SQL)", "desc": "Fast distributed SQL query.", "chart": "trino", "repo_url": "https://trinodb.github.io/charts/", "repo_name": "trino", "version": "0.18.0", "values": {"server": {"workers": 1, "coordinator": True}, "service": {"type": "NodePort"}}, "ui_svc": "trino", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/5/57/Trino-logo-w-bk.svg"},
-    "airflow": { "title": "Apache Airflow", "desc": "Workflow orchestration.", "chart": "airflow", "repo_url": "https://airflow.apache.org", "repo_name": "apache-airflow", "version": "1.11.0", "values": {"executor": "KubernetesExecutor", "webserver": {"service": {"type": "NodePort"}}}, "ui_svc": "airflow-webserver", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/d/de/AirflowLogo.png"}
-}
+    def inc(self, *labels, amount=1):
+        with self._lock: self.values[labels] = self.values.get(labels, 0) + amount
 
-def install_app_logic(key):
-    cfg = MARKETPLACE_CATALOG[key]
-    values_yaml = yaml.dump(cfg['values'], default_flow_style=False)
-    values_indented = "\n".join(["    " + line for line in values_yaml.split("\n") if line.strip()])
-    yaml_content = f"""apiVersion: source.toolkit.fluxcd.io/v1
-kind: HelmRepository
-metadata:
-  name: {cfg['repo_name']}
-  namespace: flux-system
-spec:
-  interval: 1h
-  url: {cfg['repo_url']}
----
-apiVersion: helm.toolkit.fluxcd.io/v2
-kind: HelmRelease
-metadata:
-  name: {key}
-  namespace: flux-system
-spec:
-  interval: 5m
-  targetNamespace: default
-  chart:
-    spec:
-      chart: {cfg['chart']}
-      version: "{cfg['version']}"
-      sourceRef:
-        kind: HelmRepository
-        name: {cfg['repo_name']}
-        namespace: flux-system
-  values:
-{values_indented}
-"""
-    with open(f"/tmp/{key}.yaml", "w") as f: f.write(yaml_content)
-    return run_shell_cmd(f"kubectl apply -f /tmp/{key}.yaml")
+    def dec(self, *labels): self.inc(*labels, amount=-1)
 
-def get_node_port(svc):
-    try:
-        res = subprocess.run(f"kubectl get svc -n default {svc} -o jsonpath='{{.spec.ports[0].nodePort}}'", shell=True, stdout=subprocess.PIPE)
-        return res.stdout.decode().strip()
-    except: return None
+class PromHistogram(PromMetric):
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, "histogram", labels)
+        self.buckets = buckets
 
-# --- NEW API ENDPOINTS FOR SETTINGS ---
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None: counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
 
-@app.route('/')
-def index(): return HTML_TEMPLATE
+    def render(self):
+        with self._lock: values = {k: list(v) for k, v in self.values.items()}
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(values.items()):
+            total = 0
+            for le, n in zip(self.buckets + ("+Inf",), counts):
+                total += n
+                bucket = prom_labels(self.labels, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {total}")
+            lines.append(f"{self.name}_sum{prom_labels(self.labels, key)} {round(counts[-1], 6)}")
+            lines.append(f"{self.name}_count{prom_labels(self.labels, key)} {total}")
+        return lines
 
-@app.route('/api/init')
-def api_init():
-    ready = os.path.exists("/etc/kubernetes/admin.conf")
-    os_info = detect_os_release()
-    return jsonify({"is_ready": ready, "os_info": os_info})
+class PromCallback(PromMetric):
+    # Read from existing counters at scrape time: fn() -> {label values tuple: number}
+    def __init__(self, name, doc, kind, labels, fn):
+        super().__init__(name, doc, kind, labels)
+        self.fn = fn
 
-@app.route('/api/nodes')
-def api_nodes(): return jsonify(get_detailed_nodes())
+    def samples(self):
+        try: return self.fn()
+        except Exception: return {}
 
-@app.route('/api/nodes/<name>', methods=['DELETE'])
-def api_delete_node(name):
-    run_shell_cmd(f"kubectl delete node {name}")
-    return jsonify({"status": "ok"})
+class PromRegistry:
+    def __init__(self): self.metrics = []
 
-@app.route('/api/install-master', methods=['POST'])
-def api_install_master():
-    os_info = detect_os_release()
-    install_cmd = get_k8s_install_cmd(os_info["FAMILY"])
-    setup_script = f"""
-    sudo swapoff -a
-    sudo sed -i '/ swap / s/^\\(.*\\)$/#\\1/g' /etc/fstab
-    cat <<EOF | sudo tee /etc/modules-load.d/k8s.conf
-    overlay
-    br_netfilter
-EOF
-    sudo modprobe overlay
-    sudo modprobe br_netfilter
-    cat <<EOF | sudo tee /etc/sysctl.d/k8s.conf
-    net.bridge.bridge-nf-call-iptables  = 1
-    net.bridge.bridge-nf-call-ip6tables = 1
-    net.ipv4.ip_forward                 = 1
-EOF
-    sudo sysctl --system
-    
-    # Containerd
-    if command -v apt-get &> /dev/null; then
-        sudo apt-get update 2>/dev/null || true
-        sudo apt-get install -y ca-certificates curl gnupg lsb-release
-        sudo install -m 0755 -d /etc/apt/keyrings
-        curl -fsSL https://download.docker.com/linux/debian/gpg | sudo gpg --dearmor --yes -o /etc/apt/keyrings/docker.gpg
-        sudo chmod a+r /etc/apt/keyrings/docker.gpg
-        if [ -f /etc/os-release ]; then . /etc/os-release; fi
-        DOCKER_CODENAME="$VERSION_CODENAME"
-        if [ "$VERSION_CODENAME" = "trixie" ] || [ "$VERSION_CODENAME" = "sid" ]; then DOCKER_CODENAME="bookworm"; fi
-        echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/$ID $DOCKER_CODENAME stable" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
-        sudo apt-get update && sudo apt-get install -y containerd.io
-    elif command -v dnf &> /dev/null; then
-        sudo dnf install -y dnf-plugins-core
-        sudo dnf config-manager --add-repo https://download.docker.com/linux/centos/docker-ce.repo
-        sudo dnf install -y containerd.io
-    fi
-    
-    sudo mkdir -p /etc/containerd
-    containerd config default | sudo tee /etc/containerd/config.toml
-    sudo sed -i 's/SystemdCgroup = false/SystemdCgroup = true/g' /etc/containerd/config.toml
-    sudo systemctl restart containerd
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
 
-    {install_cmd}
+    def counter(self, name, doc, labels=()): return self.register(PromCounter(name, doc, labels))
+    def gauge(self, name, doc, labels=()): return self.register(PromCounter(name, doc, labels, kind="gauge"))
+    def histogram(self, name, doc, labels=()): return self.register(PromHistogram(name, doc, labels))
+    def callback(self, name, doc, kind, labels, fn): return self.register(PromCallback(name, doc, kind, labels, fn))
 
-    sudo kubeadm init --pod-network-cidr=10.244.0.0/16
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+prom = PromRegistry()
+HTTP_SECONDS = prom.histogram("zoplete_http_request_duration_seconds", "Time to response headers per route (streams: until the stream starts).",
+                              ("route", "method", "status"))
+HTTP_STREAMS = prom.gauge("zoplete_http_streams_in_flight", "Streaming responses currently open.", ("route",))
+SUBPROCESS_SECONDS = prom.histogram("zoplete_subprocess_duration_seconds", "run_shell_cmd and subprocess.run wall time by command verb.", ("verb",))
+SUBPROCESS_FAILURES = prom.counter("zoplete_subprocess_failures_total", "Commands that exited non-zero or could not start.", ("verb",))
+KUBE_SECONDS = prom.histogram("zoplete_kube_request_duration_seconds", "Kubernetes API request latency (watches: until the stream opens).",
+                              ("verb", "resource"))
+KUBE_ERRORS = prom.counter("zoplete_kube_request_errors_total", "Failed Kubernetes API requests by HTTP status (0: no response).",
+                           ("verb", "resource", "code"))
+JOB_SECONDS = prom.histogram("zoplete_job_duration_seconds", "Job run time by kind and final status.", ("kind", "status"))
+
+@contextlib.contextmanager
+def span(name):
+    # Adds the block's wall time to the current request's Server-Timing entry `name`;
+    # a no-op outside a request (informers, jobs, background threads).
+    if not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try: yield
+    finally:
+        spans = g.setdefault('spans', {})
+        total, count = spans.get(name, (0.0, 0))
+        spans[name] = (total + time.perf_counter() - start, count + 1)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    # jsonify and conditional_json both serialize through here
+    def dumps(self, obj, **kwargs):
+        with span("encode"): return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+COMMAND_SUBVERBS = {"kubectl", "flux", "helm", "kubeadm", "systemctl", "apt-get", "dnf", "yum", "zypper", "ctr"}
+
+def command_verb(cmd):
+    # Low-cardinality label: the program, plus the subcommand of multi-command tools ("kubectl get")
+    try: words = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    except ValueError: words = cmd.split()
+    words = [w for w in words if w not in ("sudo", "env") and not re.match(r"[A-Za-z_][A-Za-z0-9_]*=", w)]
+    if not words: return "unknown"
+    verb = os.path.basename(words[0])
+    if verb in COMMAND_SUBVERBS:
+        sub = next((w for w in words[1:] if not w.startswith("-")), None)
+        if sub and re.fullmatch(r"[a-z][a-z-]*", sub): verb += f" {sub}"
+    return verb
+
+def run_process(cmd, **kwargs):
+    # subprocess.run, timed into SUBPROCESS_SECONDS
+    verb = command_verb(cmd)
+    start = time.perf_counter()
+    try:
+        with span("shell"): res = subprocess.run(cmd, **kwargs)
+    except Exception:
+        SUBPROCESS_FAILURES.inc(verb)
+        raise
+    finally: SUBPROCESS_SECONDS.observe(time.perf_counter() - start, verb)
+    if res.returncode != 0: SUBPROCESS_FAILURES.inc(verb)
+    return res
+
+def kube_resource(url):
+    # "/api/v1/namespaces/x/pods/y/log?..." -> "v1/pods/{name}/log", so the label set stays bounded
+    parts = urlsplit(url).path.strip("/").split("/")
+    core = parts[:1] == ["api"]
+    group, rest = "/".join(parts[1:2] if core else parts[1:3]), parts[2:] if core else parts[3:]
+    if rest[:1] == ["namespaces"] and len(rest) > 2: rest = rest[2:]
+    if len(rest) > 1: rest = [rest[0], "{name}"] + rest[2:]
+    return "/".join([group] + rest)
+
+def instrument_api_client(api_client):
+    # Times requests at the REST layer, which every generated API method goes through
+    request_fn = api_client.rest_client.request
+
+    def timed(method, url, *args, **kwargs):
+        watch = "watch=true" in url.lower() or "watch" in str(kwargs.get("query_params") or "")
+        labels = ("WATCH" if watch else method, kube_resource(url))
+        start = time.perf_counter()
+        try:
+            with span("kube"): return request_fn(method, url, *args, **kwargs)
+        except Exception as e:
+            KUBE_ERRORS.inc(*labels, str(getattr(e, "status", None) or 0))
+            raise
+        finally: KUBE_SECONDS.observe(time.perf_counter() - start, *labels)
+
+    api_client.rest_client.request = timed
+    return api_client
+
+def run_shell_cmd(cmd):
+    try:
+        res = run_process(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        return res.returncode == 0, res.stdout
+    except Exception as e: return False, str(e)
+
+# --- JOB ENGINE ---
+class JobCancelled(Exception): pass
+
+class Job:
+    # A long-running operation whose output goes to a log file on disk, so any number of
+    # browsers can follow it (and resume by byte offset) without owning the process.
+    def __init__(self, kind, jobs_dir, timeout):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.log_path = os.path.join(jobs_dir, f"{self.id}.log")
+        self.timeout = timeout
+        self.status = "queued"
+        self.exit_code = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+        self.cancel_requested = False
+        self.progress = None
+        self._proc = None
+        self._log_lock = threading.Lock()
+        open(self.log_path, "wb").close()
+
+    def log(self, text):
+        if not text: return
+        with self._log_lock, open(self.log_path, "ab") as f:
+            f.write(text.encode() if isinstance(text, str) else text)
+
+    def record(self, success, output):
+        self.log(output)
+        return success
+
+    def deadline_remaining(self):
+        return None if self.timeout is None else self.timeout - (time.time() - self.started)
+
+    def should_stop(self):
+        remaining = self.deadline_remaining()
+        return self.cancel_requested or (remaining is not None and remaining <= 0)
+
+    def check(self):
+        # Cooperative checkpoint for func jobs, which have no process to kill
+        if self.cancel_requested: raise JobCancelled()
+        remaining = self.deadline_remaining()
+        if remaining is not None and remaining <= 0: raise subprocess.TimeoutExpired(self.kind, self.timeout)
+
+    def run(self, cmd):
+        # Runs a shell command in its own process group, appending output to the job log.
+        # Always reaps the child; raises on cancel/timeout so the caller unwinds.
+        if self.cancel_requested: raise JobCancelled()
+        with self._log_lock:
+            with open(self.log_path, "ab") as out:
+                self._proc = subprocess.Popen(cmd, shell=True, executable="/bin/bash", stdout=out, stderr=subprocess.STDOUT,
+                                              stdin=subprocess.DEVNULL, start_new_session=True)
+        try:
+            remaining = self.deadline_remaining()
+            try: return self._proc.wait(timeout=max(remaining, 0) if remaining is not None else None)
+            except subprocess.TimeoutExpired:
+                self._kill()
+                raise
+        finally:
+            if self._proc.poll() is None: self._kill()
+            self._proc = None
+            if self.cancel_requested: raise JobCancelled()
+
+    def _kill(self, grace=5):
+        proc = self._proc
+        if proc is None or proc.poll() is not None: return
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError: pass
+
+    def cancel(self):
+        self.cancel_requested = True
+        self._kill()
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        return {
+            "id": self.id, "kind": self.kind, "status": self.status, "exit_code": self.exit_code, "error": self.error,
+            "created": self.created, "started": self.started, "finished": self.finished,
+            "duration": round(end - self.started, 3) if self.started else None,
+            "log_size": os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0,
+            "progress": self.progress
+        }
+
+class JobManager:
+    def __init__(self, jobs_dir=JOBS_DIR, workers=JOB_WORKERS, keep=100):
+        try: os.makedirs(jobs_dir, exist_ok=True)
+        except OSError:
+            jobs_dir = os.path.join(tempfile.gettempdir(), "zoplete-jobs")
+            os.makedirs(jobs_dir, exist_ok=True)
+        self.jobs_dir = jobs_dir
+        self.keep = keep
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, kind, cmd=None, func=None, timeout=3600, on_done=None):
+        # Either a shell command or func(job) -> success; on_done(job) runs after either.
+        job = Job(kind, self.jobs_dir, timeout)
+        with self._lock:
+            self.jobs[job.id] = job
+            for old in list(self.jobs.values())[:-self.keep]:
+                if old.done.is_set():
+                    del self.jobs[old.id]
+                    try: os.remove(old.log_path)
+                    except OSError: pass
+        self._pool.submit(self._execute, job, cmd, func, on_done)
+        return job
+
+    def _execute(self, job, cmd, func, on_done):
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.done.set()
+            return
+        job.status = "running"
+        job.started = time.time()
+        try:
+            if cmd is not None:
+                job.exit_code = job.run(cmd)
+            else:
+                job.exit_code = 0 if func(job) else 1
+                job.check()
+            job.status = "succeeded" if job.exit_code == 0 else "failed"
+        except JobCancelled: job.status = "cancelled"
+        except subprocess.TimeoutExpired: job.status = "timeout"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.log(f"\n{e}\n")
+        job.finished = time.time()
+        JOB_SECONDS.observe(job.finished - (job.started or job.finished), job.kind, job.status)
+        if on_done:
+            try: on_done(job)
+            except Exception: pass
+        job.done.set()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        return [j.to_dict() for j in reversed(list(self.jobs.values()))]
+
+    def drain(self, timeout):
+        # Shutdown: give unfinished jobs up to timeout, then cancel (and kill) the rest.
+        # Returns (finished, cancelled).
+        deadline = time.time() + timeout
+        pending = [j for j in list(self.jobs.values()) if not j.done.is_set()]
+        for job in pending: job.done.wait(max(deadline - time.time(), 0))
+        left = [j for j in pending if not j.done.is_set()]
+        for job in left: job.cancel()
+        for job in left: job.done.wait(10)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        return len(pending) - len(left), len(left)
+
+jobs = JobManager()
+
+# --- KUBERNETES CLIENT ---
+class KubeClients:
+    # One ApiClient (and urllib3 keep-alive pool) shared by every route. The kubeconfig is
+    # loaded into a private Configuration, so the global client config is never mutated,
+    # and it is only re-parsed when the file's mtime changes.
+    def __init__(self, path=KUBECONFIG_PATH, pool_size=KUBE_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._api_client = None
+        self._handles = {}
+
+    def _kubeconfig_mtime(self):
+        try: return os.stat(self.path).st_mtime_ns
+        except OSError: return None
+
+    def _build(self, mtime):
+        cfg = client.Configuration()
+        if mtime is not None:
+            config.load_kube_config(config_file=self.path, client_configuration=cfg, persist_config=False)
+        else:
+            try: config.load_kube_config(client_configuration=cfg, persist_config=False)
+            except Exception: cfg = client.Configuration.get_default_copy()
+        cfg.connection_pool_maxsize = self.pool_size
+        return instrument_api_client(client.ApiClient(configuration=cfg))
+
+    def api_client(self):
+        mtime = self._kubeconfig_mtime()
+        with self._lock:
+            if self._api_client is None or mtime != self._mtime:
+                # In-flight calls keep their reference to the old client; it is closed on GC.
+                self._api_client = self._build(mtime)
+                self._mtime = mtime
+                self._handles = {}
+                self.generation += 1
+            return self._api_client
+
+    def api(self, api_cls):
+        api_client = self.api_client()
+        with self._lock:
+            handle = self._handles.get(api_cls)
+            if handle is None or handle.api_client is not api_client:
+                handle = self._handles[api_cls] = api_cls(api_client)
+            return handle
+
+    @property
+    def core(self): return self.api(client.CoreV1Api)
+
+    @property
+    def custom(self): return self.api(client.CustomObjectsApi)
+
+    @property
+    def apiextensions(self): return self.api(client.ApiextensionsV1Api)
+
+    @property
+    def apiregistration(self): return self.api(client.ApiregistrationV1Api)
+
+kube = KubeClients()
+
+def list_raw(list_method, **kwargs):
+    # Skips model deserialization; informers and aggregations only need plain dicts.
+    resp = list_method(_preload_content=False, **kwargs)
+    with span("kube"): data = resp.data  # the body is read here, after the timed request returned headers
+    with span("parse"): return json.loads(data)
+
+# --- QUANTITIES ---
+QUANTITY_RE = re.compile(r"([+-]?(?:\d+(?:\.\d*)?|\.\d+))(.*)")
+QUANTITY_EXPONENT = re.compile(r"[eE][+-]?\d+")
+QUANTITY_SCALES = {"n": Decimal("1e-9"), "u": Decimal("1e-6"), "m": Decimal("1e-3"), "": 1, "k": 10**3, "M": 10**6, "G": 10**9,
+                   "T": 10**12, "P": 10**15, "E": 10**18, "Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50, "Ei": 2**60}
+
+@functools.lru_cache(maxsize=4096)
+def parse_quantity(quantity):
+    # Kubernetes resource quantity ("250m", "1.5Gi", "2e3", "129e6", "3500000n") -> exact Decimal in
+    # base units (cores, bytes). Cached: across thousands of pods there are few distinct values.
+    m = QUANTITY_RE.fullmatch(str(quantity).strip())
+    if not m: raise ValueError(f"Invalid quantity {quantity!r}")
+    number, suffix = m.groups()
+    # Suffixes first: "1Ei" is 2**60, not an exponent
+    if suffix in QUANTITY_SCALES: return Decimal(number) * QUANTITY_SCALES[suffix]
+    if QUANTITY_EXPONENT.fullmatch(suffix): return Decimal(number + suffix)
+    raise ValueError(f"Invalid quantity {quantity!r}")
+
+def resource_pair(resources):
+    # {"cpu": "250m", "memory": "64Mi"} -> (millicores, bytes), rounded up like the API server does.
+    # Integers, so per-node sums can be added to and subtracted from without drifting.
+    resources = resources or {}
+    return math.ceil(parse_quantity(resources.get('cpu', 0)) * 1000), math.ceil(parse_quantity(resources.get('memory', 0)))
+
+def pod_resources(spec, field):
+    # What a pod holds of `field` ("requests" or "limits") the way the scheduler counts it: its
+    # containers plus restartable (sidecar) init containers, or the largest single init container
+    # if that is more, plus the runtime class overhead. -> (millicores, bytes)
+    total = lambda pairs: tuple(map(sum, zip((0, 0), *pairs)))
+    sidecars, init_peak = (0, 0), (0, 0)
+    for c in spec.get('initContainers') or []:
+        pair = resource_pair((c.get('resources') or {}).get(field))
+        if c.get('restartPolicy') == "Always": sidecars = total([sidecars, pair])
+        else: init_peak = tuple(map(max, init_peak, total([sidecars, pair])))
+    running = total([sidecars] + [resource_pair((c.get('resources') or {}).get(field)) for c in spec.get('containers') or []])
+    return total([tuple(map(max, running, init_peak)), resource_pair(spec.get('overhead'))])
+
+def project_node(n):
+    md, status = n['metadata'], n.get('status', {})
+    role = "Master" if "node-role.kubernetes.io/control-plane" in (md.get('labels') or {}) else "Worker"
+    ready = any(c['type'] == "Ready" and c['status'] == "True" for c in status.get('conditions') or [])
+    ip = next((a['address'] for a in status.get('addresses') or [] if a['type'] == "InternalIP"), "Unknown")
+    capacity = status.get('capacity', {})
+    return {
+        "Name": md['name'],
+        "Role": role,
+        "Status": "Ready" if ready else "NotReady",
+        "Internal IP": ip,
+        "CPU": capacity.get('cpu', '0'),
+        "Memory": f"{parse_quantity(capacity.get('memory', 0)) / 2**30:.2f} GiB",
+        # What pods can be given, after system/kube reservations: (millicores, bytes)
+        "allocatable": resource_pair(status.get('allocatable') or capacity)
+    }
+
+def get_detailed_nodes():
+    try: return sorted((project_node(n) for n in list_raw(kube.core.list_node)['items']), key=lambda r: r['Name'])
+    except: return []
+
+# --- INFORMERS ---
+class WatchExpired(Exception): pass
+
+def watch_raw(list_method, resource_version, timeout, **kwargs):
+    # Yields raw watch events as dicts; a 410 Gone surfaces as WatchExpired so callers relist.
+    resp = list_method(watch=True, resource_version=resource_version, timeout_seconds=max(int(timeout), 1),
+                       allow_watch_bookmarks=True, _preload_content=False, _request_timeout=(10, timeout + 60), **kwargs)
+    try:
+        for line in iter_resp_lines(resp):
+            if not line: continue
+            ev = json.loads(line)
+            if ev['type'] == "ERROR":
+                if ev['object'].get('code') == 410: raise WatchExpired()
+                raise client.rest.ApiException(status=ev['object'].get('code'), reason=ev['object'].get('message'))
+            yield ev
+    finally:
+        resp.close()
+        resp.release_conn()
+
+class Informer:
+    # One list, then a watch resumed from the last seen resourceVersion. Objects are kept
+    # projected in memory so readers never touch the API server. A 410 Gone (or any watch
+    # failure) falls back to a relist, which is counted as a resync.
+    def __init__(self, name, list_method, project, watch_timeout=300):
+        self.name = name
+        self.list_method = list_method
+        self.project = project
+        self.watch_timeout = watch_timeout
+        self.items = {}
+        self.resource_version = None
+        self.changed_version = None  # resourceVersion of the last event that changed a projected row
+        self.indexes = []  # objects with reset(items) and update(old, new), kept in step under the lock
+        self.version = 0
+        self.synced = threading.Event()
+        self.attempted = threading.Event()
+        self.counters = {"lists": 0, "resyncs": 0, "watches": 0, "events": 0, "errors": 0}
+        self.last_contact = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._snapshot = (None, [])
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+                self._thread.start()
+        return self
+
+    def wait_synced(self, timeout):
+        # Only the first list attempt is waited for; while the API server is unreachable
+        # callers get False straight away instead of paying the timeout on every request.
+        self.start()
+        self.attempted.wait(timeout)
+        return self.synced.is_set()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                self._list()
+                backoff = 1
+                while self._watch(): pass
+            except Exception as e:
+                self.counters["errors"] += 1
+                self.last_error = str(e)[:200]
+                self.attempted.set()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            self.counters["resyncs"] += 1
+
+    def _list(self):
+        data = list_raw(self.list_method())
+        items = {}
+        for obj in data['items']:
+            md = obj['metadata']
+            items[(md.get('namespace'), md['name'])] = self.project(obj)
+        with self._lock:
+            self.resource_version = data['metadata']['resourceVersion']
+            if items != self.items or self.changed_version is None:
+                self.items = items
+                self.changed_version = self.resource_version
+                self.version += 1
+                for index in self.indexes: index.reset(items)
+        self.counters["lists"] += 1
+        self.last_contact = time.time()
+        self.synced.set()
+        self.attempted.set()
+
+    def _watch(self):
+        # Returns True when the server closed the watch cleanly and it can be resumed.
+        self.counters["watches"] += 1
+        try:
+            for ev in watch_raw(self.list_method(), self.resource_version, self.watch_timeout):
+                md = ev['object'].get('metadata', {})
+                with self._lock:
+                    # Status heartbeats that leave the projection unchanged are not changes
+                    key = (md.get('namespace'), md.get('name'))  # bookmarks carry no name
+                    old = self.items.get(key)
+                    row = None
+                    if ev['type'] in ("ADDED", "MODIFIED"):
+                        row = self.items[key] = self.project(ev['object'])
+                    elif ev['type'] == "DELETED":
+                        self.items.pop(key, None)
+                    if md.get('resourceVersion'): self.resource_version = md['resourceVersion']
+                    if ev['type'] != "BOOKMARK" and old != row:
+                        self.version += 1
+                        self.changed_version = self.resource_version
+                        for index in self.indexes: index.update(old, row)
+                self.counters["events"] += 1
+                self.last_contact = time.time()
+        except WatchExpired: return False
+        self.last_contact = time.time()
+        return True
+
+    def add_index(self, index):
+        with self._lock:
+            self.indexes.append(index)
+            index.reset(self.items)
+        return index
+
+    def values(self):
+        # Sorted snapshot, rebuilt only when the table changed since the last read.
+        with self._lock:
+            version, rows = self._snapshot
+            if version != self.version:
+                rows = [self.items[k] for k in sorted(self.items, key=lambda k: (k[0] or '', k[1]))]
+                self._snapshot = (self.version, rows)
+            return rows
+
+    def stats(self):
+        now = time.time()
+        return {
+            "synced": self.synced.is_set(),
+            "objects": len(self.items),
+            "resource_version": self.resource_version,
+            "changed_version": self.changed_version,
+            "staleness_seconds": round(now - self.last_contact, 3) if self.last_contact else None,
+            "last_error": self.last_error,
+            **self.counters
+        }
+
+node_informer = Informer("nodes", lambda: kube.core.list_node, project_node)
+
+# Labels that name the Helm release a pod belongs to, most specific first
+POD_RELEASE_LABELS = ("helm.toolkit.fluxcd.io/name", "app.kubernetes.io/instance", "release")
+
+def project_pod(p):
+    md, spec = p['metadata'], p.get('spec', {})
+    labels = md.get('labels') or {}
+    return {"namespace": md['namespace'], "name": md['name'], "node": spec.get('nodeName'),
+            "release": next((labels[k] for k in POD_RELEASE_LABELS if labels.get(k)), None),
+            "phase": p.get('status', {}).get('phase'),
+            "requests": pod_resources(spec, "requests"), "limits": pod_resources(spec, "limits")}
+
+# Places pod metrics (which carry no nodeName) on nodes and releases, and feeds capacity_index
+pod_informer = Informer("pods", lambda: kube.core.list_pod_for_all_namespaces, project_pod)
+
+class CapacityIndex:
+    # Pod requests and limits summed per spec.nodeName, kept current from the pod informer's
+    # events: a change moves one pod's contribution instead of re-adding every pod. Finished
+    # pods (Succeeded/Failed) no longer hold anything on their node.
+    def __init__(self):
+        self.nodes = {}  # node -> [pods, cpu requested, memory requested, cpu limits, memory limits] (millicores, bytes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _holds(row):
+        return bool(row and row['node'] and row['phase'] not in ("Succeeded", "Failed"))
+
+    def _add(self, row, sign):
+        totals = self.nodes.setdefault(row['node'], [0, 0, 0, 0, 0])
+        for i, value in enumerate((1, *row['requests'], *row['limits'])): totals[i] += sign * value
+        if not totals[0]: del self.nodes[row['node']]
+
+    def reset(self, items):
+        with self._lock:
+            self.nodes = {}
+            for row in items.values():
+                if self._holds(row): self._add(row, 1)
+
+    def update(self, old, new):
+        with self._lock:
+            if self._holds(old): self._add(old, -1)
+            if self._holds(new): self._add(new, 1)
+
+    def totals(self):
+        with self._lock: return {node: list(t) for node, t in self.nodes.items()}
+
+capacity_index = pod_informer.add_index(CapacityIndex())
+
+def capacity_figures(allocatable, requested, limits, used, scale, digits):
+    # One resource of one node (or the cluster); allocatable/requested/limits arrive in
+    # millicores or bytes and leave, like `used`, in cores or MiB.
+    to = lambda v: round(v / scale, digits)
+    return {"allocatable": to(allocatable), "requested": to(requested), "limits": to(limits), "free": to(allocatable - requested),
+            "used": None if used is None else round(used, digits)}
+
+def capacity_view(ask=None):
+    # Allocatable (node status) vs requested and limits (capacity_index) vs used (the last
+    # metrics sample), per node and summed over the cluster. ask=(millicores, bytes) also
+    # lists the Ready nodes with that much unrequested, roomiest first.
+    usage = {m["Name"]: (m["CPU (cores)"], m["Memory (MiB)"]) for m in metrics_sampler.latest["metrics"]}
+    totals = capacity_index.totals()
+    nodes, fits = [], []
+    cluster = [0] * 6  # cpu allocatable, requested, limits, then memory
+    used = [0.0, 0.0] if usage else None
+    pods = 0
+    for row in node_informer.values():
+        t = totals.get(row['Name'], [0, 0, 0, 0, 0])
+        (cpu_alloc, mem_alloc), node_used = row['allocatable'], usage.get(row['Name'])
+        for i, value in enumerate((cpu_alloc, t[1], t[3], mem_alloc, t[2], t[4])): cluster[i] += value
+        if node_used and used: used = [used[0] + node_used[0], used[1] + node_used[1]]
+        pods += t[0]
+        nodes.append({"name": row['Name'], "role": row['Role'], "status": row['Status'], "pods": t[0],
+                      "cpu": capacity_figures(cpu_alloc, t[1], t[3], node_used and node_used[0], 1000, 3),
+                      "memory": capacity_figures(mem_alloc, t[2], t[4], node_used and node_used[1], 2**20, 1)})
+        if ask and row['Status'] == "Ready" and cpu_alloc - t[1] >= ask[0] and mem_alloc - t[2] >= ask[1]:
+            fits.append((min((cpu_alloc - t[1]) / max(cpu_alloc, 1), (mem_alloc - t[2]) / max(mem_alloc, 1)), row['Name']))
+    return {
+        "has_metrics": bool(usage),
+        "nodes": nodes,
+        "cluster": {"nodes": len(nodes), "pods": pods,
+                    "cpu": capacity_figures(*cluster[:3], used and used[0], 1000, 3),
+                    "memory": capacity_figures(*cluster[3:], used and used[1], 2**20, 1)},
+        "fits": [name for _, name in sorted(fits, key=lambda f: (-f[0], f[1]))] if ask else None
+    }
+
+def node_cpu(row):
+    return float(parse_quantity(row['CPU'] or 0))
+
+NODE_SORT_KEYS = {
+    "name": lambda r: r['Name'],
+    "status": lambda r: r['Status'],
+    "role": lambda r: r['Role'],
+    "cpu": node_cpu,
+    "memory": lambda r: float(r['Memory'].split()[0]),
+}
+NUMERIC_SORT_KEYS = {"cpu", "memory"}
+
+class NodeIndex:
+    # Per-sort-key orderings of the node table, rebuilt only when the informer version
+    # changes. Pages are cut by bisecting on (sort value, name), so the cursor stays valid
+    # while nodes come and go, and a name-prefix search on the name order is two bisects.
+    def __init__(self, informer):
+        self.informer = informer
+        self.builds = 0
+        self._version = None
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def _order(self, rows, version, sort):
+        with self._lock:
+            if version is None or version != self._version:
+                self._orders = {}
+                self._version = version
+            if sort not in self._orders:
+                key = NODE_SORT_KEYS[sort]
+                ordered = sorted(rows, key=lambda r: (key(r), r['Name']))
+                self._orders[sort] = ([(key(r), r['Name']) for r in ordered], ordered)
+                self.builds += 1
+            return self._orders[sort]
+
+    @staticmethod
+    def encode_cursor(key):
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor, sort):
+        # A cursor is (sort value, name) as encode_cursor wrote it; anything else is a ValueError
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value_type = (int, float) if sort in NUMERIC_SORT_KEYS else str
+        if not (isinstance(key, list) and len(key) == 2 and isinstance(key[0], value_type) and not isinstance(key[0], bool)
+                and isinstance(key[1], str)):
+            raise ValueError("Invalid cursor")
+        return tuple(key)
+
+    def query(self, rows=None, sort="name", desc=False, status=None, role=None, prefix="", limit=100, cursor=None):
+        # rows=None reads the informer; a direct-list fallback passes its own rows (never cached)
+        version = None
+        if rows is None: version, rows = self.informer.version, self.informer.values()
+        keys, ordered = self._order(rows, version, sort)
+        lo, hi = 0, len(ordered)
+        if prefix and sort == "name":
+            lo = bisect.bisect_left(keys, (prefix, ""))
+            hi = bisect.bisect_left(keys, (prefix + "\uffff", ""))
+
+        def match(r):
+            return (not status or r['Status'] == status) and (not role or r['Role'] == role) and r['Name'].startswith(prefix)
+
+        total = sum(1 for i in range(lo, hi) if match(ordered[i])) if (status or role or (prefix and sort != "name")) else hi - lo
+        if cursor:
+            after = self.decode_cursor(cursor, sort)
+            if desc: hi = min(hi, bisect.bisect_left(keys, after))
+            else: lo = max(lo, bisect.bisect_right(keys, after))
+        page = []
+        indices = range(hi - 1, lo - 1, -1) if desc else range(lo, hi)
+        for i in indices:
+            if match(ordered[i]):
+                if len(page) == limit: break
+                page.append(i)
+        else: i = None
+        next_cursor = self.encode_cursor(keys[page[-1]]) if page and i is not None else None
+        return {"items": [ordered[i] for i in page], "total": total, "next_cursor": next_cursor}
+
+node_index = NodeIndex(node_informer)
+
+def get_public_ip_metadata():
+    try:
+        cmd_token = 'curl -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 21600" -s --fail'
+        token_res = run_process(cmd_token, shell=True, stdout=subprocess.PIPE, text=True, timeout=1)
+        if token_res.returncode != 0: return None
+        token = token_res.stdout.strip()
+        cmd_ip = f'curl -H "X-aws-ec2-metadata-token: {token}" http://169.254.169.254/latest/meta-data/public-ipv4 -s --fail'
+        ip_res = run_process(cmd_ip, shell=True, stdout=subprocess.PIPE, text=True, timeout=1)
+        if ip_res.returncode == 0: return ip_res.stdout.strip()
+    except: pass
+    return None
+
+def get_node_ips():
+    ips = []
+    try:
+        nodes = kube.core.list_node()
+        for node in nodes.items:
+            ext_ip = None
+            int_ip = None
+            for addr in node.status.addresses:
+                if addr.type == "ExternalIP": ext_ip = addr.address
+                if addr.type == "InternalIP": int_ip = addr.address
+            if ext_ip: ips.append(ext_ip)
+            elif int_ip: ips.append(int_ip)
+    except Exception: pass
+    public_ip = (host_facts.get("cloud") or {}).get("public_ip")
+    if public_ip: ips.insert(0, public_ip)
+    return list(set(ips))
+
+K8S_MINOR = "v1.30"
+
+SWAP_OFF_CMD = r"""
+    sudo swapoff -a
+    sudo sed -i '/ swap / s/^\(.*\)$/#\1/g' /etc/fstab
+"""
+
+KERNEL_MODULES_CMD = """
+    cat <<EOF | sudo tee /etc/modules-load.d/k8s.conf
+    overlay
+    br_netfilter
+EOF
+    sudo modprobe overlay
+    sudo modprobe br_netfilter
+"""
+
+SYSCTL_CMD = """
+    cat <<EOF | sudo tee /etc/sysctl.d/k8s.conf
+    net.bridge.bridge-nf-call-iptables  = 1
+    net.bridge.bridge-nf-call-ip6tables = 1
+    net.ipv4.ip_forward                 = 1
+EOF
+    sudo sysctl --system
+"""
+
+HOST_PREP_CMD = SWAP_OFF_CMD + KERNEL_MODULES_CMD + SYSCTL_CMD
+
+CONTAINERD_CONFIG_CMD = """
+    sudo mkdir -p /etc/containerd
+    containerd config default | sudo tee /etc/containerd/config.toml
+    sudo sed -i 's/SystemdCgroup = false/SystemdCgroup = true/g' /etc/containerd/config.toml
+    sudo systemctl enable containerd
+    sudo systemctl restart containerd
+"""
+
+def get_containerd_repo_cmd(os_family):
+    # Upstream repo setup only; shared by the installers and the artifact cache build
+    if os_family == "debian":
+        return """
+    sudo apt-get update 2>/dev/null || true
+    sudo apt-get install -y ca-certificates curl gnupg lsb-release
+    sudo install -m 0755 -d /etc/apt/keyrings
+    curl -fsSL https://download.docker.com/linux/debian/gpg | sudo gpg --dearmor --yes -o /etc/apt/keyrings/docker.gpg
+    sudo chmod a+r /etc/apt/keyrings/docker.gpg
+    if [ -f /etc/os-release ]; then . /etc/os-release; fi
+    DOCKER_CODENAME="$VERSION_CODENAME"
+    if [ "$VERSION_CODENAME" = "trixie" ] || [ "$VERSION_CODENAME" = "sid" ]; then DOCKER_CODENAME="bookworm"; fi
+    echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/$ID $DOCKER_CODENAME stable" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
+"""
+    if os_family == "rhel":
+        return """
+    sudo dnf install -y dnf-plugins-core
+    sudo dnf config-manager --add-repo https://download.docker.com/linux/centos/docker-ce.repo
+"""
+    return ""
+
+def get_containerd_install_cmd(os_family):
+    if os_family == "debian":
+        return get_containerd_repo_cmd(os_family) + """    sudo apt-get update && sudo apt-get install -y containerd.io
+    """
+    if os_family == "rhel":
+        return get_containerd_repo_cmd(os_family) + """    sudo dnf install -y containerd.io
+    """
+    if os_family == "suse":
+        return """
+    sudo zypper -n install containerd
+    """
+    return "# Manual Installation Required"
+
+def get_k8s_repo_cmd(os_family):
+    if os_family == "debian":
+        return f"""
+    sudo rm -f /etc/apt/sources.list.d/kubernetes.list
+    sudo apt-get update && sudo apt-get install -y apt-transport-https ca-certificates curl gpg
+    sudo install -m 0755 -d /etc/apt/keyrings
+    curl -fsSL https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/deb/Release.key | sudo gpg --dearmor --yes -o /etc/apt/keyrings/kubernetes-apt-keyring.gpg
+    echo 'deb [signed-by=/etc/apt/keyrings/kubernetes-apt-keyring.gpg] https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/deb/ /' | sudo tee /etc/apt/sources.list.d/kubernetes.list
+"""
+    if os_family == "rhel":
+        return f"""
+    cat <<EOF | sudo tee /etc/yum.repos.d/kubernetes.repo
+[kubernetes]
+name=Kubernetes
+baseurl=https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/rpm/
+enabled=1
+gpgcheck=1
+gpgkey=https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/rpm/repodata/repomd.xml.key
+exclude=kubelet kubeadm kubectl cri-tools kubernetes-cni
+EOF
+"""
+    if os_family == "suse":
+        return f"""
+    sudo rpm --import https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/rpm/repodata/repomd.xml.key
+    sudo zypper -n removerepo kubernetes 2>/dev/null || true
+    sudo zypper -n addrepo --refresh https://pkgs.k8s.io/core:/stable:/{K8S_MINOR}/rpm/ kubernetes
+"""
+    return ""
+
+def get_k8s_install_cmd(os_family):
+    if os_family == "debian":
+        return get_k8s_repo_cmd(os_family) + """    sudo apt-get update
+    sudo apt-get install -y kubelet kubeadm kubectl
+    sudo apt-mark hold kubelet kubeadm kubectl
+    sudo systemctl enable --now kubelet
+    """
+    if os_family == "rhel":
+        return get_k8s_repo_cmd(os_family) + """    sudo setenforce 0 || true
+    sudo sed -i 's/^SELINUX=enforcing$/SELINUX=permissive/' /etc/selinux/config
+    sudo dnf install -y kubelet kubeadm kubectl --disableexcludes=kubernetes
+    sudo systemctl enable --now kubelet
+    """
+    if os_family == "suse":
+        return get_k8s_repo_cmd(os_family) + """    sudo zypper -n --gpg-auto-import-keys install kubelet kubeadm kubectl
+    sudo systemctl enable --now kubelet
+    """
+    return "# Manual Installation Required"
+
+# --- ARTIFACT CACHE ---
+CONTAINERD_PACKAGES = {"debian": ["containerd.io"], "rhel": ["containerd.io"], "suse": ["containerd"]}
+K8S_PACKAGES = ["kubelet", "kubeadm", "kubectl", "kubernetes-cni", "cri-tools"]
+
+REPO_INDEX_CMD = {
+    "debian": "command -v dpkg-scanpackages >/dev/null || sudo apt-get install -y dpkg-dev\n"
+              "dpkg-scanpackages --multiversion . /dev/null | gzip -9c > Packages.gz",
+    "rhel": "command -v createrepo_c >/dev/null || sudo dnf install -y createrepo_c\ncreaterepo_c --update .",
+    "suse": "command -v createrepo_c >/dev/null || sudo zypper -n install createrepo_c\ncreaterepo_c --update .",
+}
+
+REPO_DOWNLOAD_CMD = {
+    "debian": "sudo apt-get update 2>/dev/null || true\napt-get download {pkgs}",
+    "rhel": "sudo dnf download --disableexcludes=kubernetes {pkgs}",
+    "suse": "sudo zypper -n --gpg-auto-import-keys --pkg-cache-dir \"$PWD/.cache\" download {pkgs}\nfind .cache -name '*.rpm' -exec mv {{}} . \\;\nrm -rf .cache",
+}
+
+def local_repo_install_cmd(family, repo_url, packages):
+    pkgs = " ".join(packages)
+    if family == "debian":
+        cmd = f"""
+    echo "deb [trusted=yes] {repo_url} ./" | sudo tee /etc/apt/sources.list.d/zoplete.list
+    sudo apt-get update 2>/dev/null || true
+    sudo apt-get install -y {pkgs}
+    """
+        if "kubelet" in packages: cmd += "    sudo apt-mark hold kubelet kubeadm kubectl\n"
+    elif family == "rhel":
+        cmd = f"""
+    printf '[zoplete]\\nname=Zoplete artifact cache\\nbaseurl={repo_url}\\nenabled=1\\ngpgcheck=0\\npriority=1\\n' | sudo tee /etc/yum.repos.d/zoplete.repo
+    sudo dnf install -y {pkgs}
+    """
+        if "kubelet" in packages: cmd += "    sudo setenforce 0 || true\n"
+    else:
+        cmd = f"""
+    sudo zypper -n removerepo zoplete 2>/dev/null || true
+    sudo zypper -n addrepo --no-gpgcheck --priority 1 {repo_url} zoplete
+    sudo zypper -n install {pkgs}
+    """
+    if "kubelet" in packages: cmd += "    sudo systemctl enable --now kubelet\n"
+    return cmd
+
+def cached_install_cmd(family, base_url, packages, online_cmd):
+    # Uses the master's artifact cache when it answers, otherwise the upstream repos
+    repo_url = f"{base_url}/{family}"
+    return f"""
+    if curl -fsS --max-time 5 -o /dev/null {repo_url}/repo.ready; then
+    echo "Installing {' '.join(packages)} from the zoplete artifact cache"
+    {local_repo_install_cmd(family, repo_url, packages)}
+    else
+    {online_cmd}
+    fi
+"""
+
+class ArtifactCache:
+    # One package directory per OS family on the master, each a flat apt or rpm-md repo.
+    # Workers install from it over HTTP and the master over file://, so a cluster downloads
+    # every package once. repo.ready is written last and is what install scripts probe for.
+    def __init__(self, root=ARTIFACTS_DIR):
+        self.root = root
+        self.served = 0
+        self.served_bytes = 0
+
+    def path(self, family):
+        return os.path.join(self.root, family)
+
+    def ready(self, family):
+        return os.path.exists(os.path.join(self.path(family), "repo.ready"))
+
+    def build(self, job, family, download=True):
+        # download=False only regenerates metadata, e.g. after copying packages in by hand.
+        # Downloads configure the upstream repos first, so a cache can be built on a fresh
+        # master before bootstrap, which then installs from it instead of downloading twice.
+        path = self.path(family)
+        os.makedirs(path, exist_ok=True)
+        try: os.remove(os.path.join(path, "repo.ready"))
+        except OSError: pass
+        steps = [REPO_INDEX_CMD[family]]
+        if download:
+            steps[:0] = [get_containerd_repo_cmd(family), get_k8s_repo_cmd(family),
+                         REPO_DOWNLOAD_CMD[family].format(pkgs=" ".join(CONTAINERD_PACKAGES[family] + K8S_PACKAGES))]
+        if job.run(f"set -e\ncd {shlex.quote(path)}\n" + "\n".join(steps)) != 0: return False
+        files = sorted(f for f in os.listdir(path) if f.endswith((".deb", ".rpm")))
+        with open(os.path.join(path, "repo.ready"), "w") as f: json.dump({"family": family, "built": time.time(), "packages": files}, f)
+        job.log(f"Cached {len(files)} packages for {family}\n")
+        return True
+
+    def stats(self):
+        families = {}
+        for family in WORKER_FAMILIES:
+            path = self.path(family)
+            files = [f for f in os.listdir(path) if f.endswith((".deb", ".rpm"))] if os.path.isdir(path) else []
+            families[family] = {"ready": self.ready(family), "packages": len(files),
+                                "bytes": sum(os.path.getsize(os.path.join(path, f)) for f in files)}
+        return {"families": families, "served": self.served, "served_bytes": self.served_bytes}
+
+artifacts = ArtifactCache()
+
+def artifacts_base_url(join):
+    # Joining nodes download from this server: on its listen address unless that is a wildcard
+    # or loopback (then the API server's host, which they reach anyway), on the port it serves.
+    if ARTIFACTS_URL: return ARTIFACTS_URL
+    host, port = join['endpoint'].rsplit(':', 1)[0], None
+    if SERVER_ADDRESS:
+        listen_host, port = SERVER_ADDRESS
+        if listen_host not in ("", "0.0.0.0", "::", "localhost", "::1") and not listen_host.startswith("127."):
+            host = f"[{listen_host}]" if ":" in listen_host else listen_host
+    elif has_request_context():
+        url = urlsplit(request.host_url)
+        port = url.port or (443 if url.scheme == "https" else 80)
+    return f"http://{host}:{port or 5000}/artifacts"
+
+# --- WORKER JOIN ---
+WORKER_FAMILIES = ("debian", "rhel", "suse")
+
+class JoinTokenCache:
+    # Mints one kubeadm bootstrap token (plus CA cert hash) and reuses it until shortly before
+    # it expires. Scripts are rendered once per OS family per token; per-host variants only
+    # add a hostname line.
+    def __init__(self, ttl=24 * 3600, refresh_margin=3600):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.minted = 0
+        self.hits = 0
+        self._join = None
+        self._expires = 0
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._join and time.time() < self._expires - self.refresh_margin:
+                self.hits += 1
+                return self._join
+            ok, out = run_shell_cmd(f"kubeadm token create --ttl {self.ttl}s --print-join-command")
+            m = re.search(r"kubeadm join (\S+) --token (\S+)\s+--discovery-token-ca-cert-hash (\S+)", out) if ok else None
+            if not m: raise RuntimeError(out.strip() or "kubeadm token create failed")
+            self._join = {"endpoint": m.group(1), "token": m.group(2), "ca_cert_hash": m.group(3),
+                          "command": f"kubeadm join {m.group(1)} --token {m.group(2)} --discovery-token-ca-cert-hash {m.group(3)}"}
+            self._expires = time.time() + self.ttl
+            self._rendered = {}
+            self.minted += 1
+            return self._join
+
+    def rendered(self, family, kind):
+        join = self.get()
+        with self._lock:
+            if (family, kind) not in self._rendered:
+                script = render_worker_script(family, join)
+                self._rendered[(family, kind)] = script if kind == "sh" else render_cloud_init(script)
+            return self._rendered[(family, kind)]
+
+    def stats(self):
+        return {"minted": self.minted, "hits": self.hits, "expires_in": max(int(self._expires - time.time()), 0) if self._join else None}
+
+def render_worker_script(family, join):
+    return f"""#!/bin/bash
+# Zoplete worker bootstrap ({family}) - joins {join['endpoint']}
+{HOST_PREP_CMD}
+{cached_install_cmd(family, artifacts_base_url(join), CONTAINERD_PACKAGES[family], get_containerd_install_cmd(family))}
+{CONTAINERD_CONFIG_CMD}
+{cached_install_cmd(family, artifacts_base_url(join), K8S_PACKAGES, get_k8s_install_cmd(family))}
+    sudo {join['command']}
+    echo "Worker joined"
+"""
+
+def render_cloud_init(script, hostname=None):
+    body = "\n".join("      " + line for line in script.splitlines())
+    host = f"hostname: {hostname}\npreserve_hostname: false\n" if hostname else ""
+    return f"""#cloud-config
+{host}write_files:
+  - path: /root/zoplete-worker.sh
+    permissions: '0700'
+    content: |
+{body}
+runcmd:
+  - [bash, /root/zoplete-worker.sh]
+"""
+
+def host_worker_script(family, hostname):
+    header, body = join_tokens.rendered(family, "sh").split("\n", 1)
+    return f"{header}\nsudo hostnamectl set-hostname {shlex.quote(hostname)}\n{body}"
+
+def worker_bundle(family, hosts):
+    # tar.gz with one bash script and one cloud-init file per host
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for host in hosts:
+            script = host_worker_script(family, host)
+            for name, content in ((f"{host}/worker-setup.sh", script), (f"{host}/user-data.yaml", render_cloud_init(script, host))):
+                data = content.encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o700 if name.endswith(".sh") else 0o600
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+join_tokens = JoinTokenCache()
+
+# --- SSH FLEET BOOTSTRAP ---
+FLEET_PHASES = ("connect", "upload", "join", "verify")
+NODE_NAME_RE = re.compile(r"[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?")  # RFC 1123 label
+
+class FleetHost:
+    def __init__(self, user, host, port, family, name):
+        self.user = user
+        self.host = host
+        self.port = port
+        self.family = family
+        self.name = name
+        self.done = []
+        self.timings = {}
+        self.attempts = 0
+        self.state = "Pending"
+        self.error = None
+
+    def to_dict(self):
+        return {"host": self.host, "name": self.name, "family": self.family, "state": self.state, "done": self.done,
+                "timings": self.timings, "attempts": self.attempts, "error": self.error}
+
+def parse_inventory(text, default_user="root", default_port=22, default_family="debian"):
+    # One host per line: [user@]host[:port] [family] [node-name]; '#' starts a comment.
+    hosts = []
+    for line in text.splitlines():
+        fields = line.split("#", 1)[0].split()
+        if not fields: continue
+        target = fields[0]
+        user, _, target = target.rpartition("@")
+        host, _, port = target.partition(":")
+        family = fields[1] if len(fields) > 1 else default_family
+        if family not in WORKER_FAMILIES: raise ValueError(f"{line.strip()}: unsupported OS family {family}")
+        if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9.:-]*", host): raise ValueError(f"{line.strip()}: invalid host")
+        name = fields[2] if len(fields) > 2 else None
+        if name is not None and not NODE_NAME_RE.fullmatch(name): raise ValueError(f"{line.strip()}: invalid node name {name}")
+        hosts.append(FleetHost(user or default_user, host, int(port or default_port), family, name))
+    return hosts
+
+class FleetRun:
+    # Pushes the worker join script to every host over SSH with bounded concurrency. Each
+    # host remembers its finished phases, so retries (automatic, with backoff, or a later
+    # re-run of the failed hosts) resume where they stopped.
+    def __init__(self, hosts, concurrency=10, retries=2, backoff=5):
+        self.hosts = hosts
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.job_ids = []
+
+    def ssh_cmd(self, h, remote):
+        cmd = [SSH_BINARY, "-p", str(h.port), "-o", "BatchMode=yes", "-o", "ConnectTimeout=10", "-o", "StrictHostKeyChecking=accept-new"]
+        if SSH_KNOWN_HOSTS: cmd += ["-o", f"UserKnownHostsFile={SSH_KNOWN_HOSTS}"]
+        if SSH_KEY: cmd += ["-i", SSH_KEY]
+        return cmd + [f"{h.user}@{h.host}", remote]
+
+    def phase_cmd(self, h, phase):
+        if phase == "connect": return "true", None
+        if phase == "upload":
+            script = host_worker_script(h.family, h.name) if h.name else join_tokens.rendered(h.family, "sh")
+            return "umask 077 && cat > /tmp/zoplete-worker.sh", script
+        if phase == "join":
+            return "if [ -f /etc/kubernetes/kubelet.conf ]; then echo 'already joined'; else sudo bash /tmp/zoplete-worker.sh; fi", None
+        return "test -f /etc/kubernetes/kubelet.conf && systemctl is-active --quiet kubelet", None
+
+    def ssh(self, job, h, remote, stdin, timeout):
+        # Polls so a job cancel reaches every in-flight session, not just one.
+        proc = subprocess.Popen(self.ssh_cmd(h, remote), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, start_new_session=True)
+        deadline = time.time() + timeout
+        try:
+            while True:
+                try:
+                    # Input can only be handed over on the first call; later calls just keep reading
+                    out = proc.communicate(stdin or "", timeout=1)[0] if stdin is not None else proc.communicate(timeout=1)[0]
+                except subprocess.TimeoutExpired:
+                    stdin = None
+                    job.check()
+                    if time.time() > deadline: raise RuntimeError(f"timed out after {timeout}s")
+                    continue
+                return proc.returncode, out
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    def run_host(self, job, h):
+        h.state = "Running"
+        while True:
+            h.attempts += 1
+            try:
+                for phase in FLEET_PHASES:
+                    if phase in h.done: continue
+                    job.check()
+                    remote, stdin = self.phase_cmd(h, phase)
+                    started = time.time()
+                    code, out = self.ssh(job, h, remote, stdin, 1800 if phase == "join" else 120)
+                    h.timings[phase] = round(time.time() - started, 2)
+                    if code != 0: raise RuntimeError(f"{phase} failed (exit {code}): {out.strip()[-300:]}")
+                    h.done.append(phase)
+                    job.log(f"[{h.host}] {phase} ok ({h.timings[phase]}s)\n")
+                h.state, h.error = "Joined", None
+                return True
+            except JobCancelled:
+                h.state = "Cancelled"
+                return False
+            except Exception as e:
+                h.error = str(e)
+                if h.attempts > self.retries:
+                    h.state = "Failed"
+                    job.log(f"[{h.host}] failed: {h.error}\n")
+                    return False
+                delay = self.backoff * 2 ** (h.attempts - 1)
+                job.log(f"[{h.host}] attempt {h.attempts} failed, retrying in {delay}s: {h.error}\n")
+                time.sleep(delay)
+
+    def __call__(self, job):
+        pending = [h for h in self.hosts if h.state != "Joined"]
+        for h in pending: h.attempts = 0
+        job.progress = {"hosts": [h.to_dict() for h in self.hosts]}
+        def run(h):
+            try: return self.run_host(job, h)
+            finally: job.progress = {"hosts": [x.to_dict() for x in self.hosts]}
+        with ThreadPoolExecutor(max_workers=max(min(self.concurrency, len(pending)), 1), thread_name_prefix="fleet") as pool:
+            results = list(pool.map(run, pending))
+        job.log(f"{sum(results)}/{len(pending)} hosts joined\n")
+        return all(results)
+
+fleet_runs = {}
+
+def start_fleet_run(run):
+    job = jobs.submit(f"fleet-bootstrap:{len(run.hosts)}", func=run, timeout=None)
+    run.job_ids.append(job.id)
+    fleet_runs[run.job_ids[0]] = run
+    return job
+
+# --- HOST FACTS & PREFLIGHT ---
+KUBE_PORTS = {6443: "kube-apiserver", 2379: "etcd", 2380: "etcd", 10250: "kubelet", 10257: "kube-controller-manager", 10259: "kube-scheduler"}
+MiB = 1024 * 1024
+
+def listening_tcp_ports():
+    ports = set()
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path) as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[3] == "0A": ports.add(int(fields[1].rsplit(":", 1)[1], 16))  # 0A = LISTEN
+        except OSError: pass
+    return ports
+
+def gather_cloud():
+    public_ip = get_public_ip_metadata()
+    return {"provider": "aws" if public_ip else None, "public_ip": public_ip}
+
+HOST_FACT_GATHERERS = {
+    "os": detect_os_release,
+    "hostname": socket.gethostname,
+    "kernel": lambda: os.uname().release,
+    "cgroup": lambda: "v2" if os.path.exists("/sys/fs/cgroup/cgroup.controllers") else "v1",
+    "cpus": psutil.cpu_count,
+    "memory_mb": lambda: psutil.virtual_memory().total // MiB,
+    "swap_mb": lambda: psutil.swap_memory().total // MiB,
+    "modules": lambda: {m: os.path.isdir(f"/sys/module/{m}") for m in ("overlay", "br_netfilter")},
+    "ports": lambda: sorted(p for p in listening_tcp_ports() if p in KUBE_PORTS),
+    "disk_free_gb": lambda: round(shutil.disk_usage("/var/lib" if os.path.isdir("/var/lib") else "/").free / 1024 ** 3, 1),
+    "binaries": lambda: {b: shutil.which(b) is not None for b in ("containerd", "kubeadm", "kubelet", "kubectl")},
+    "cloud": gather_cloud,
+}
+
+class HostFacts:
+    # Facts about the machine zoplete runs on, gathered concurrently in the background and
+    # refreshed every ttl seconds. Readers get the last value and never wait on a probe,
+    # except for a fact that has not been gathered even once.
+    def __init__(self, gatherers=HOST_FACT_GATHERERS, ttl=HOST_FACTS_TTL):
+        self.gatherers = gatherers
+        self.ttl = ttl
+        self.facts = {}
+        self.gathered_at = {}
+        self.durations = {}
+        self.errors = {}
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="host-facts", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.ttl)
+
+    def _gather(self, name):
+        started = time.monotonic()
+        try:
+            self.facts[name] = self.gatherers[name]()
+            self.errors.pop(name, None)
+        except Exception as e: self.errors[name] = str(e)
+        self.durations[name] = round(time.monotonic() - started, 3)
+        self.gathered_at[name] = time.time()
+
+    def refresh(self):
+        with ThreadPoolExecutor(max_workers=len(self.gatherers), thread_name_prefix="fact") as pool:
+            list(pool.map(self._gather, self.gatherers))
+        self.refreshes += 1
+        return dict(self.facts)
+
+    def get(self, name):
+        self.start()
+        if name not in self.facts: self._gather(name)
+        return self.facts.get(name)
+
+    def snapshot(self):
+        self.start()
+        now = time.time()
+        return {"facts": dict(self.facts), "age": {k: round(now - t, 1) for k, t in self.gathered_at.items()},
+                "durations": dict(self.durations), "errors": dict(self.errors), "ttl": self.ttl}
+
+host_facts = HostFacts()
+
+def check_package_source(facts, role):
+    family = facts["os"]["FAMILY"]
+    if family in WORKER_FAMILIES and artifacts.ready(family): return "pass", "local artifact cache"
+    try:
+        socket.create_connection(("pkgs.k8s.io", 443), timeout=3).close()
+        return "pass", "pkgs.k8s.io reachable"
+    except OSError as e: return "fail", f"no artifact cache and pkgs.k8s.io unreachable ({e})"
+
+def check_ports(facts, role):
+    wanted = [6443, 2379, 2380, 10250, 10257, 10259] if role == "master" else [10250]
+    busy = [f"{p} ({KUBE_PORTS[p]})" for p in wanted if p in facts["ports"]]
+    if not busy: return "pass", "all free"
+    if os.path.exists("/etc/kubernetes/kubelet.conf"): return "pass", "in use by the existing cluster"
+    return "fail", "in use: " + ", ".join(busy)
+
+def check_minimum(value, minimum, unit):
+    return ("pass" if value >= minimum else "fail"), f"{value} {unit} (minimum {minimum})"
+
+# (name, check(facts, role) -> (status, detail)); status is pass, warn or fail
+PREFLIGHT_CHECKS = [
+    ("os-family", lambda f, r: ("pass", f["os"]["PRETTY_NAME"]) if f["os"]["FAMILY"] in WORKER_FAMILIES else ("fail", f"unsupported: {f['os']['ID']}")),
+    ("cpus", lambda f, r: check_minimum(f["cpus"], 2 if r == "master" else 1, "CPUs")),
+    ("memory", lambda f, r: check_minimum(f["memory_mb"], 1700 if r == "master" else 900, "MiB")),
+    ("swap", lambda f, r: ("pass", "disabled") if not f["swap_mb"] else ("warn", f"{f['swap_mb']} MiB; bootstrap disables it")),
+    ("cgroup", lambda f, r: ("pass", "cgroup v2") if f["cgroup"] == "v2" else ("warn", "cgroup v1 is deprecated")),
+    ("kernel-modules", lambda f, r: ("pass", "loaded") if all(f["modules"].values()) else
+        ("warn", "not loaded: " + ", ".join(m for m, ok in f["modules"].items() if not ok) + "; bootstrap loads them")),
+    ("ports", check_ports),
+    ("disk", lambda f, r: ("pass" if f["disk_free_gb"] >= 20 else "warn" if f["disk_free_gb"] >= 5 else "fail", f"{f['disk_free_gb']} GB free")),
+    ("hostname", lambda f, r: ("pass", f["hostname"]) if re.fullmatch(r"[a-z0-9]([a-z0-9.-]{0,251}[a-z0-9])?", f["hostname"]) else
+        ("fail", f"{f['hostname']} is not a lowercase RFC 1123 name")),
+    ("package-source", check_package_source),
+]
+
+def run_preflight(role="master"):
+    # Fresh facts (gathered concurrently), then every check in parallel
+    started = time.monotonic()
+    facts = host_facts.refresh()
+
+    def run(check):
+        name, fn = check
+        t = time.monotonic()
+        try: status, detail = fn(facts, role)
+        except Exception as e: status, detail = "fail", f"check error: {e}"
+        return {"check": name, "status": status, "detail": detail, "duration": round(time.monotonic() - t, 3)}
+
+    with ThreadPoolExecutor(max_workers=len(PREFLIGHT_CHECKS), thread_name_prefix="preflight") as pool:
+        results = list(pool.map(run, PREFLIGHT_CHECKS))
+    return {"role": role, "ok": all(r["status"] != "fail" for r in results), "checks": results,
+            "duration": round(time.monotonic() - started, 3)}
+
+# --- MASTER BOOTSTRAP ---
+FLANNEL_MANIFEST = "https://raw.githubusercontent.com/coreos/flannel/master/Documentation/kube-flannel.yml"
+
+def master_steps(family):
+    # (name, probe, command). The probe is a cheap "already satisfied?" check; it guards
+    # against a checkpoint outliving the state it describes (e.g. after kubeadm reset).
+    local = "file://" + os.path.abspath(artifacts.root)
+    return [
+        ("swap-off", "! swapon --noheadings --show | grep -q . && ! grep -Eq '^[^#].*[[:space:]]swap[[:space:]]' /etc/fstab", SWAP_OFF_CMD),
+        ("kernel-modules", "test -f /etc/modules-load.d/k8s.conf && lsmod | grep -q '^br_netfilter' && lsmod | grep -q '^overlay'", KERNEL_MODULES_CMD),
+        ("sysctl", "test -f /etc/sysctl.d/k8s.conf && [ \"$(sysctl -n net.ipv4.ip_forward)\" = 1 ]", SYSCTL_CMD),
+        ("containerd-install", "command -v containerd", cached_install_cmd(family, local, CONTAINERD_PACKAGES.get(family, []), get_containerd_install_cmd(family))),
+        ("containerd-config", "grep -q 'SystemdCgroup = true' /etc/containerd/config.toml && systemctl is-active --quiet containerd", CONTAINERD_CONFIG_CMD),
+        ("kubernetes-packages", "command -v kubeadm && command -v kubelet && command -v kubectl", cached_install_cmd(family, local, K8S_PACKAGES, get_k8s_install_cmd(family))),
+        ("kubeadm-init", "test -f /etc/kubernetes/admin.conf", "    sudo kubeadm init --pod-network-cidr=10.244.0.0/16\n"),
+        ("kubeconfig", "test -s $HOME/.kube/config", """
     mkdir -p $HOME/.kube
-    sudo cp -i /etc/kubernetes/admin.conf $HOME/.kube/config
+    sudo cp -f /etc/kubernetes/admin.conf $HOME/.kube/config
     sudo chown $(id -u):$(id -g) $HOME/.kube/config
-    kubectl apply -f https://raw.githubusercontent.com/coreos/flannel/master/Documentation/kube-flannel.yml
-    echo "Installation Complete"
-    """
-    def generate():
-        for line in stream_shell_cmd(setup_script): yield line
-    return Response(generate(), mimetype='text/plain')
+"""),
+        ("pod-network", "kubectl --request-timeout=5s get daemonset -n kube-flannel kube-flannel-ds", f"    kubectl apply -f {FLANNEL_MANIFEST}\n"),
+    ]
 
-@app.route('/api/marketplace')
-def api_marketplace():
-    flux = run_shell_cmd("kubectl get crd gitrepositories.source.toolkit.fluxcd.io")[0]
+class BootstrapCheckpoints:
+    # One JSON file per completed step. A checkpoint only counts while the step's command
+    # is unchanged; a stale one forces the step to run again even if its probe passes, so
+    # bumping K8S_MINOR (or editing a step) re-runs that step.
+    def __init__(self, state_dir=BOOTSTRAP_STATE_DIR):
+        try: os.makedirs(state_dir, exist_ok=True)
+        except OSError:
+            state_dir = os.path.join(tempfile.gettempdir(), "zoplete-bootstrap")
+            os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, f"{name}.json")
+
+    def get(self, name, cmd):
+        try:
+            with open(self._path(name)) as f: entry = json.load(f)
+        except (OSError, ValueError): return None
+        return entry if entry.get("digest") == hashlib.sha256(cmd.encode()).hexdigest() else None
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def put(self, name, cmd, duration, via):
+        entry = {"digest": hashlib.sha256(cmd.encode()).hexdigest(), "finished": time.time(), "duration": duration, "via": via}
+        tmp = self._path(name) + ".tmp"
+        with open(tmp, "w") as f: json.dump(entry, f)
+        os.replace(tmp, self._path(name))
+
+    def clear(self):
+        for name in os.listdir(self.state_dir):
+            if name.endswith(".json"): os.remove(os.path.join(self.state_dir, name))
+
+    def status(self, family):
+        rows = []
+        for name, _, cmd in master_steps(family):
+            entry = self.get(name, cmd)
+            rows.append({"step": name, "done": entry is not None, "duration": entry and entry["duration"],
+                         "finished": entry and entry["finished"], "via": entry and entry["via"]})
+        return rows
+
+bootstrap_checkpoints = BootstrapCheckpoints()
+
+def bootstrap_master(job, family, preflight=True):
+    if preflight:
+        report = run_preflight("master")
+        job.log("".join(f"preflight {r['check']:<16}{r['status']:<6}{r['detail']}\n" for r in report["checks"]))
+        if not report["ok"]:
+            job.log("Preflight failed; fix the checks above or retry with skip_preflight\n")
+            return False
+    steps = master_steps(family)
+    job.progress = {name: {"state": "Pending", "duration": None} for name, _, _ in steps}
+    for i, (name, probe, cmd) in enumerate(steps, 1):
+        started = time.time()
+        job.check()
+        checkpoint = bootstrap_checkpoints.get(name, cmd)
+        stale = checkpoint is None and bootstrap_checkpoints.exists(name)
+        if not stale and job.run(f"{{ {probe}; }} >/dev/null 2>&1") == 0:
+            # Checkpointed by an earlier run, or done by something outside zoplete (adopted)
+            state = "Skipped" if checkpoint else "Satisfied"
+            if state == "Satisfied": bootstrap_checkpoints.put(name, cmd, 0, "probe")
+        else:
+            job.progress[name]["state"] = "Running"
+            job.log(f"==> [{i}/{len(steps)}] {name}\n")
+            code = job.run(cmd)
+            if code != 0:
+                job.progress[name].update(state="Failed", duration=round(time.time() - started, 1))
+                job.log(f"==> {name} failed with exit code {code}; completed steps will be skipped on retry\n")
+                return False
+            state = "Done"
+            bootstrap_checkpoints.put(name, cmd, round(time.time() - started, 1), "run")
+        job.progress[name].update(state=state, duration=round(time.time() - started, 1))
+        if state != "Done": job.log(f"==> [{i}/{len(steps)}] {name}: {state.lower()}\n")
+    job.log("\nStep durations:\n" + "".join(f"  {name:<22}{p['state']:<11}{p['duration']}s\n" for name, p in job.progress.items()))
+    job.log("Installation Complete\n")
+    return True
+
+# --- CATALOG & GITOPS LOGIC ---
+MARKETPLACE_CATALOG = {
+    "kafka": { "title": "Apache Kafka", "desc": "Event streaming platform.", "chart": "kafka", "repo_url": "https://charts.bitnami.com/bitnami", "repo_name": "bitnami", "version": "26.0.0", "values": {"zookeeper": {"enabled": True}, "replicaCount": 1}, "ui_svc": None, "logo_url": "https://upload.wikimedia.org/wikipedia/commons/0/01/Apache_Kafka_logo.svg"},
+    "kouncil": { "title": "Kouncil", "desc": "Kafka UI. Requires Kafka.", "chart": "kouncil", "repo_url": "https://consdata.github.io/kouncil/", "repo_name": "consdata", "version": "1.5.0", "values": {"bootstrapServers": "kafka.flux-system.svc.cluster.local:9092", "service": {"type": "NodePort"}}, "ui_svc": "kouncil", "dependency": "kafka", "logo_url": "https://avatars.githubusercontent.com/u/47789366?s=200&v=4"},
+    "jupyterhub": { "title": "JupyterHub", "desc": "Notebook server.", "chart": "jupyterhub", "repo_url": "https://jupyterhub.github.io/helm-chart/", "repo_name": "jupyterhub", "version": "3.1.0", "values": {"proxy": {"service": {"type": "NodePort"}}}, "ui_svc": "proxy-public", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/3/38/Jupyter_logo.svg"},
+    "nifi": { "title": "Apache NiFi", "desc": "Data flow.", "chart": "nifi", "repo_url": "https://cetic.github.io/helm-charts", "repo_name": "cetic", "version": "1.1.0", "values": {"service": {"type": "NodePort"}}, "ui_svc": "nifi", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/f/ff/Apache-nifi-logo.svg"},
+    "trino": { "title": "Trino (SQL)", "desc": "Fast distributed SQL query.", "chart": "trino", "repo_url": "https://trinodb.github.io/charts/", "repo_name": "trino", "version": "0.18.0", "values": {"server": {"workers": 1, "coordinator": True}, "service": {"type": "NodePort"}}, "ui_svc": "trino", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/5/57/Trino-logo-w-bk.svg"},
+    "airflow": { "title": "Apache Airflow", "desc": "Workflow orchestration.", "chart": "airflow", "repo_url": "https://airflow.apache.org", "repo_name": "apache-airflow", "version": "1.11.0", "values": {"executor": "KubernetesExecutor", "webserver": {"service": {"type": "NodePort"}}}, "ui_svc": "airflow-webserver", "logo_url": "https://upload.wikimedia.org/wikipedia/commons/d/de/AirflowLogo.png"}
+}
+
+# --- APPLY ENGINE ---
+FIELD_MANAGER = "zoplete"
+KIND_PLURALS = {
+    "HelmRepository": "helmrepositories",
+    "GitRepository": "gitrepositories",
+    "HelmRelease": "helmreleases",
+    "Kustomization": "kustomizations",
+}
+
+def helm_repository_obj(cfg):
+    return {
+        "apiVersion": "source.toolkit.fluxcd.io/v1", "kind": "HelmRepository",
+        "metadata": {"name": cfg['repo_name'], "namespace": "flux-system"},
+        "spec": {"interval": "1h", "url": cfg['repo_url']}
+    }
+
+def helm_release_obj(key, cfg):
+    return {
+        "apiVersion": "helm.toolkit.fluxcd.io/v2", "kind": "HelmRelease",
+        "metadata": {"name": key, "namespace": "flux-system"},
+        "spec": {
+            "interval": "5m",
+            "targetNamespace": "default",
+            "chart": {"spec": {"chart": cfg['chart'], "version": cfg['version'],
+                               "sourceRef": {"kind": "HelmRepository", "name": cfg['repo_name'], "namespace": "flux-system"}}},
+            "values": cfg['values']
+        }
+    }
+
+def git_repository_obj(name, url, branch):
+    return {
+        "apiVersion": "source.toolkit.fluxcd.io/v1", "kind": "GitRepository",
+        "metadata": {"name": name, "namespace": "flux-system"},
+        "spec": {"interval": "1m", "url": url, "ref": {"branch": branch}}
+    }
+
+def kustomization_obj(name, source, path):
+    return {
+        "apiVersion": "kustomize.toolkit.fluxcd.io/v1", "kind": "Kustomization",
+        "metadata": {"name": name, "namespace": "flux-system"},
+        "spec": {"interval": "5m", "path": path, "prune": True, "sourceRef": {"kind": "GitRepository", "name": source}}
+    }
+
+def app_bundle(key):
+    cfg = MARKETPLACE_CATALOG[key]
+    return [helm_repository_obj(cfg), helm_release_obj(key, cfg)]
+
+class ApplyEngine:
+    # Server-side apply straight through the shared API client. The hash of every object
+    # we applied is remembered with the object's uid, so re-applying an identical object
+    # costs one GET instead of a write. A missing or recreated object (different uid)
+    # is applied again; entries expire after max_age so edits made outside Zoplete are
+    # still corrected eventually.
+    def __init__(self, field_manager=FIELD_MANAGER, max_age=600):
+        self.field_manager = field_manager
+        self.max_age = max_age
+        self.applied = 0
+        self.skipped = 0
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(obj):
+        md = obj['metadata']
+        return (obj['apiVersion'], obj['kind'], md.get('namespace'), md['name'])
+
+    @staticmethod
+    def _digest(obj):
+        return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def apply(self, objs):
+        # Applies a bundle in order over one pooled connection; returns (success, summary).
+        lines = []
+        success = True
+        for obj in objs:
+            key, digest = self._key(obj), self._digest(obj)
+            label = f"{obj['kind'].lower()}/{key[3]}"
+            with self._lock: cached = self._hashes.get(key)
+            group, version = obj['apiVersion'].split('/')
+            if cached and cached[0] == (kube.generation, digest) and time.monotonic() - cached[1] < self.max_age \
+                    and self._live_uid(group, version, key) == cached[2]:
+                self.skipped += 1
+                lines.append(f"{label} unchanged")
+                continue
+            try:
+                resp = kube.custom.patch_namespaced_custom_object(group, version, key[2], KIND_PLURALS[obj['kind']], key[3], obj,
+                                                                  field_manager=self.field_manager, force=True,
+                                                                  _content_type="application/apply-patch+yaml", _preload_content=False)
+                uid = json.loads(resp.data)['metadata'].get('uid')
+            except Exception as e:
+                success = False
+                lines.append(f"{label} failed: {getattr(e, 'body', None) or e}")
+                with self._lock: self._hashes.pop(key, None)
+                continue
+            with self._lock: self._hashes[key] = ((kube.generation, digest), time.monotonic(), uid)
+            self.applied += 1
+            lines.append(f"{label} serverside-applied")
+        return success, "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _live_uid(group, version, key):
+        try:
+            resp = kube.custom.get_namespaced_custom_object(group, version, key[2], KIND_PLURALS[key[1]], key[3], _preload_content=False)
+            return json.loads(resp.data)['metadata'].get('uid')
+        except Exception: return None
+
+    def delete(self, api_version, kind, namespace, name):
+        with self._lock:
+            for key in [k for k in self._hashes if k[1] == kind and k[2] == namespace and k[3] == name]: del self._hashes[key]
+        group, version = api_version.split('/')
+        try:
+            kube.custom.delete_namespaced_custom_object(group, version, namespace, KIND_PLURALS[kind], name, _preload_content=False)
+        except client.rest.ApiException as e:
+            if e.status != 404: return False, str(getattr(e, 'body', None) or e)
+        except Exception as e: return False, str(e)
+        return True, f"{kind.lower()}/{name} deleted\n"
+
+    def stats(self):
+        return {"applied": self.applied, "skipped": self.skipped, "tracked": len(self._hashes)}
+
+apply_engine = ApplyEngine()
+
+def install_app_logic(key):
+    return apply_engine.apply(app_bundle(key))
+
+# --- MARKETPLACE AGGREGATION ---
+class TTLCache:
+    # Single-flight cache: concurrent readers of an expired entry wait for one refresh
+    # instead of each re-running the expensive computation.
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0
+
+    def get(self, compute):
+        with self._lock:
+            if time.monotonic() < self._expires:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            self._value = compute()
+            self._expires = time.monotonic() + self.ttl
+            self.generation += 1
+            return self._value
+
+    def peek(self):
+        # Current value if still fresh, without computing or counting a hit
+        with self._lock: return self._value if time.monotonic() < self._expires else None
+
+    def invalidate(self):
+        with self._lock: self._expires = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": round(self.hits / total, 3) if total else None, "ttl": self.ttl}
+
+class FluxProbe:
+    # Caches whether the Flux CRDs exist. While Flux is missing, re-checks back off
+    # exponentially so an idle dashboard does not keep hitting the API server.
+    def __init__(self, present_ttl=300, min_backoff=2, max_backoff=60):
+        self.present_ttl = present_ttl
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._present = False
+        self._next_check = 0
+        self._backoff = self.min_backoff
+
+    def present(self):
+        with self._lock:
+            if time.monotonic() >= self._next_check:
+                try:
+                    kube.apiextensions.read_custom_resource_definition("gitrepositories.source.toolkit.fluxcd.io", _preload_content=False)
+                    self._present = True
+                except Exception: self._present = False
+                if self._present:
+                    self._backoff = self.min_backoff
+                    self._next_check = time.monotonic() + self.present_ttl
+                else:
+                    self._next_check = time.monotonic() + self._backoff
+                    self._backoff = min(self._backoff * 2, self.max_backoff)
+            return self._present
+
+flux_probe = FluxProbe()
+marketplace_cache = TTLCache("marketplace", ttl=5)
+
+def helmrelease_list_method():
+    return functools.partial(kube.custom.list_namespaced_custom_object, "helm.toolkit.fluxcd.io", "v2", "flux-system", "helmreleases")
+
+def list_helmreleases():
+    return list_raw(helmrelease_list_method())['items']
+
+def collect_marketplace():
+    # One HelmRelease list and (only if needed) one Service list, joined against the catalog.
+    # List errors propagate, so the cache never stores a transient failure as "nothing installed".
+    flux = flux_probe.present()
     installed = []
     services = {}
     if flux:
-        for key, cfg in MARKETPLACE_CATALOG.items():
-            if run_shell_cmd(f"kubectl get helmrelease -n flux-system {key}")[0]:
-                installed.append(key)
-                if cfg['ui_svc']:
-                    port = get_node_port(cfg['ui_svc'])
-                    if port: services[key] = port
-    return jsonify({"flux_installed": flux, "catalog": MARKETPLACE_CATALOG, "installed_apps": installed, "services": services})
+        releases = {r['metadata']['name'] for r in list_helmreleases()}
+        installed = [key for key in MARKETPLACE_CATALOG if key in releases]
+        if any(MARKETPLACE_CATALOG[key]['ui_svc'] for key in installed):
+            ports = {}
+            for svc in list_raw(kube.core.list_namespaced_service, namespace="default")['items']:
+                svc_ports = svc['spec'].get('ports') or []
+                if svc_ports and svc_ports[0].get('nodePort'): ports[svc['metadata']['name']] = str(svc_ports[0]['nodePort'])
+            for key in installed:
+                port = ports.get(MARKETPLACE_CATALOG[key]['ui_svc'])
+                if port: services[key] = port
+    return {"flux_installed": flux, "catalog": MARKETPLACE_CATALOG, "installed_apps": installed, "services": services}
+
+# --- METRICS SAMPLER ---
+class RingBuffer:
+    # Fixed-capacity series: float64 timestamps plus one float32 column per field.
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.ts = array('d', bytes(8 * capacity))
+        self.columns = [array('f', bytes(4 * capacity)) for _ in range(fields)]
+        self.start = 0
+        self.count = 0
+
+    def append(self, ts, *values):
+        idx = (self.start + self.count) % self.capacity
+        if self.count == self.capacity: self.start = (self.start + 1) % self.capacity
+        else: self.count += 1
+        self.ts[idx] = ts
+        for col, v in zip(self.columns, values): col[idx] = v
+
+    def last_ts(self):
+        return self.ts[(self.start + self.count - 1) % self.capacity] if self.count else 0
+
+    def since(self, since_ts):
+        # Timestamps are appended in order, so the first newer sample is found by bisection.
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[(self.start + mid) % self.capacity] > since_ts: hi = mid
+            else: lo = mid + 1
+        idx = [(self.start + i) % self.capacity for i in range(lo, self.count)]
+        return [self.ts[i] for i in idx], [[col[i] for i in idx] for col in self.columns]
+
+def parse_node_usage(item):
+    # metrics.k8s.io usage -> (cores, MiB)
+    return float(parse_quantity(item['usage']['cpu'])), float(parse_quantity(item['usage']['memory']) / 2**20)
+
+def rollup_pods(items, pods, top_n):
+    # One pass over metrics.k8s.io pod usage: sums per namespace, per (namespace, release) and
+    # per node, plus the top_n pods by CPU and by memory kept in bounded min-heaps, so a tick
+    # costs O(pods * log top_n) rather than a sort of every pod.
+    namespaces, releases, by_node = {}, {}, {}
+    top_cpu, top_mem = [], []
+    for item in items:
+        md = item['metadata']
+        ns, name = md['namespace'], md['name']
+        cpu = mem = 0.0
+        for container in item.get('containers') or []:
+            c_cpu, c_mem = parse_node_usage(container)
+            cpu += c_cpu
+            mem += c_mem
+        pod = pods.get((ns, name)) or {}
+        row = (cpu, mem, ns, name, pod.get('release'), pod.get('node'))
+        for table, key in ((namespaces, ns), (releases, (ns, row[4]) if row[4] else None)):
+            if key is None: continue
+            acc = table.get(key)
+            if acc is None: acc = table[key] = [0.0, 0.0, 0]
+            acc[0] += cpu
+            acc[1] += mem
+            acc[2] += 1
+        by_node.setdefault(row[5], []).append(row)
+        for heap, value in ((top_cpu, cpu), (top_mem, mem)):
+            if len(heap) < top_n: heapq.heappush(heap, (value, ns, name, row))
+            elif value > heap[0][0]: heapq.heapreplace(heap, (value, ns, name, row))
+
+    def group(key, acc): return {**key, "cpu": round(acc[0], 4), "mem": round(acc[1], 1), "pods": acc[2]}
+    return {
+        "pods": len(items),
+        "namespaces": sorted((group({"namespace": ns}, acc) for ns, acc in namespaces.items()), key=lambda g: -g["cpu"]),
+        "releases": sorted((group({"namespace": ns, "release": rel}, acc) for (ns, rel), acc in releases.items()), key=lambda g: -g["cpu"]),
+        "top_cpu": [pod_usage(entry[3]) for entry in sorted(top_cpu, reverse=True)],
+        "top_mem": [pod_usage(entry[3]) for entry in sorted(top_mem, reverse=True)],
+    }, by_node
+
+def pod_usage(row):
+    cpu, mem, ns, name, release, node = row
+    return {"namespace": ns, "name": name, "release": release, "node": node, "cpu": round(cpu, 4), "mem": round(mem, 1)}
+
+AGGREGATE_STATS = ("total", "p50", "p95", "max")
+
+def summarize(values):
+    # total, p50, p95, max (nearest rank) of one tick's per-node values
+    ordered = sorted(values)
+    n = len(ordered)
+    return [sum(ordered), ordered[(n - 1) // 2], ordered[max(-(-95 * n // 100) - 1, 0)], ordered[-1]]
+
+def lttb_indices(ts, values, budget):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, per bucket, the
+    # point forming the largest triangle with the previous pick and the next bucket's mean.
+    n = len(ts)
+    if budget >= n or budget < 3: return list(range(n))
+    picked = [0]
+    every = (n - 2) / (budget - 2)
+    a = 0
+    for i in range(budget - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nxt_start, nxt_end = end, min(int((i + 2) * every) + 1, n)
+        avg_t = sum(ts[nxt_start:nxt_end]) / (nxt_end - nxt_start)
+        avg_v = sum(values[nxt_start:nxt_end]) / (nxt_end - nxt_start)
+        best, best_area = start, -1
+        for j in range(start, end):
+            area = abs((ts[a] - avg_t) * (values[j] - values[a]) - (ts[a] - ts[j]) * (avg_v - values[a]))
+            if area > best_area: best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+class MetricsBroadcaster:
+    # Fans one encoded SSE event per sampler tick out to every subscriber. Events carry only
+    # the per-node values that changed; a recent backlog lets reconnecting clients resume
+    # from Last-Event-ID, anyone else starts from a full snapshot.
+    def __init__(self, backlog=64, keepalive=15):
+        self.keepalive = keepalive
+        self.seq = 0
+        self.subscribers = 0
+        self.closed = False
+        self._values = {}
+        self._last = {"ts": 0, "has_metrics": False, "network": {"sent": 0, "recv": 0}}
+        self._events = deque(maxlen=backlog)
+        self._snapshot = (None, None)
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _encode(seq, payload):
+        return f"id: {seq}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+    def publish(self, ts, has_metrics, node_values, network, agg=None):
+        values = {name: [round(cpu, 3), round(mem, 1)] for name, (cpu, mem) in node_values.items()}
+        with self._cond:
+            changed = {name: v for name, v in values.items() if self._values.get(name) != v}
+            removed = [name for name in self._values if name not in values]
+            self._values = values
+            self._last = {"ts": ts, "has_metrics": has_metrics, "network": {k: round(v, 4) for k, v in network.items()}, "agg": agg}
+            self.seq += 1
+            self._events.append((self.seq, self._encode(self.seq, {**self._last, "nodes": changed, "removed": removed})))
+            self._cond.notify_all()
+
+    def close(self):
+        # Ends every subscription (server shutdown)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _snapshot_event(self):
+        # Built at most once per tick no matter how many clients (re)connect.
+        if self._snapshot[0] != self.seq:
+            self._snapshot = (self.seq, self._encode(self.seq, {**self._last, "nodes": self._values, "removed": [], "full": True}))
+        return self._snapshot[1]
+
+    def subscribe(self, last_event_id=None):
+        with self._cond:
+            self.subscribers += 1
+            if last_event_id is not None and self._events and self._events[0][0] <= last_event_id + 1 <= self.seq + 1:
+                pending = [e for seq, e in self._events if seq > last_event_id]
+            else:
+                pending = [self._snapshot_event()] if self.seq else []
+            cursor = self.seq
+        try:
+            yield "retry: 3000\n\n"
+            while not self.closed:
+                for event in pending: yield event
+                with self._cond:
+                    if self.seq == cursor: self._cond.wait(self.keepalive)
+                    if self.closed: break
+                    if self.seq == cursor:
+                        pending = [": keepalive\n\n"]
+                        continue
+                    if self._events[0][0] > cursor + 1: pending = [self._snapshot_event()]
+                    else: pending = [e for seq, e in self._events if seq > cursor]
+                    cursor = self.seq
+        finally:
+            with self._cond: self.subscribers -= 1
+
+# --- TIME-SERIES STORE ---
+class SeriesTier:
+    # One resolution of the store. A series keeps one file per `segment` seconds holding
+    # segment/step fixed-width records, so a timestamp maps straight to a byte offset and a
+    # range read only touches the pages it covers. Raw records are (ts, value); rollups are
+    # (ts, mean, min, max, count). A zero ts marks an empty slot.
+    def __init__(self, name, step, segment, retention, rollup):
+        self.name = name
+        self.step = step
+        self.segment = segment
+        self.retention = retention
+        self.rollup = rollup
+        self.record = struct.Struct("<dfffI" if rollup else "<df")
+        self.slots = int(round(segment / step))
+
+    def segment_start(self, ts):
+        return ts - ts % self.segment
+
+class TimeSeriesStore:
+    # Chart history that survives reloads and restarts: raw samples for hours, 1 minute
+    # rollups for days, 1 hour rollups for months, in memory-mapped segment files under
+    # <root>/<tier>/<series>/<segment start>.seg. A background thread rolls each tier up
+    # into the next and deletes segments past their tier's retention.
+    def __init__(self, root=TSDB_DIR, interval=METRICS_INTERVAL, raw_hours=TSDB_RAW_HOURS,
+                 minute_days=TSDB_MINUTE_DAYS, hour_days=TSDB_HOUR_DAYS, max_open=512, compact_every=60):
+        try: os.makedirs(root, exist_ok=True)
+        except OSError:
+            root = os.path.join(tempfile.gettempdir(), "zoplete-tsdb")
+            os.makedirs(root, exist_ok=True)
+        self.root = root
+        # The raw tier's name carries its step: files written at another interval are not reinterpreted
+        self.tiers = [SeriesTier(f"raw-{interval:g}s", interval, 3600, raw_hours * 3600, False),
+                      SeriesTier("1m", 60, 86400, minute_days * 86400, True),
+                      SeriesTier("1h", 3600, 30 * 86400, hour_days * 86400, True)]
+        self.max_open = max_open
+        self.compact_every = compact_every
+        self.series = set()
+        self.compacted = {}  # tier name -> every bucket before this ts has been rolled up
+        self.writes = 0
+        self.compactions = 0
+        self.compact_seconds = 0.0
+        self.errors = 0
+        self._open = OrderedDict()  # (tier name, series, segment start) -> writable mmap
+        self._expired_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        raw_dir = os.path.join(root, self.tiers[0].name)
+        if os.path.isdir(raw_dir): self.series.update(unquote(name) for name in os.listdir(raw_dir))
+        try:
+            with open(self._state_path()) as f: self.compacted = json.load(f)
+        except (OSError, ValueError): pass
+
+    def _state_path(self):
+        return os.path.join(self.root, "compacted.json")
+
+    def _path(self, tier, series, start):
+        return os.path.join(self.root, tier.name, quote(series, safe=""), f"{int(start)}.seg")
+
+    def _writable(self, tier, series, start):
+        # Caller holds _lock. Maps are kept in an LRU so the open file count stays bounded.
+        key = (tier.name, series, start)
+        mm = self._open.get(key)
+        if mm is not None:
+            self._open.move_to_end(key)
+            return mm
+        path = self._path(tier, series, start)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = tier.slots * tier.record.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size: os.ftruncate(fd, size)  # sparse: unwritten slots cost no disk
+            mm = self._open[key] = mmap.mmap(fd, size)
+        finally: os.close(fd)
+        while len(self._open) > self.max_open: self._open.popitem(last=False)[1].close()
+        return mm
+
+    def _write(self, tier, series, ts, values):
+        start = tier.segment_start(ts)
+        slot = min(int((ts - start) // tier.step), tier.slots - 1)
+        tier.record.pack_into(self._writable(tier, series, start), slot * tier.record.size, ts, *values)
+
+    def append(self, ts, values):
+        # values: {series: value}, one raw sample each
+        raw = self.tiers[0]
+        with self._lock:
+            for series, value in values.items(): self._write(raw, series, ts, (value,))
+            self.series.update(values)
+            self.writes += len(values)
+
+    def read(self, tier, series, start, end):
+        # (ts, mean, min, max, count) for the records in [start, end), oldest first
+        size = tier.record.size
+        seg = tier.segment_start(start)
+        while seg < end:
+            try: fd = os.open(self._path(tier, series, seg), os.O_RDONLY)
+            except OSError: fd = None
+            if fd is not None:
+                try:
+                    length = os.fstat(fd).st_size
+                    mm = mmap.mmap(fd, length, access=mmap.ACCESS_READ) if length else None
+                finally: os.close(fd)
+                if mm is not None:
+                    try:
+                        first = max(int((start - seg) // tier.step), 0)
+                        last = min(int((end - seg) // tier.step) + 1, length // size)
+                        if first < last:
+                            for rec in tier.record.iter_unpack(mm[first * size:last * size]):
+                                if rec[0] and start <= rec[0] < end: yield rec if tier.rollup else (rec[0], rec[1], rec[1], rec[1], 1)
+                    finally: mm.close()
+            seg += tier.segment
+
+    @staticmethod
+    def _rollup(records):
+        count = sum(r[4] for r in records)
+        return (sum(r[1] * r[4] for r in records) / count, min(r[2] for r in records), max(r[3] for r in records), count)
+
+    def compact(self, now=None):
+        # Rolls finished buckets of each tier into the next, from the last watermark on. Raw
+        # buckets count as finished two steps after they end, so late samples still make it in.
+        now = now or time.time()
+        started = time.perf_counter()
+        with self._lock: names = list(self.series)
+        for src, dst in zip(self.tiers, self.tiers[1:]):
+            settled = self.compacted.get(src.name, 0) if src.rollup else now - 2 * src.step
+            until = settled - settled % dst.step
+            since = max(self.compacted.get(dst.name, 0), until - src.retention)
+            since -= since % dst.step
+            if until <= since: continue
+            for name in names:
+                buckets = {}
+                for rec in self.read(src, name, since, until): buckets.setdefault(rec[0] - rec[0] % dst.step, []).append(rec)
+                if not buckets: continue
+                with self._lock:
+                    for bucket, records in buckets.items(): self._write(dst, name, bucket, self._rollup(records))
+            self.compacted[dst.name] = until
+        tmp = self._state_path() + ".tmp"
+        with open(tmp, "w") as f: json.dump(self.compacted, f)
+        os.replace(tmp, self._state_path())
+        self.compactions += 1
+        self.compact_seconds = time.perf_counter() - started
+
+    def expire(self, now=None):
+        # Drops segments past retention, closes maps for segments that can no longer be written
+        now = now or time.time()
+        with self._lock:
+            for key in [k for k in self._open if self._tier(k[0]).segment_start(now) > k[2] + self._tier(k[0]).segment]:
+                self._open.pop(key).close()
+        for tier in self.tiers:
+            tier_dir = os.path.join(self.root, tier.name)
+            if not os.path.isdir(tier_dir): continue
+            for quoted in os.listdir(tier_dir):
+                series_dir = os.path.join(tier_dir, quoted)
+                for name in os.listdir(series_dir):
+                    start = int(name.split(".")[0]) if name.endswith(".seg") else None
+                    if start is None or start + tier.segment >= now - tier.retention: continue
+                    with self._lock:
+                        mm = self._open.pop((tier.name, unquote(quoted), start), None)
+                        if mm is not None: mm.close()
+                    os.remove(os.path.join(series_dir, name))
+                if not os.listdir(series_dir):
+                    os.rmdir(series_dir)
+                    if tier is self.tiers[0]:
+                        with self._lock: self.series.discard(unquote(quoted))
+
+    def _tier(self, name):
+        return next(t for t in self.tiers if t.name == name)
+
+    def query(self, names, start, end, points=150):
+        # About `points` buckets per series over [start, end), from the coarsest tier that
+        # still resolves them and holds `start`; the tail that tier has not rolled up yet
+        # is filled from the finer tiers. -> {"tier", "step", "ts", "series": {name: {"mean", "min", "max"}}}
+        now = time.time()
+        want = max((end - start) / max(points, 1), self.tiers[0].step)
+        index = max(i for i, t in enumerate(self.tiers) if t.step <= want or i == 0)
+        while index < len(self.tiers) - 1 and start < now - self.tiers[index].retention: index += 1
+        tier = self.tiers[index]
+        step = max(want, tier.step)
+        step = tier.step * int(round(step / tier.step))  # buckets aligned to the tier's own
+        spans, cursor = [], start
+        for t in reversed(self.tiers[:index + 1]):
+            stop = min(end, self.compacted.get(t.name, 0)) if t.rollup else end
+            if stop > cursor: spans.append((t, cursor, stop))
+            cursor = max(cursor, stop)
+        series, stamps = {}, set()
+        for name in names:
+            buckets = {}
+            for t, lo, hi in spans:
+                for rec in self.read(t, name, lo, hi): buckets.setdefault(rec[0] - rec[0] % step, []).append(rec)
+            series[name] = {bucket: self._rollup(records) for bucket, records in buckets.items()}
+            stamps.update(buckets)
+        ts = sorted(stamps)
+        return {"tier": tier.name, "step": step, "ts": ts,
+                "series": {name: {field: [rows[t][i] if t in rows else None for t in ts] for i, field in enumerate(("mean", "min", "max"))}
+                           for name, rows in series.items()}}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tsdb-compactor", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.compact_every)
+            try:
+                self.compact()
+                if time.time() - self._expired_at > 3600:
+                    self.expire()
+                    self._expired_at = time.time()
+            except Exception: self.errors += 1
+
+    def close(self):
+        with self._lock:
+            for mm in self._open.values():
+                mm.flush()
+                mm.close()
+            self._open.clear()
+
+    def stats(self):
+        return {"root": self.root, "series": len(self.series), "open_segments": len(self._open), "writes": self.writes,
+                "compactions": self.compactions, "compact_seconds": round(self.compact_seconds, 3), "errors": self.errors,
+                "compacted": self.compacted, "tiers": {t.name: {"step": t.step, "retention_seconds": t.retention} for t in self.tiers}}
+
+tsdb = TimeSeriesStore()
+
+class MetricsSampler:
+    # Scrapes metrics.k8s.io once per interval for every viewer and keeps the last
+    # METRICS_HISTORY_SECONDS of CPU cores / MiB per node (and master network rates).
+    def __init__(self, interval=METRICS_INTERVAL, history_seconds=METRICS_HISTORY_SECONDS, apiservice_ttl=30, top_n=10, store=None):
+        self.interval = interval
+        self.top_n = top_n
+        self.store = store
+        self.capacity = max(int(history_seconds / interval), 1)
+        self.apiservice_ttl = apiservice_ttl
+        self.nodes = {}
+        self.network = RingBuffer(self.capacity, 2)
+        self.aggregates = RingBuffer(self.capacity, 2 * len(AGGREGATE_STATS))  # cpu stats, then mem stats
+        self.has_metrics = False
+        self.latest = {"has_metrics": False, "metrics": [], "network": {"sent": 0, "recv": 0}}
+        self.workloads = {"ts": 0, "pods": 0, "namespaces": [], "releases": [], "top_cpu": [], "top_mem": []}
+        self.pods_by_node = {}
+        self.ticks = 0
+        self.errors = 0
+        self.sampled = threading.Event()
+        self.stream = MetricsBroadcaster()
+        self._apiservice_checked = 0
+        self._last_net = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+                self._thread.start()
+                if self.store: self.store.start()
+        return self
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            try: self.sample()
+            except Exception: self.errors += 1
+            next_tick += self.interval
+            time.sleep(max(next_tick - time.monotonic(), 0))
+
+    def _check_apiservice(self, now):
+        if now - self._apiservice_checked < self.apiservice_ttl: return self.has_metrics
+        self._apiservice_checked = now
+        try:
+            kube.apiregistration.read_api_service("v1beta1.metrics.k8s.io", _preload_content=False)
+            self.has_metrics = True
+        except Exception: self.has_metrics = False
+        return self.has_metrics
+
+    def sample(self):
+        # Millisecond timestamps survive the JSON round trip exactly, so ?since= never repeats a point.
+        now = round(time.time(), 3)
+        metrics_data = []
+        if self._check_apiservice(now):
+            try:
+                for item in list_raw(kube.custom.list_cluster_custom_object, group="metrics.k8s.io", version="v1beta1", plural="nodes")['items']:
+                    cpu_val, mem_val = parse_node_usage(item)
+                    metrics_data.append({"Name": item['metadata']['name'], "CPU (cores)": cpu_val, "Memory (MiB)": mem_val})
+            except Exception: self.errors += 1
+            try:
+                pod_items = list_raw(kube.custom.list_cluster_custom_object, group="metrics.k8s.io", version="v1beta1", plural="pods")['items']
+                workloads, by_node = rollup_pods(pod_items, pod_informer.start().items, self.top_n)
+                with self._lock:
+                    self.workloads = {"ts": now, **workloads}
+                    self.pods_by_node = by_node
+            except Exception: self.errors += 1
+        network_data = {"sent": 0, "recv": 0}
+        sent_rate = recv_rate = 0.0
+        try:
+            net = psutil.net_io_counters()
+            network_data = {"sent": net.bytes_sent/1024/1024, "recv": net.bytes_recv/1024/1024}
+            if self._last_net:
+                elapsed = now - self._last_net[0]
+                if elapsed > 0:
+                    sent_rate = max((network_data["sent"] - self._last_net[1]) / elapsed, 0)
+                    recv_rate = max((network_data["recv"] - self._last_net[2]) / elapsed, 0)
+            self._last_net = (now, network_data["sent"], network_data["recv"])
+        except: pass
+        agg = None
+        if metrics_data:
+            cpu_stats = summarize([m["CPU (cores)"] for m in metrics_data])
+            mem_stats = summarize([m["Memory (MiB)"] for m in metrics_data])
+            agg = {"cpu": [round(v, 3) for v in cpu_stats], "mem": [round(v, 1) for v in mem_stats]}
+        with self._lock:
+            if agg: self.aggregates.append(now, *cpu_stats, *mem_stats)
+            for m in metrics_data:
+                buf = self.nodes.get(m["Name"])
+                if buf is None: buf = self.nodes[m["Name"]] = RingBuffer(self.capacity, 2)
+                buf.append(now, m["CPU (cores)"], m["Memory (MiB)"])
+            self.network.append(now, sent_rate, recv_rate)
+            horizon = now - self.capacity * self.interval
+            for name in [n for n, buf in self.nodes.items() if buf.last_ts() < horizon]: del self.nodes[name]
+            self.latest = {"has_metrics": self.has_metrics, "metrics": metrics_data, "network": network_data}
+            self.ticks += 1
+        self.stream.publish(now, self.has_metrics, {m["Name"]: (m["CPU (cores)"], m["Memory (MiB)"]) for m in metrics_data},
+                            {"sent": sent_rate, "recv": recv_rate}, agg)
+        if self.store:
+            values = {"network:sent": sent_rate, "network:recv": recv_rate}
+            for m in metrics_data:
+                values[f"node:{m['Name']}:cpu"] = m["CPU (cores)"]
+                values[f"node:{m['Name']}:mem"] = m["Memory (MiB)"]
+            if agg:
+                for stat, cpu, mem in zip(AGGREGATE_STATS, cpu_stats, mem_stats):
+                    values[f"cluster:cpu:{stat}"] = cpu
+                    values[f"cluster:mem:{stat}"] = mem
+            try: self.store.append(now, values)
+            except Exception: self.errors += 1
+        self.sampled.set()
+
+    def recheck(self):
+        self._apiservice_checked = 0
+
+    def node_pods(self, node):
+        # Drill-down: one node's pods, heaviest CPU first (a node holds ~100 pods at most)
+        with self._lock: rows = list(self.pods_by_node.get(node, []))
+        return [pod_usage(row) for row in sorted(rows, key=lambda r: -r[0])]
+
+    def history(self, since=0, node=None):
+        with self._lock:
+            nodes = {}
+            for name, buf in self.nodes.items():
+                if node and name != node: continue
+                ts, (cpu, mem) = buf.since(since)
+                if ts: nodes[name] = {"ts": ts, "cpu": [round(v, 4) for v in cpu], "mem": [round(v, 1) for v in mem]}
+            ts, (sent, recv) = self.network.since(since)
+            return {
+                "has_metrics": self.has_metrics,
+                "interval": self.interval,
+                "now": round(time.time(), 3),
+                "nodes": nodes,
+                "network": {"ts": ts, "sent": [round(v, 4) for v in sent], "recv": [round(v, 4) for v in recv]}
+            }
+
+    def aggregate(self, since=0, points=150, k=5, by="cpu", rank_window=60):
+        # Fixed-size answer whatever the cluster size: total/p50/p95/max per tick, the top k
+        # nodes (by mean over the last rank_window seconds), all thinned to `points` by LTTB
+        # on the cluster total of the ranking metric.
+        col = 0 if by == "cpu" else 1
+        with self._lock:
+            ts, columns = self.aggregates.since(since)
+            recent = self.aggregates.last_ts() - rank_window
+            means = []
+            for name, buf in self.nodes.items():
+                _, values = buf.since(recent)
+                if values[col]: means.append((sum(values[col]) / len(values[col]), name))
+            top = [name for _, name in sorted(means, reverse=True)[:k]]
+            top_series = {}
+            for name in top:
+                nts, (cpu, mem) = self.nodes[name].since(since)
+                top_series[name] = dict(zip(nts, zip(cpu, mem)))
+            net_ts, (sent, recv) = self.network.since(since)
+        net = dict(zip(net_ts, zip(sent, recv)))
+        n = len(AGGREGATE_STATS)
+        keep = lttb_indices(ts, columns[col * n], points)
+        pick = lambda values, digits: [round(values[i], digits) for i in keep]
+        kept_ts = [ts[i] for i in keep]
+        return {
+            "has_metrics": self.has_metrics,
+            "interval": self.interval,
+            "node_count": len(self.nodes),
+            "ts": kept_ts,
+            "cpu": {stat: pick(columns[i], 4) for i, stat in enumerate(AGGREGATE_STATS)},
+            "mem": {stat: pick(columns[n + i], 1) for i, stat in enumerate(AGGREGATE_STATS)},
+            "top": {"by": by, "nodes": {name: {"cpu": [round(series[t][0], 4) if t in series else None for t in kept_ts],
+                                                "mem": [round(series[t][1], 1) if t in series else None for t in kept_ts]}
+                                         for name, series in top_series.items()}},
+            "network": {"sent": [round(net.get(t, (0, 0))[0], 4) for t in kept_ts], "recv": [round(net.get(t, (0, 0))[1], 4) for t in kept_ts]}
+        }
+
+metrics_sampler = MetricsSampler(store=tsdb)
+
+# --- STACK INSTALLS ---
+HELMRELEASE_FAILED_REASONS = {"InstallFailed", "UpgradeFailed", "TestFailed", "RollbackFailed", "UninstallFailed"}
+
+def helmrelease_state(obj):
+    if obj is None: return "Missing", ""
+    md, status = obj['metadata'], obj.get('status') or {}
+    if status.get('observedGeneration', -1) < md.get('generation', 0): return "Progressing", "Waiting for helm-controller"
+    conds = {c['type']: c for c in status.get('conditions') or []}
+    stalled, ready = conds.get('Stalled'), conds.get('Ready')
+    if stalled and stalled['status'] == "True": return "Failed", stalled.get('message', '')
+    if not ready: return "Progressing", ""
+    if ready['status'] == "True": return "Ready", ready.get('message', '')
+    if ready['status'] == "False" and ready.get('reason') in HELMRELEASE_FAILED_REASONS: return "Failed", ready.get('message', '')
+    return "Progressing", ready.get('message', '')
+
+def wait_for_object(list_method, name, check, timeout, should_stop=None):
+    # Lists the single named object, then watches it until check(obj) returns something
+    # other than None (obj is None once deleted). Returns None on deadline or should_stop();
+    # watches are cut into 30s slices so should_stop() is honoured.
+    deadline = time.monotonic() + timeout
+    selector = f"metadata.name={name}"
+    while True:
+        data = list_raw(list_method(), field_selector=selector)
+        result = check(data['items'][0] if data['items'] else None)
+        if result is not None: return result
+        rv = data['metadata']['resourceVersion']
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (should_stop and should_stop()): return None
+                for ev in watch_raw(list_method(), rv, min(remaining, 30), field_selector=selector):
+                    rv = ev['object'].get('metadata', {}).get('resourceVersion', rv)
+                    if ev['type'] == "BOOKMARK": continue
+                    result = check(None if ev['type'] == "DELETED" else ev['object'])
+                    if result is not None: return result
+        except WatchExpired: continue
+
+def wait_helmrelease(key, timeout, until=("Ready", "Failed"), should_stop=None):
+    last = ("Progressing", "")
+    def check(obj):
+        nonlocal last
+        last = helmrelease_state(obj)
+        return last if last[0] in until else None
+    result = wait_for_object(helmrelease_list_method, key, check, timeout, should_stop)
+    if result: return result
+    return ("Cancelled" if should_stop and should_stop() else "Timeout"), last[1]
+
+def wait_node_port(svc, timeout, namespace="default"):
+    def check(obj):
+        ports = (obj or {}).get('spec', {}).get('ports') or []
+        return str(ports[0]['nodePort']) if ports and ports[0].get('nodePort') else None
+    return wait_for_object(lambda: functools.partial(kube.core.list_namespaced_service, namespace), svc, check, timeout)
+
+def resolve_stack(keys):
+    # Returns {key: dependency} for the requested apps plus everything they depend on,
+    # in dependency-first order.
+    plan = {}
+    def visit(key, path):
+        if key not in MARKETPLACE_CATALOG: raise ValueError(f"Unknown app {key}")
+        if key in path: raise ValueError(f"Dependency cycle: {' -> '.join(path + [key])}")
+        if key in plan: return
+        dep = MARKETPLACE_CATALOG[key].get('dependency')
+        if dep: visit(dep, path + [key])
+        plan[key] = dep
+    for key in keys: visit(key, [])
+    return plan
+
+def install_stack(job, plan, app_timeout=900):
+    # Every app gets its own worker; dependents block until their parent reports Ready,
+    # so the stack takes as long as its longest dependency chain.
+    job.progress = {key: {"state": "Pending", "dependency": dep, "message": "", "duration": None} for key, dep in plan.items()}
+    finished = {key: threading.Event() for key in plan}
+
+    def update(key, state, message=""):
+        job.progress[key].update(state=state, message=message)
+        job.log(f"[{key}] {state}{': ' + message if message else ''}\n")
+
+    def run(key):
+        try:
+            dep = plan[key]
+            if dep:
+                update(key, "Waiting", f"for {dep}")
+                finished[dep].wait()
+                if job.progress[dep]['state'] != "Ready":
+                    return update(key, "Skipped", f"{dep} is {job.progress[dep]['state']}")
+            if job.should_stop(): return update(key, "Cancelled")
+            started = time.time()
+            success, output = install_app_logic(key)
+            marketplace_cache.invalidate()
+            if not success: return update(key, "Failed", output.strip())
+            update(key, "Applied")
+            state, message = wait_helmrelease(key, app_timeout, should_stop=job.should_stop)
+            job.progress[key]['duration'] = round(time.time() - started, 1)
+            update(key, state, message)
+        except Exception as e: update(key, "Failed", str(e))
+        finally: finished[key].set()
+
+    with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix="stack") as pool: list(pool.map(run, plan))
+    marketplace_cache.invalidate()
+    return all(p['state'] == "Ready" for p in job.progress.values())
+
+# --- STATIC ASSETS ---
+# CDN references in HTML_TEMPLATE and the vendored file that replaces each one when present
+# (`python zoplete.py --fetch-vendor` downloads them). Missing files keep the CDN link.
+CHART_JS_URL = "https://cdn.jsdelivr.net/npm/chart.js"
+CHART_JS_PINNED = "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js"
+K8S_LOGO_URL = "https://raw.githubusercontent.com/cncf/artwork/master/projects/kubernetes/icon/color/kubernetes-icon-color.png"
+FONT_CSS = {
+    "roboto.css": "https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap",
+    "material-symbols.css": "https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined:opsz,wght,FILL,GRAD@24,400,0,0",
+}
+ASSET_TYPES = {".css": "text/css; charset=utf-8", ".js": "application/javascript; charset=utf-8", ".png": "image/png",
+               ".woff2": "font/woff2", ".html": "text/html; charset=utf-8"}
+
+class Asset:
+    # Content plus its precompressed variants, computed once
+    def __init__(self, name, data, compress=True):
+        self.name = name
+        self.data = data
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        self.mimetype = ASSET_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+        self.encoded = {}
+        if compress and not name.endswith((".png", ".woff2")):
+            self.encoded["gzip"] = gzip.compress(data, 9, mtime=0)
+            if brotli: self.encoded["br"] = brotli.compress(data, quality=11)
+
+    def response(self, immutable):
+        if self.etag in request.headers.get('If-None-Match', ''): resp = Response(status=304)
+        else:
+            accepted = request.headers.get('Accept-Encoding', '')
+            encoding = next((e for e in ("br", "gzip") if e in self.encoded and e in accepted), None)
+            resp = Response(self.encoded[encoding] if encoding else self.data, mimetype=self.mimetype)
+            if encoding: resp.headers['Content-Encoding'] = encoding
+        resp.headers['ETag'] = self.etag
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+        return resp
+
+class StaticAssets:
+    # Splits HTML_TEMPLATE into a small page plus fingerprinted app.<hash>.css/.js (and any
+    # vendored libraries), so browsers keep the assets forever and only revalidate the page.
+    def __init__(self, template=HTML_TEMPLATE, vendor_dir=VENDOR_DIR):
+        self.template = template
+        self.vendor_dir = vendor_dir
+        self.assets = {}
+        self.page = None
+        self._lock = threading.Lock()
+
+    def _add(self, name, data):
+        stem, ext = os.path.splitext(name)
+        asset = Asset(f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}", data)
+        self.assets[asset.name] = asset
+        return f"/assets/{asset.name}"
+
+    def _vendor(self, name):
+        path = os.path.join(self.vendor_dir, name)
+        if not os.path.exists(path): return None
+        with open(path, "rb") as f: return f.read()
+
+    def build(self):
+        with self._lock:
+            if self.page: return self
+            html = self.template
+            head_css, _, rest = html.partition("<style>")
+            css, _, rest = rest.partition("</style>")
+            body, _, rest = rest.partition("    <script>\n")
+            js, _, tail = rest.partition("</script>")
+            fonts = os.path.join(self.vendor_dir, "fonts")
+            if os.path.isdir(fonts):
+                for name in os.listdir(fonts):
+                    with open(os.path.join(fonts, name), "rb") as f: self.assets[f"fonts/{name}"] = Asset(f"fonts/{name}", f.read())
+            for name, url in FONT_CSS.items():
+                data = self._vendor(name)
+                if data:
+                    css = data.decode() + css
+                    head_css = re.sub(r'\s*<link[^>]*href="' + re.escape(url) + r'"[^>]*>', "", head_css)
+            chart = self._vendor("chart.umd.js")
+            if chart: head_css = head_css.replace(CHART_JS_URL, self._add("chart.umd.js", chart))
+            logo = self._vendor("kubernetes-icon.png")
+            if logo: body = body.replace(K8S_LOGO_URL, self._add("kubernetes-icon.png", logo))
+            page = (head_css + f'<link rel="stylesheet" href="{self._add("app.css", css.encode())}">' + body +
+                    f'    <script src="{self._add("app.js", js.encode())}"></script>' + tail)
+            self.page = Asset("index.html", page.encode())
+            return self
+
+    def stats(self):
+        return {name: {"bytes": len(a.data), **{enc: len(d) for enc, d in a.encoded.items()}} for name, a in self.assets.items()}
+
+static_assets = StaticAssets()
+
+# --- CONDITIONAL JSON ---
+GZIP_MIN_BYTES = 1024
+_json_bodies = {}  # etag -> (body, gzipped body), so an unchanged list is encoded once
+_json_lock = threading.Lock()
+JSON_MEMO = prom.counter("zoplete_json_body_cache_total", "Encoded list bodies reused (hit) or rebuilt (miss) per ETag.", ("result",))
+
+def conditional_json(build, tag=None):
+    # Strong ETag from `tag` (e.g. a resourceVersion) when given, otherwise from the body.
+    # A matching If-None-Match answers 304 without building or encoding the payload.
+    etag = f'"{tag}"' if tag else None
+    if etag and etag in request.headers.get('If-None-Match', ''): resp = Response(status=304)
+    else:
+        body, gz = _json_bodies.get(etag, (None, None)) if etag else (None, None)
+        if tag: JSON_MEMO.inc("hit" if body is not None else "miss")
+        if body is None:
+            body = app.json.dumps(build()).encode()
+            etag = etag or '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if not tag and etag in request.headers.get('If-None-Match', ''): resp = Response(status=304)
+        else:
+            resp = Response(body, mimetype="application/json")
+            if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get('Accept-Encoding', ''):
+                if gz is None: gz = gzip.compress(body, 5, mtime=0)
+                resp.set_data(gz)
+                resp.headers['Content-Encoding'] = 'gzip'
+            if tag:
+                with _json_lock:
+                    if len(_json_bodies) >= 64: _json_bodies.pop(next(iter(_json_bodies)))
+                    _json_bodies[etag] = (body, gz)
+    resp.headers['ETag'] = etag
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+def fetch_vendor(vendor_dir=VENDOR_DIR):
+    # One-time download of the CDN assets for offline installs; fonts are rewritten to local URLs
+    os.makedirs(os.path.join(vendor_dir, "fonts"), exist_ok=True)
+    # A modern User-Agent makes Google Fonts answer with woff2
+    get = lambda url: urllib.request.urlopen(urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 Chrome/120"}), timeout=30).read()
+    for name, url in (("chart.umd.js", CHART_JS_PINNED), ("kubernetes-icon.png", K8S_LOGO_URL)):
+        with open(os.path.join(vendor_dir, name), "wb") as f: f.write(get(url))
+        print(f"vendor/{name}")
+    for name, url in FONT_CSS.items():
+        css = get(url).decode()
+        for font_url in sorted(set(re.findall(r"url\((https://[^)]+)\)", css))):
+            data = get(font_url)
+            font = hashlib.sha256(data).hexdigest()[:16] + os.path.splitext(font_url)[1]
+            with open(os.path.join(vendor_dir, "fonts", font), "wb") as f: f.write(data)
+            css = css.replace(font_url, f"/assets/fonts/{font}")
+        with open(os.path.join(vendor_dir, name), "w") as f: f.write(css)
+        print(f"vendor/{name}")
+
+# --- NEW API ENDPOINTS FOR SETTINGS ---
+
+@app.route('/')
+def index(): return static_assets.build().page.response(immutable=False)
+
+@app.route('/assets/<path:name>')
+def serve_asset(name):
+    # Names are content-addressed, so a response never changes and can be cached for good
+    asset = static_assets.build().assets.get(name)
+    if not asset: return jsonify({"error": "Not found"}), 404
+    return asset.response(immutable=True)
+
+# Route instrumentation: every view is timed by its URL rule, and streamed responses count
+# as in flight until the server closes them.
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    profile = next((p for p in list(profiles.values()) if request.url_rule and p.route == request.url_rule.rule and p.claim()), None)
+    if profile: g.profile = profile
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profile = g.pop('profile', None)
+    if profile: profile.release()
+
+@app.after_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        HTTP_SECONDS.observe(elapsed, route, request.method, str(response.status_code))
+        timings = [f'{name};dur={total * 1000:.1f};desc="{count}x"' for name, (total, count) in g.get('spans', {}).items()]
+        response.headers['Server-Timing'] = ", ".join(timings + [f"total;dur={elapsed * 1000:.1f}"])
+    if response.is_streamed and request.url_rule:
+        HTTP_STREAMS.inc(route)
+        response.call_on_close(lambda: HTTP_STREAMS.dec(route))
+    return response
+
+# --- PROFILER ---
+class SamplingProfiler:
+    # Samples the stacks of the threads serving the next `requests` hits on `route` every
+    # `interval` seconds and keeps them in collapsed form ("frame;frame;frame count"),
+    # which flamegraph.pl and speedscope read directly.
+    def __init__(self, route, requests, interval):
+        self.id = uuid.uuid4().hex[:8]
+        self.route = route
+        self.requests = requests
+        self.interval = interval
+        self.claimed = 0
+        self.completed = 0
+        self.samples = 0
+        self.stacks = {}
+        self.created = time.time()
+        self.done = threading.Event()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+
+    def claim(self):
+        with self._lock:
+            if self.claimed >= self.requests: return False
+            self.claimed += 1
+            self._threads.add(threading.get_ident())
+            return True
+
+    def release(self):
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+            self.completed += 1
+            if self.completed >= self.requests: self.done.set()
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":"))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            with self._lock: threads = list(self._threads)
+            if not threads: continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None: continue
+                stack = self._collapse(frame)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items()))
+
+    def to_dict(self):
+        return {"id": self.id, "route": self.route, "requests": self.requests, "interval_ms": self.interval * 1000,
+                "claimed": self.claimed, "completed": self.completed, "samples": self.samples, "done": self.done.is_set()}
+
+profiles = {}
+
+def admin_denied():
+    # Admin endpoints need ZOPLETE_ADMIN_TOKEN set and sent back as X-Zoplete-Admin
+    if not ADMIN_TOKEN: return jsonify({"error": "Admin endpoints are disabled (set ZOPLETE_ADMIN_TOKEN)"}), 403
+    if not hmac.compare_digest(request.headers.get('X-Zoplete-Admin', ''), ADMIN_TOKEN): return jsonify({"error": "Forbidden"}), 403
+    return None
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    # {"route": "/api/marketplace", "requests": 5, "interval_ms": 5} profiles the next 5 hits on that URL rule
+    denied = admin_denied()
+    if denied: return denied
+    d = request.get_json(silent=True) or {}
+    route = d.get('route', '')
+    if route not in {rule.rule for rule in app.url_map.iter_rules()}: return jsonify({"error": f"Unknown route {route}"}), 400
+    try: count, interval = int(d.get('requests', 1)), float(d.get('interval_ms', 5))
+    except (TypeError, ValueError): return jsonify({"error": "requests and interval_ms must be numbers"}), 400
+    profile = SamplingProfiler(route, min(max(count, 1), 1000), min(max(interval, 1), 1000) / 1000)
+    for old in list(profiles.values())[:-19]:
+        old.done.set()
+        del profiles[old.id]
+    profiles[profile.id] = profile
+    return jsonify(profile.to_dict())
+
+@app.route('/api/admin/profile/<profile_id>')
+def api_admin_profile_status(profile_id):
+    denied = admin_denied()
+    if denied: return denied
+    profile = profiles.get(profile_id)
+    if not profile: return jsonify({"error": "Profile not found"}), 404
+    return jsonify(profile.to_dict())
+
+@app.route('/api/admin/profile/<profile_id>/collapsed')
+def api_admin_profile_collapsed(profile_id):
+    denied = admin_denied()
+    if denied: return denied
+    profile = profiles.get(profile_id)
+    if not profile: return jsonify({"error": "Profile not found"}), 404
+    return Response(profile.collapsed(), mimetype='text/plain',
+                    headers={"Content-disposition": f"attachment; filename=zoplete-{profile.id}.collapsed"})
+
+def cache_counts():
+    # (hits, misses) per cache; for the apply engine a skipped unchanged object is a hit
+    return {"marketplace": (marketplace_cache.hits, marketplace_cache.misses), "apply": (apply_engine.skipped, apply_engine.applied),
+            "join_token": (join_tokens.hits, join_tokens.minted)}
+
+def job_counts():
+    counts = {}
+    for job in list(jobs.jobs.values()): counts[(job.status,)] = counts.get((job.status,), 0) + 1
+    return counts
+
+prom.callback("zoplete_cache_hits_total", "Lookups answered from cache.", "counter", ("cache",),
+              lambda: {(name,): hits for name, (hits, _) in cache_counts().items()})
+prom.callback("zoplete_cache_misses_total", "Lookups that had to compute or fetch.", "counter", ("cache",),
+              lambda: {(name,): misses for name, (_, misses) in cache_counts().items()})
+INFORMERS = (node_informer, pod_informer)
+prom.callback("zoplete_informer_events_total", "Watch events received.", "counter", ("informer",),
+              lambda: {(i.name,): i.counters["events"] for i in INFORMERS})
+prom.callback("zoplete_informer_resyncs_total", "Relists after a failed or expired watch.", "counter", ("informer",),
+              lambda: {(i.name,): i.counters["resyncs"] for i in INFORMERS})
+prom.callback("zoplete_informer_staleness_seconds", "Seconds since the informer last heard from the API server.", "gauge", ("informer",),
+              lambda: {(i.name,): i.stats()["staleness_seconds"] for i in INFORMERS})
+prom.callback("zoplete_jobs", "Jobs currently tracked, by status.", "gauge", ("status",), job_counts)
+prom.callback("zoplete_metrics_stream_subscribers", "Clients subscribed to the metrics SSE stream.", "gauge", (),
+              lambda: {(): metrics_sampler.stream.subscribers})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(prom.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/api/init')
+def api_init():
+    ready = os.path.exists(KUBECONFIG_PATH)
+    return jsonify({"is_ready": ready, "os_info": host_facts.get("os")})
+
+@app.route('/api/host-facts')
+def api_host_facts():
+    return jsonify(host_facts.snapshot())
+
+@app.route('/api/preflight')
+def api_preflight():
+    role = request.args.get('role', 'master')
+    if role not in ("master", "worker"): return jsonify({"error": f"Unknown role {role}"}), 400
+    return jsonify(run_preflight(role))
+
+@app.route('/api/nodes')
+def api_nodes():
+    # Without ?limit the full list is returned, as before. With it: one page of
+    # {items, total, next_cursor}, filtered by status/role/q (name prefix), ordered by sort[&desc=1].
+    # Served from the informer, the ETag is the resourceVersion of the last change plus the query.
+    synced = node_informer.wait_synced(5)
+    tag = None
+    if synced:
+        query = hashlib.sha256(request.query_string).hexdigest()[:8]
+        tag = f"nodes-{node_informer.changed_version}-{query}"
+    if request.args.get('limit') is None: return conditional_json(lambda: node_informer.values() if synced else get_detailed_nodes(), tag)
+    sort = request.args.get('sort', 'name')
+    if sort not in NODE_SORT_KEYS: return jsonify({"error": f"Unknown sort key {sort}"}), 400
+    try:
+        args = dict(sort=sort, desc=request.args.get('desc') == '1', status=request.args.get('status'), role=request.args.get('role'),
+                    prefix=request.args.get('q', ''), limit=min(max(request.args.get('limit', type=int) or 100, 1), 1000),
+                    cursor=request.args.get('cursor'))
+        return conditional_json(lambda: node_index.query(rows=None if synced else get_detailed_nodes(), **args), tag)
+    except (ValueError, TypeError, binascii.Error): return jsonify({"error": "Invalid cursor"}), 400
+
+@app.route('/api/capacity')
+def api_capacity():
+    # Per node and cluster-wide allocatable / requested / limits / used. With ?cpu=500m&memory=1Gi,
+    # "fits" lists the Ready nodes that could still schedule a pod requesting that much.
+    if not (node_informer.wait_synced(5) and pod_informer.wait_synced(5)):
+        return jsonify({"error": "Cluster state is not loaded yet"}), 503
+    ask = None
+    if request.args.get('cpu') or request.args.get('memory'):
+        try: ask = resource_pair({"cpu": request.args.get('cpu') or 0, "memory": request.args.get('memory') or 0})
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+    metrics_sampler.start()
+    # Changes with the node and pod tables and with each metrics tick; concurrent viewers share one encoding
+    query = hashlib.sha256(request.query_string).hexdigest()[:8]
+    tag = f"capacity-{node_informer.changed_version}-{pod_informer.changed_version}-{metrics_sampler.ticks}-{query}"
+    return conditional_json(lambda: capacity_view(ask), tag)
+
+@app.route('/api/cache-stats')
+def api_cache_stats():
+    return jsonify({"nodes": node_informer.stats(), "pods": pod_informer.stats(), "marketplace": marketplace_cache.stats(), "apply": apply_engine.stats(), "join_token": join_tokens.stats(), "artifacts": artifacts.stats(), "tsdb": tsdb.stats()})
+
+@app.route('/api/nodes/<name>', methods=['DELETE'])
+def api_delete_node(name):
+    run_shell_cmd(f"kubectl delete node {name}")
+    return jsonify({"status": "ok"})
+
+@app.route('/api/install-master', methods=['POST'])
+def api_install_master():
+    # Steps already checkpointed (and still satisfied) are skipped; {"force": true} starts over
+    d = request.get_json(silent=True) or {}
+    family = host_facts.get("os")["FAMILY"]
+    if d.get('force'): bootstrap_checkpoints.clear()
+    job = jobs.submit("install-master", func=lambda job: bootstrap_master(job, family, preflight=not d.get('skip_preflight')), timeout=3600)
+    return jsonify({"status": "ok", "job_id": job.id})
+
+@app.route('/api/install-master/steps')
+def api_install_master_steps():
+    return jsonify(bootstrap_checkpoints.status(host_facts.get("os")["FAMILY"]))
+
+@app.route('/api/marketplace')
+def api_marketplace():
+    try: return conditional_json(lambda: marketplace_cache.get(collect_marketplace))
+    except Exception as e:
+        return jsonify({"flux_installed": True, "catalog": MARKETPLACE_CATALOG, "installed_apps": [], "services": {}, "error": str(e)}), 503
 
 @app.route('/api/install-flux', methods=['POST'])
 def api_install_flux():
-    run_shell_cmd("curl -s https://fluxcd.io/install.sh | sudo bash && flux install")
-    return jsonify({"status": "ok"})
+    def done(job):
+        flux_probe.reset()
+        marketplace_cache.invalidate()
+    job = jobs.submit("install-flux", cmd="curl -s https://fluxcd.io/install.sh | sudo bash && flux install", timeout=900, on_done=done)
+    return jsonify({"status": "ok", "job_id": job.id})
 
 @app.route('/api/install-app', methods=['POST'])
 def api_install_app():
     key = request.json['app_key']
-    success, output = install_app_logic(key)
-    return jsonify({"status": "ok" if success else "error", "error": output})
+    if key not in MARKETPLACE_CATALOG: return jsonify({"status": "error", "error": f"Unknown app {key}"}), 400
+    job = jobs.submit(f"install-app:{key}", func=lambda job: job.record(*install_app_logic(key)), timeout=300,
+                      on_done=lambda job: marketplace_cache.invalidate())
+    return jsonify({"status": "ok", "job_id": job.id})
+
+@app.route('/api/install-apps', methods=['POST'])
+def api_install_apps():
+    try: plan = resolve_stack(request.json['app_keys'])
+    except ValueError as e: return jsonify({"status": "error", "error": str(e)}), 400
+    if not plan: return jsonify({"status": "error", "error": "No apps selected"}), 400
+    job = jobs.submit("install-stack:" + ",".join(plan), func=lambda job: install_stack(job, plan), timeout=3600)
+    return jsonify({"status": "ok", "job_id": job.id, "plan": plan})
+
+@app.route('/api/apps/<key>/wait')
+def api_app_wait(key):
+    # Holds the request until the app is Ready (with its NodePort), Failed, gone
+    # (?for=uninstalled) or the deadline passes.
+    if key not in MARKETPLACE_CATALOG: return jsonify({"error": f"Unknown app {key}"}), 404
+    timeout = min(request.args.get('timeout', type=float) or 120, 300)
+    deadline = time.monotonic() + timeout
+    port = None
+    try:
+        if request.args.get('for') == 'uninstalled':
+            state, message = wait_helmrelease(key, timeout, until=("Missing",))
+            if state == "Missing": state = "Uninstalled"
+        else:
+            state, message = wait_helmrelease(key, timeout)
+            svc = MARKETPLACE_CATALOG[key]['ui_svc']
+            if state == "Ready" and svc:
+                port = wait_node_port(svc, max(deadline - time.monotonic(), 1))
+                if not port: state = "Timeout"
+    except Exception as e: state, message = "Error", str(e)
+    # Only drop the cached marketplace view if it disagrees with what we just observed
+    cached = marketplace_cache.peek()
+    if cached is not None:
+        installed = key in cached["installed_apps"]
+        if (state == "Ready" and (not installed or cached["services"].get(key) != port)) or (state == "Uninstalled" and installed):
+            marketplace_cache.invalidate()
+    return jsonify({"app": key, "state": state, "message": message, "port": port})
 
 @app.route('/api/uninstall-app', methods=['POST'])
 def api_uninstall_app():
     key = request.json['app_key']
-    success, output = run_shell_cmd(f"kubectl delete helmrelease -n flux-system {key} --ignore-not-found=true")
+    success, output = apply_engine.delete("helm.toolkit.fluxcd.io/v2", "HelmRelease", "flux-system", key)
+    marketplace_cache.invalidate()
     return jsonify({"status": "ok" if success else "error", "error": output})
 
 @app.route('/api/git-sources')
@@ -1087,9 +4222,9 @@ def api_git_sources():
     # Helper logic inlined
     try:
         cmd = "kubectl get gitrepositories -A -o json"
-        res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, text=True)
+        res = run_process(cmd, shell=True, stdout=subprocess.PIPE, text=True)
         if res.returncode != 0: return jsonify([])
-        data = yaml.safe_load(res.stdout)
+        with span("parse"): data = yaml.safe_load(res.stdout)
         sources = []
         for item in data.get('items', []):
             status = "Unknown"
@@ -1097,16 +4232,16 @@ def api_git_sources():
                 for c in item['status']['conditions']:
                     if c['type'] == 'Ready': status = "Ready" if c['status'] == "True" else "Failed"
             sources.append({"Name": item['metadata']['name'], "URL": item['spec']['url'], "Status": status})
-        return jsonify(sources)
+        return conditional_json(lambda: sources)
     except: return jsonify([])
 
 @app.route('/api/kustomizations')
 def api_kustomizations():
     try:
         cmd = "kubectl get kustomizations -A -o json"
-        res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, text=True)
+        res = run_process(cmd, shell=True, stdout=subprocess.PIPE, text=True)
         if res.returncode != 0: return jsonify([])
-        data = yaml.safe_load(res.stdout)
+        with span("parse"): data = yaml.safe_load(res.stdout)
         kusts = []
         for item in data.get('items', []):
             status = "Unknown"
@@ -1115,22 +4250,20 @@ def api_kustomizations():
                 for c in item['status']['conditions']:
                     if c['type'] == 'Ready': status = "Ready" if c['status'] == "True" else "Failed"
             kusts.append({"Name": item['metadata']['name'], "Path": item['spec']['path'], "Source": item['spec']['sourceRef']['name'], "Status": status, "Revision": revision})
-        return jsonify(kusts)
+        return conditional_json(lambda: kusts)
     except: return jsonify([])
 
 @app.route('/api/create-source', methods=['POST'])
 def api_create_source():
     d = request.json
-    cmd = f"flux create source git {d['name']} --url={d['url']} --branch={d['branch']} --interval=1m --export > /tmp/{d['name']}.yaml && kubectl apply -f /tmp/{d['name']}.yaml"
-    run_shell_cmd(cmd)
-    return jsonify({"status": "ok"})
+    success, output = apply_engine.apply([git_repository_obj(d['name'], d['url'], d['branch'])])
+    return jsonify({"status": "ok" if success else "error", "error": output})
 
 @app.route('/api/create-kust', methods=['POST'])
 def api_create_kust():
     d = request.json
-    cmd = f"flux create kustomization {d['name']} --source={d['source']} --path={d['path']} --prune=true --interval=5m --export > /tmp/{d['name']}.yaml && kubectl apply -f /tmp/{d['name']}.yaml"
-    run_shell_cmd(cmd)
-    return jsonify({"status": "ok"})
+    success, output = apply_engine.apply([kustomization_obj(d['name'], d['source'], d['path'])])
+    return jsonify({"status": "ok" if success else "error", "error": output})
 
 @app.route('/api/sync-kust', methods=['POST'])
 def api_sync_kust():
@@ -1139,45 +4272,334 @@ def api_sync_kust():
 
 @app.route('/api/metrics')
 def api_metrics():
-    has_metrics = run_shell_cmd("kubectl get apiservice v1beta1.metrics.k8s.io")[0]
-    metrics_data = []
-    network_data = {"sent": 0, "recv": 0}
-    if has_metrics:
-        try:
-            cust = client.CustomObjectsApi()
-            data = cust.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
-            for item in data['items']:
-                cpu = item['usage']['cpu']
-                mem = item['usage']['memory']
-                cpu_val = float(cpu.replace('n',''))/1e9 if 'n' in cpu else float(cpu.replace('m',''))/1000
-                mem_val = float(mem.replace('Ki','')) / 1024
-                metrics_data.append({"Name": item['metadata']['name'], "CPU (cores)": cpu_val, "Memory (MiB)": mem_val})
-        except: pass
+    metrics_sampler.start().sampled.wait(5)
+    return jsonify(metrics_sampler.latest)
+
+@app.route('/api/metrics/history')
+def api_metrics_history():
+    metrics_sampler.start().sampled.wait(5)
+    since = request.args.get('since', type=float) or 0
+    return jsonify(metrics_sampler.history(since=since, node=request.args.get('node')))
+
+@app.route('/api/metrics/workloads')
+def api_metrics_workloads():
+    # Per-namespace / per-HelmRelease usage and the top pods by CPU and memory, as of the last tick
+    metrics_sampler.start().sampled.wait(5)
+    return jsonify({"has_metrics": metrics_sampler.has_metrics, **metrics_sampler.workloads})
+
+@app.route('/api/metrics/pods')
+def api_metrics_pods():
+    node = request.args.get('node')
+    if not node: return jsonify({"error": "Pass node"}), 400
+    metrics_sampler.start().sampled.wait(5)
+    return jsonify({"node": node, "pods": metrics_sampler.node_pods(node)})
+
+@app.route('/api/metrics/aggregate')
+def api_metrics_aggregate():
+    # ?points=150&k=5&by=cpu|memory[&since=ts]
+    metrics_sampler.start().sampled.wait(5)
+    by = request.args.get('by', 'cpu')
+    if by not in ("cpu", "memory"): return jsonify({"error": f"Unknown metric {by}"}), 400
+    return jsonify(metrics_sampler.aggregate(since=request.args.get('since', type=float) or 0,
+                                             points=min(max(request.args.get('points', type=int) or 150, 3), 2000),
+                                             k=min(max(request.args.get('k', type=int) or 5, 0), 20), by=by))
+
+@app.route('/api/metrics/range')
+def api_metrics_range():
+    # ?start=ts&end=ts&points=150[&node=name] from the on-disk store; without node, the
+    # cluster aggregates. Unlike /history this reaches back days or months.
     try:
-        net = psutil.net_io_counters()
-        network_data = { "sent": net.bytes_sent/1024/1024, "recv": net.bytes_recv/1024/1024 }
-    except: pass
-    return jsonify({"has_metrics": has_metrics, "metrics": metrics_data, "network": network_data})
+        end = float(request.args['end']) if 'end' in request.args else time.time()
+        start = float(request.args['start']) if 'start' in request.args else end - 3600
+        points = int(request.args['points']) if 'points' in request.args else 150
+    except ValueError: return jsonify({"error": "start and end must be numbers, points an integer"}), 400
+    if not (math.isfinite(start) and math.isfinite(end)): return jsonify({"error": "start and end must be finite"}), 400
+    if start >= end: return jsonify({"error": "start must be before end"}), 400
+    if points <= 0: return jsonify({"error": "points must be positive"}), 400
+    node = request.args.get('node')
+    labels = {node: f"node:{node}:%s"} if node else {stat: f"cluster:%s:{stat}" for stat in AGGREGATE_STATS}
+    names = [pattern % metric for pattern in labels.values() for metric in ("cpu", "mem")] + ["network:sent", "network:recv"]
+    data = tsdb.query(names, start, end, points=min(points, 2000))
+    rounded = lambda name, digits: [None if v is None else round(v, digits) for v in data["series"][name]["mean"]]
+    return jsonify({"tier": data["tier"], "step": data["step"], "ts": data["ts"],
+                    "cpu": {label: rounded(pattern % "cpu", 4) for label, pattern in labels.items()},
+                    "mem": {label: rounded(pattern % "mem", 1) for label, pattern in labels.items()},
+                    "network": {"sent": rounded("network:sent", 4), "recv": rounded("network:recv", 4)}})
+
+@app.route('/api/metrics/stream')
+def api_metrics_stream():
+    metrics_sampler.start()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+    return Response(metrics_sampler.stream.subscribe(last_id), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/api/install-metrics', methods=['POST'])
 def api_install_metrics():
-    run_shell_cmd("kubectl apply -f https://github.com/kubernetes-sigs/metrics-server/releases/latest/download/components.yaml")
-    run_shell_cmd("kubectl patch deployment metrics-server -n kube-system --type='json' -p='[{\"op\": \"add\", \"path\": \"/spec/template/spec/containers/0/args/-\", \"value\": \"--kubelet-insecure-tls\"}]'")
-    return jsonify({"status": "ok"})
+    cmd = ("kubectl apply -f https://github.com/kubernetes-sigs/metrics-server/releases/latest/download/components.yaml && "
+           "kubectl patch deployment metrics-server -n kube-system --type='json' -p='[{\"op\": \"add\", \"path\": \"/spec/template/spec/containers/0/args/-\", \"value\": \"--kubelet-insecure-tls\"}]'")
+    job = jobs.submit("install-metrics", cmd=cmd, timeout=300, on_done=lambda job: metrics_sampler.recheck())
+    return jsonify({"status": "ok", "job_id": job.id})
+
+@app.route('/api/jobs')
+def api_jobs():
+    return jsonify(jobs.list())
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = jobs.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    wait = min(request.args.get('wait', type=float) or 0, 60)
+    if wait: job.done.wait(wait)
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/log')
+def api_job_log(job_id):
+    # Returns the log from ?offset= on; with ?follow=1 keeps streaming until the job ends.
+    # X-Log-Offset tells a reconnecting client where to resume.
+    job = jobs.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    offset = max(request.args.get('offset', type=int) or 0, 0)
+    if not request.args.get('follow'):
+        with open(job.log_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        return Response(data, mimetype='text/plain', headers={"X-Log-Offset": str(offset + len(data)), "X-Job-Status": job.status})
+    def generate():
+        with open(job.log_path, "rb") as f:
+            f.seek(offset)
+            while True:
+                finished = job.done.is_set()
+                chunk = f.read(65536)
+                if chunk: yield chunk
+                elif finished: break
+                else: job.done.wait(0.25)
+    return Response(generate(), mimetype='text/plain', headers={"X-Job-Status": job.status, "X-Accel-Buffering": "no"})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    job = jobs.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    job.cancel()
+    return jsonify(job.to_dict())
+
+@app.route('/artifacts/<family>/<path:name>')
+def serve_artifact(family, name):
+    if family not in WORKER_FAMILIES: return jsonify({"error": f"Unsupported OS family {family}"}), 404
+    resp = send_from_directory(os.path.abspath(artifacts.path(family)), name, conditional=True)
+    artifacts.served += 1
+    artifacts.served_bytes += resp.content_length or 0
+    return resp
+
+@app.route('/api/artifacts')
+def api_artifacts():
+    return jsonify(artifacts.stats())
+
+@app.route('/api/artifacts/build', methods=['POST'])
+def api_artifacts_build():
+    # Downloads are only possible for this host's own family; other families can be filled
+    # by copying packages into their directory and posting {"family": ..., "reindex": true}.
+    d = request.get_json(silent=True) or {}
+    local_family = host_facts.get("os")["FAMILY"]
+    family = d.get('family') or local_family
+    reindex = bool(d.get('reindex'))
+    if family not in WORKER_FAMILIES: return jsonify({"status": "error", "error": f"Unsupported OS family {family}"}), 400
+    if not reindex and family != local_family:
+        return jsonify({"status": "error", "error": f"Cannot download {family} packages on this host; copy them into {artifacts.path(family)} and reindex"}), 400
+    job = jobs.submit(f"artifacts:{family}", func=lambda job: artifacts.build(job, family, download=not reindex), timeout=1800)
+    return jsonify({"status": "ok", "job_id": job.id})
 
 @app.route('/api/download-worker')
 def api_download_worker():
-    # We need get_join_details logic from previous iteration
-    res, _ = get_join_details()
-    if not res: return "Error", 500
-    
-    if request.args.get('type') == 'yaml':
-        # generate cloud-init
-        # (Simplified logic from previous file reused here)
-        return Response("Cloud-Init content...", mimetype='text/yaml', headers={"Content-disposition": "attachment; filename=worker-user-data.yaml"})
-    else:
-        # generate bash
-        return Response("Bash content...", mimetype='text/x-sh', headers={"Content-disposition": "attachment; filename=worker-setup.sh"})
+    family = request.args.get('os', 'debian')
+    if family not in WORKER_FAMILIES: return jsonify({"error": f"Unsupported OS family {family}"}), 400
+    try:
+        if request.args.get('type') == 'yaml':
+            return Response(join_tokens.rendered(family, "yaml"), mimetype='text/yaml', headers={"Content-disposition": "attachment; filename=worker-user-data.yaml"})
+        return Response(join_tokens.rendered(family, "sh"), mimetype='text/x-sh', headers={"Content-disposition": "attachment; filename=worker-setup.sh"})
+    except RuntimeError as e: return jsonify({"error": str(e)}), 500
+
+@app.route('/api/fleet/bootstrap', methods=['POST'])
+def api_fleet_bootstrap():
+    d = request.json
+    try:
+        hosts = parse_inventory(d.get('inventory', ''), d.get('user') or 'root', int(d.get('port') or 22), d.get('os') or 'debian')
+        join_tokens.get()
+    except (ValueError, RuntimeError) as e: return jsonify({"status": "error", "error": str(e)}), 400
+    if not hosts: return jsonify({"status": "error", "error": "Inventory is empty"}), 400
+    run = FleetRun(hosts, concurrency=min(int(d.get('concurrency') or 10), 100), retries=int(d.get('retries', 2)))
+    job = start_fleet_run(run)
+    return jsonify({"status": "ok", "run_id": run.job_ids[0], "job_id": job.id})
+
+@app.route('/api/fleet/<run_id>')
+def api_fleet_run(run_id):
+    run = fleet_runs.get(run_id)
+    if not run: return jsonify({"error": "Fleet run not found"}), 404
+    return jsonify({"run_id": run_id, "job_ids": run.job_ids, "hosts": [h.to_dict() for h in run.hosts]})
+
+@app.route('/api/fleet/<run_id>/retry', methods=['POST'])
+def api_fleet_retry(run_id):
+    # Re-runs only the hosts that have not joined yet, skipping their finished phases
+    run = fleet_runs.get(run_id)
+    if not run: return jsonify({"error": "Fleet run not found"}), 404
+    last = jobs.get(run.job_ids[-1])
+    if last and not last.done.is_set(): return jsonify({"status": "error", "error": "Fleet run is still in progress"}), 409
+    job = start_fleet_run(run)
+    return jsonify({"status": "ok", "run_id": run_id, "job_id": job.id})
+
+@app.route('/api/download-worker/bulk')
+def api_download_worker_bulk():
+    # ?hosts=a,b,c or ?count=N[&prefix=worker]
+    family = request.args.get('os', 'debian')
+    if family not in WORKER_FAMILIES: return jsonify({"error": f"Unsupported OS family {family}"}), 400
+    hosts = [h for h in re.split(r"[,\s]+", request.args.get('hosts', '')) if h]
+    if not hosts:
+        count = min(request.args.get('count', type=int) or 0, 500)
+        prefix = request.args.get('prefix', 'worker')
+        hosts = [f"{prefix}-{i:02d}" for i in range(1, count + 1)]
+    if not hosts: return jsonify({"error": "Pass hosts or count"}), 400
+    if any(not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9.-]{0,252}", h) for h in hosts): return jsonify({"error": "Invalid hostname"}), 400
+    try: data = worker_bundle(family, hosts)
+    except RuntimeError as e: return jsonify({"error": str(e)}), 500
+    return Response(data, mimetype='application/gzip', headers={"Content-disposition": f"attachment; filename=zoplete-workers-{family}.tar.gz"})
+
+# --- SERVER ---
+# Long-lived responses: log follows, SSE, and the ?wait= long polls. They get their own pool
+# so a dashboard full of open streams cannot take the threads short API calls need.
+STREAM_PATHS = re.compile(r"^(?:GET|HEAD) /api/(?:metrics/stream|jobs/[^/ ?]+/log|apps/[^/ ?]+/wait|jobs/[^/ ?]+\?\S*wait=)")
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection, so an idle keep-alive socket never pins a pool thread
+    protocol_version = "HTTP/1.0"
+
+class PooledWSGIServer(BaseWSGIServer):
+    # Werkzeug server whose connections run on two bounded thread pools, picked by
+    # peeking at the request line: `threads` for the API, `stream_threads` for STREAM_PATHS.
+    # The peek happens on one selector thread, so a client that connects and then sends
+    # nothing (or trickles its request line) holds a selector slot, never a pool worker.
+    multithread = True
+
+    def __init__(self, host, port, app, threads=16, stream_threads=32, classify_timeout=10):
+        super().__init__(host, port, app, handler=RequestHandler)
+        self.pools = {"api": ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http"),
+                      "stream": ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix="http-stream")}
+        self.classify_timeout = classify_timeout
+        self.streams = set()
+        self.closing = False
+        self._incoming = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._classifier = threading.Thread(target=self._classify, name="http-classify", daemon=True)
+        self._classifier.start()
+
+    def _wake(self):
+        try: self._wake_w.send(b"\0")
+        except OSError: pass  # buffer full: a wake-up is already pending
+
+    def process_request(self, request, client_address):
+        with self._lock: self._incoming.append((request, client_address))
+        self._wake()
+
+    def _classify(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        pending = {}  # socket -> (client_address, deadline)
+        retry = []    # sockets holding a partial request line, re-armed on the next pass
+        while not self.closing:
+            for key, _ in selector.select(0.05 if retry else 1):
+                request = key.fileobj
+                if request is self._wake_r:
+                    try: self._wake_r.recv(4096)
+                    except OSError: pass
+                    continue
+                try: head = request.recv(1024, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+                except BlockingIOError: continue
+                except OSError: head = b""
+                selector.unregister(request)
+                if head and b"\n" not in head and len(head) < 1024:
+                    retry.append(request)  # readable until more arrives; level-triggered, so do not spin on it
+                    continue
+                client_address, _ = pending.pop(request)
+                if not head:
+                    self.shutdown_request(request)
+                    continue
+                stream = bool(STREAM_PATHS.match(head.decode("latin-1")))
+                self.pools["stream" if stream else "api"].submit(self._handle, request, client_address, stream)
+            with self._lock: incoming, self._incoming = self._incoming, []
+            now = time.monotonic()
+            for request, client_address in incoming: pending[request] = (client_address, now + self.classify_timeout)
+            for request in retry + [r for r, _ in incoming]: selector.register(request, selectors.EVENT_READ)
+            retry = []
+            for request in [r for r, (_, deadline) in pending.items() if deadline < now]:
+                selector.unregister(request)
+                del pending[request]
+                self.shutdown_request(request)
+        for request in pending: self.shutdown_request(request)
+        selector.close()
+
+    def _handle(self, request, client_address, stream):
+        if self.closing: return self.shutdown_request(request)
+        if stream:
+            with self._lock: self.streams.add(request)
+        try: self.finish_request(request, client_address)
+        except Exception: self.handle_error(request, client_address)
+        finally:
+            if stream:
+                with self._lock: self.streams.discard(request)
+            self.shutdown_request(request)
+
+    def close_streams(self):
+        # Open streams never end by themselves; closing the sockets makes their writes fail
+        with self._lock: streams = list(self.streams)
+        for request in streams:
+            try: request.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+    def drain(self):
+        # Called once serve_forever has returned: queued connections are dropped, running ones finish
+        self.closing = True
+        self._wake()
+        self.close_streams()
+        for pool in self.pools.values(): pool.shutdown(wait=True, cancel_futures=True)
+
+def serve(host, port, threads, stream_threads, drain_timeout):
+    # Production entry point. One process on purpose: jobs, informers, caches and metric
+    # history live in memory and would diverge across worker processes.
+    server = PooledWSGIServer(host, port, app, threads=threads, stream_threads=stream_threads)
+
+    def stop(signum, frame):
+        print(f"Received signal {signum}, shutting down", flush=True)
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Zoplete serving on http://{host}:{port} ({threads} API threads, {stream_threads} stream threads)", flush=True)
+    server.serve_forever()
+    finished, cancelled = jobs.drain(drain_timeout)
+    print(f"Jobs drained: {finished} finished, {cancelled} cancelled", flush=True)
+    metrics_sampler.stream.close()
+    server.drain()
+    tsdb.close()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Zoplete Kubernetes manager")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("ZOPLETE_THREADS", "16")), help="threads for API requests")
+    parser.add_argument("--stream-threads", type=int, default=int(os.environ.get("ZOPLETE_STREAM_THREADS", "32")),
+                        help="threads for streaming and long-poll requests")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.environ.get("ZOPLETE_DRAIN_TIMEOUT", "300")),
+                        help="seconds running jobs get to finish on shutdown before they are cancelled")
+    parser.add_argument("--dev", action="store_true", help="run the Flask debug server with the reloader instead")
+    parser.add_argument("--fetch-vendor", action="store_true", help=f"download CDN assets into {VENDOR_DIR} and exit")
+    args = parser.parse_args()
+    if args.fetch_vendor:
+        fetch_vendor()
+        raise SystemExit(0)
+    static_assets.build()
+    host_facts.start()
+    SERVER_ADDRESS = (args.host, args.port)
+    if args.dev: app.run(host=args.host, port=args.port, debug=True, threaded=True)
+    else: serve(args.host, args.port, args.threads, args.stream_threads, args.drain_timeout)
\ No newline at end of file